@@ -0,0 +1,77 @@
+"""
+Benchmark the restricted code compiler against utils.run_code on the coded CSVs.
+
+We run every code translation with run_code, then with run_compiled_code (first with an empty
+program cache, then with the compiled programs cached), and check that both return exactly the
+same graphs, and fail on the same translations (with different error messages, since
+run_compiled_code doesn't exec the code that it can't compile).
+"""
+
+import time
+from argparse import ArgumentParser
+import networkx as nx
+from src.preproc.arithmetic import operation_is_correct
+from src.preproc.utils import run_code
+from src.preproc.code_compiler import (
+    compile_code,
+    compile_preprocessed_code,
+    run_compiled_code,
+)
+from scripts.benchmark_utils import load_codes
+
+
+def time_runs(codes, run_fn, for_pretraining):
+    start_time = time.perf_counter()
+    results = [run_fn(code, for_pretraining=for_pretraining) for code in codes]
+    return results, time.perf_counter() - start_time
+
+
+def same_result(result, other_result):
+    if isinstance(result, str) or isinstance(other_result, str):
+        return isinstance(result, str) and isinstance(other_result, str)
+    return (
+        nx.utils.graphs_equal(result.G, other_result.G)
+        and result.actions == other_result.actions
+        and result.node_visitation_timestep == other_result.node_visitation_timestep
+        and result.op_timestep == other_result.op_timestep
+    )
+
+
+def count_uncompiled(codes, for_pretraining):
+    n_uncompiled = 0
+    for code in codes:
+        try:
+            compile_code(code, for_pretraining)
+        except Exception:
+            n_uncompiled += 1
+    return n_uncompiled
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pattern", default="data/coded/*/*.csv")
+    parser.add_argument("--for_pretraining", action="store_true")
+    args = parser.parse_args()
+
+    codes = load_codes(args.pattern)
+    print(f"Running {len(codes)} code translations")
+
+    results, run_code_time = time_runs(codes, run_code, args.for_pretraining)
+    # time the graph building itself from a cold start too, rather than from run_code's memoized
+    # operation checks
+    operation_is_correct.cache_clear()
+    compile_preprocessed_code.cache_clear()
+    compiled_results, cold_time = time_runs(codes, run_compiled_code, args.for_pretraining)
+    _, warm_time = time_runs(codes, run_compiled_code, args.for_pretraining)
+
+    print(f"run_code: {run_code_time:.3f}s")
+    print(f"run_compiled_code (empty program cache): {cold_time:.3f}s")
+    print(f"run_compiled_code (cached programs): {warm_time:.3f}s")
+    print(
+        f"Translations that can't be compiled: {count_uncompiled(codes, args.for_pretraining)}"
+    )
+    n_mismatches = sum(
+        not same_result(result, compiled_result)
+        for result, compiled_result in zip(results, compiled_results)
+    )
+    print(f"Results that differ from run_code: {n_mismatches}")
@@ -0,0 +1,68 @@
+"""
+Benchmark the compact GraphBuilder backend against the networkx-backed GraphBuilder on the IRR coded CSVs.
+
+For each backend, we build a graph from every code translation (model and human annotations), and
+measure the build time and the memory retained by the graphs. We also check that both backends
+produce identical networkx graphs.
+"""
+
+import time
+import tracemalloc
+from argparse import ArgumentParser
+import networkx as nx
+from src.preproc.reasoning_graph import GraphBuilder
+from src.preproc.compact_graph import CompactGraphBuilder
+from src.preproc.utils import run_code
+from scripts.benchmark_utils import load_codes
+
+
+def build_graphs(codes, graph_builder_cls):
+    """Build every graph, returning the graphs, the build time and the retained memory"""
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    graphs = [
+        run_code(code, for_pretraining=False, graph_builder_cls=graph_builder_cls)
+        for code in codes
+    ]
+    build_time = time.perf_counter() - start_time
+    retained_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return graphs, build_time, retained_memory
+
+
+def check_parity(graphs, compact_graphs):
+    n_mismatches = 0
+    for graph, compact_graph in zip(graphs, compact_graphs):
+        if isinstance(graph, str) or isinstance(compact_graph, str):
+            n_mismatches += isinstance(graph, str) != isinstance(compact_graph, str)
+        elif not nx.utils.graphs_equal(graph.G, compact_graph.G):
+            n_mismatches += 1
+    return n_mismatches
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pattern", default="data/coded/irr/irr_model-*.csv")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    codes = load_codes(args.pattern)
+    print(f"Building {len(codes)} graphs per backend ({args.repeats} repeats)")
+
+    for name, graph_builder_cls in [
+        ("GraphBuilder", GraphBuilder),
+        ("CompactGraphBuilder", CompactGraphBuilder),
+    ]:
+        results = [build_graphs(codes, graph_builder_cls) for _ in range(args.repeats)]
+        graphs = results[-1][0]
+        n_failed = sum(isinstance(graph, str) for graph in graphs)
+        best_time = min(result[1] for result in results)
+        retained_memory = results[-1][2]
+        print(
+            f"{name}: best build time {best_time:.3f}s, "
+            f"retained memory {retained_memory / 1e6:.2f} MB, {n_failed} failed to run"
+        )
+        if graph_builder_cls is GraphBuilder:
+            reference_graphs = graphs
+
+    print(f"Graphs that differ between backends: {check_parity(reference_graphs, graphs)}")
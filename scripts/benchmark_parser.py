@@ -0,0 +1,106 @@
+"""
+Benchmark the operation parsers on every operation in the coded CSVs.
+
+We run every code translation to collect the explore_operation actions, then measure how many
+operations per second tokenize, get_sub_operations, is_op_well_formatted, can_run_from_curr_state
+and get_resulting_state get through: first with empty parser caches, then with every operation
+already parsed (the same operations come up many times across participants and annotators).
+"""
+
+import contextlib
+import io
+import time
+from argparse import ArgumentParser
+from src.preproc import arithmetic, reasoning_graph_utils
+from src.preproc.code_checking_tools import (
+    can_run_from_curr_state,
+    get_resulting_state,
+    is_op_well_formatted,
+)
+from src.preproc.code_compiler import run_compiled_code
+from src.preproc.reasoning_graph_utils import get_sub_operations, tokenize
+from scripts.benchmark_utils import load_codes
+
+
+def load_operations(codes):
+    """The start state and explore_operation action of every operation in the code translations"""
+    operations = []
+    for code in codes:
+        graph = run_compiled_code(code, for_pretraining=False)
+        if isinstance(graph, str):
+            continue
+        start_state = graph.actions[0]["state"]
+        operations.extend(
+            (start_state, action)
+            for action in graph.actions
+            if action["type"] == "explore_operation"
+        )
+    return operations
+
+
+def clear_caches():
+    reasoning_graph_utils.tokenize_cached.cache_clear()
+    reasoning_graph_utils.get_sub_operations_cached.cache_clear()
+    arithmetic.parse_expression.cache_clear()
+    arithmetic.parse_number.cache_clear()
+    arithmetic.evaluate.cache_clear()
+
+
+def get_benchmarks():
+    """A function for each parser, taking a start state and an explore_operation action"""
+    return {
+        "tokenize": lambda start_state, action: tokenize(lhs(action)),
+        "get_sub_operations": lambda start_state, action: get_sub_operations(lhs(action)),
+        "is_op_well_formatted": lambda start_state, action: is_op_well_formatted(
+            action["operation"]
+        ),
+        "can_run_from_curr_state": lambda start_state, action: can_run_from_curr_state(
+            action["curr_state"],
+            action["operation"],
+            start_state,
+            action["resulting_state"],
+        ),
+        "get_resulting_state": lambda start_state, action: get_resulting_state(
+            action["curr_state"], action["operation"], action["result_calc_error"]
+        ),
+    }
+
+
+def lhs(action):
+    return action["operation"][: action["operation"].rfind("=")]
+
+
+def ops_per_second(operations, fn, repeats):
+    """The best throughput over `repeats` passes. Errors count as parsed operations."""
+    best_time = float("inf")
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        # get_resulting_state prints the operations it can't compute
+        with contextlib.redirect_stdout(io.StringIO()):
+            for start_state, action in operations:
+                try:
+                    fn(start_state, action)
+                except Exception:
+                    pass
+        best_time = min(best_time, time.perf_counter() - start_time)
+    return len(operations) / best_time
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pattern", default="data/coded/*/*.csv")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    operations = load_operations(load_codes(args.pattern))
+    n_unique = len({action["operation"] for _, action in operations})
+    print(f"Parsing {len(operations)} operations ({n_unique} unique)")
+
+    print(f"{'':<25} {'empty caches':>15} {'cached':>15}")
+    for name, fn in get_benchmarks().items():
+        cold_throughput = 0
+        for _ in range(args.repeats):
+            clear_caches()
+            cold_throughput = max(cold_throughput, ops_per_second(operations, fn, 1))
+        warm_throughput = ops_per_second(operations, fn, args.repeats)
+        print(f"{name:<25} {cold_throughput:>11,.0f} op/s {warm_throughput:>11,.0f} op/s")
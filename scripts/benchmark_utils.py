@@ -0,0 +1,21 @@
+"""
+Helpers shared by the benchmark scripts.
+"""
+
+from glob import glob
+import pandas as pd
+from pyprojroot import here
+
+# the columns of the coded CSVs that hold code translations
+CODE_COLUMNS = ["lm_code_translation", "ben_annotation", "ced_annotation"]
+
+
+def load_codes(pattern):
+    """Every code translation in the CSVs that match a glob pattern (relative to the project root)"""
+    codes = []
+    for filepath in sorted(glob(str(here(pattern)))):
+        df = pd.read_csv(filepath)
+        for column in CODE_COLUMNS:
+            if column in df.columns:
+                codes.extend(code for code in df[column] if isinstance(code, str))
+    return codes
@@ -3,7 +3,8 @@ import pandas as pd
 from pyprojroot import here
 import submitit
 import networkx as nx
-from src.preproc.utils import unnormalized_graph_edit_distance, run_code
+from src.preproc.utils import unnormalized_graph_edit_distance
+from src.preproc.graph_store import GraphStore
 from argparse import ArgumentParser
 import time
 import os
@@ -72,16 +73,16 @@ slurm_params = {
 }
 
 
-def submit_model_jobs(model, timeout):
+def submit_model_jobs(model, timeout, graph_store):
     """
-    Create submitit jobs for a given model.
+    Create submitit jobs for a given model, loading the graphs from the graph store.
     """
     print(f"Submitting jobs for model: {model}")
     df = pd.read_csv(here(f"data/coded/irr/irr_model-{model}.csv"))
 
-    df["ben_graph"] = df["ben_annotation"].apply(run_code)
-    df["ced_graph"] = df["ced_annotation"].apply(run_code)
-    df["model_graph"] = df["lm_code_translation"].apply(run_code)
+    df["ben_graph"] = graph_store.run_many(df["ben_annotation"])
+    df["ced_graph"] = graph_store.run_many(df["ced_annotation"])
+    df["model_graph"] = graph_store.run_many(df["lm_code_translation"])
 
     executor = submitit.AutoExecutor(folder=here("scripts/submitit"))
     executor.update_parameters(**slurm_params)
@@ -110,12 +111,12 @@ def submit_model_jobs(model, timeout):
     return df
 
 
-def submit_human_jobs(timeout):
+def submit_human_jobs(timeout, graph_store):
     print("Submitting human jobs...")
     df = pd.read_csv(here("data/manual-coded/irr-trials.csv"))
 
-    df["ben_graph"] = df["ben_annotation"].apply(run_code)
-    df["ced_graph"] = df["ced_annotation"].apply(run_code)
+    df["ben_graph"] = graph_store.run_many(df["ben_annotation"])
+    df["ced_graph"] = graph_store.run_many(df["ced_annotation"])
 
     executor = submitit.AutoExecutor(folder=here("scripts/submitit"))
     executor.update_parameters(**slurm_params)
@@ -177,7 +178,9 @@ if __name__ == "__main__":
     parser.add_argument(
         "--results_filepath", default=here("data/coded/irr/irr_results.csv")
     )
+    parser.add_argument("--graph_store_dir", default=here("data/graph-store"))
     args = parser.parse_args()
+    graph_store = GraphStore(args.graph_store_dir)
 
     TIMEOUT = args.timeout * 60 * 60
 
@@ -208,14 +211,15 @@ if __name__ == "__main__":
     if irr_models_to_compute != []:
         print("Submitting model jobs...")
         model_dfs = [
-            submit_model_jobs(model, TIMEOUT) for model in irr_models_to_compute
+            submit_model_jobs(model, TIMEOUT, graph_store)
+            for model in irr_models_to_compute
         ]
         print("Collecting model results...")
         all_new_result_dfs = [collect_model_results(df) for df in model_dfs]
 
     if compute_human_ged:
         print("Submitting human job...")
-        human_df = submit_human_jobs(TIMEOUT)
+        human_df = submit_human_jobs(TIMEOUT, graph_store)
         print("Collecting human results...")
         all_new_result_dfs.append(collect_human_results(human_df))
 
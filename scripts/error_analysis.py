@@ -7,6 +7,7 @@ from numpy import full
 import pandas as pd
 from plotnine import *
 from src.analysis.errors import get_error_df
+from src.preproc.graph_store import GraphStore
 from pyprojroot import here
 import argparse
 
@@ -23,8 +24,14 @@ MODELS = [
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--experiment_name", type=str, default="full-experiment")
+    parser.add_argument("--graph_store_dir", type=str, default="data/graph-store")
+    # run the code that isn't in the graph store in sandboxed worker processes
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--max_mem", type=int, default=2 * 1024**3)
     args = parser.parse_args()
     EXPERIMENT_NAME = args.experiment_name
+    graph_store = GraphStore(here(args.graph_store_dir))
 
     all_problem_dfs = []
     ns_failed = {}
@@ -44,7 +51,14 @@ if __name__ == "__main__":
                 df_coded["relevant"] = 1
                 df_coded["pid"] = None
 
-            df_problems = get_error_df(df_trials_raw, df_coded)
+            df_problems = get_error_df(
+                df_trials_raw,
+                df_coded,
+                graph_store=graph_store,
+                workers=args.workers,
+                timeout=args.timeout,
+                max_mem=args.max_mem,
+            )
             df_problems["model"] = model
             all_problem_dfs.append(df_problems)
             ns_failed[model] = df_problems["failed_to_run"].sum()
@@ -0,0 +1,74 @@
+"""
+Load-test the concurrent coding engine against a fake model API, offline.
+
+We start a FakeLLMServer, code `n_rows` made-up trials with code_rows_concurrently and report the
+throughput, the number of requests and the most requests that were in flight at once. With
+`--sequential`, the rows are coded one at a time instead (like a code_rows job), for comparison.
+"""
+
+import asyncio
+import random
+import time
+from argparse import ArgumentParser
+import pandas as pd
+from src.preproc.code_with_lm import code_rows_concurrently
+from src.preproc.fake_llm_server import FakeLLMServer
+from src.preproc.utils import DotDict
+
+
+def get_fake_trials(n_rows, seed=0):
+    rng = random.Random(seed)
+    return pd.DataFrame(
+        {
+            "choices": [str([rng.randint(1, 13) for _ in range(4)]) for _ in range(n_rows)],
+            "response": "",
+            "rt_s": 60.0,
+            "transcript": "one plus two is three",
+        }
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--n_rows", type=int, default=200)
+    parser.add_argument("--model_name", default="llama4-maverick-instruct-basic")
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--bad_translation_rate", type=float, default=0.2)
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0)
+    parser.add_argument("--max_concurrency", type=int, default=32)
+    parser.add_argument("--requests_per_minute", type=float, default=None)
+    parser.add_argument("--tokens_per_minute", type=float, default=None)
+    parser.add_argument("--sequential", action="store_true")
+    # e.g. to measure a rerun, where every response comes from the cache
+    parser.add_argument("--response_cache_path", default=None)
+    args = parser.parse_args()
+
+    df_trials = get_fake_trials(args.n_rows)
+    with FakeLLMServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        bad_translation_rate=args.bad_translation_rate,
+        rate_limit_rate=args.rate_limit_rate,
+    ) as server:
+        coding_args = DotDict(
+            {
+                "model_name": args.model_name,
+                "response_cache_path": args.response_cache_path,
+                "max_concurrency": 1 if args.sequential else args.max_concurrency,
+                "requests_per_minute": args.requests_per_minute,
+                "tokens_per_minute": args.tokens_per_minute,
+            }
+        )
+        start_time = time.perf_counter()
+        translations, autochecker_log_dfs, repair_log = asyncio.run(
+            code_rows_concurrently(df_trials, coding_args, base_url=server.url, api_key="fake")
+        )
+        elapsed = time.perf_counter() - start_time
+
+    print(
+        f"Coded {len(translations)} rows in {elapsed:.1f}s ({len(translations) / elapsed:.1f} "
+        f"rows/s), with {server.stats['requests']} requests "
+        f"({server.stats['rate_limited']} rate limited) and {len(autochecker_log_dfs)} retried "
+        f"rows. At most {server.stats['max_in_flight']} requests were in flight."
+    )
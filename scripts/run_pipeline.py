@@ -88,6 +88,30 @@ if __name__ == "__main__":
                 "llama4-maverick-instruct-basic",
             ],
             "filtering_model_name": "llama-v3p3-70b-instruct",
+            "graph_store_dir": "data/graph-store",
+            # model responses are cached here, so that reruns don't call the models again
+            "response_cache_path": "data/llm-cache/responses.sqlite",
+            "state_oracle_dir": "data/state-oracle",
+            # run coded translations in sandboxed worker processes, each with a timeout (in
+            # seconds) and a memory limit (in bytes), e.g. 8 workers, 60 and 2 * 1024**3. None
+            # runs them in this process.
+            "code_workers": None,
+            "code_timeout": None,
+            "code_max_mem": None,
+            # stop running coded translations at their first auto-checker problem when retrying
+            "stop_at_first_problem": False,
+            # repair auto-checker problems with mechanical fixes before retrying with the model
+            "auto_repair": False,
+            # when a translation fails partway through, only regenerate it from the failing
+            # statement on
+            "tail_retry": False,
+            # code the transcripts concurrently in this process (see async_coding), with limits
+            # on the requests to the model's provider (None uses async_coding.PROVIDER_LIMITS),
+            # instead of in Slurm jobs
+            "async_coding": False,
+            "max_concurrency": None,
+            "requests_per_minute": None,
+            "tokens_per_minute": None,
             "transcription_kwargs": {
                 "beam_size": 5,
                 "condition_on_previous_text": True,
@@ -62,36 +62,25 @@ def compute_item_correlation(df_group1: pd.DataFrame, df_group2: pd.DataFrame) -
 ### graph utils ###
 def count_operations(graph: GraphBuilder):
     """Count the number of each operation type in the graph."""
-    operations = {"+": 0, "-": 0, "*": 0, "/": 0}
+    return {op: graph.metric_counts[op] for op in ("+", "-", "*", "/")}
 
-    for _, _, data in graph.G.edges(data=True):
-        operation = data.get("operation", "")
-        if "=" in operation:  # Only look at the part before the equals sign
-            operation = operation[: operation.find("=")]
 
-        # Count each operator in the operation
-        for op in operations.keys():
-            operations[op] += operation.count(op)
-
-    return operations
-
-
-def classify_subgoal_state(subgoal_state):
+def classify_subgoal_state(subgoal_state, target=24):
     if len(subgoal_state) == 1:
         return "single"
     elif len(subgoal_state) == 2:
-        if subgoal_state[0] * subgoal_state[1] == 24:
+        if subgoal_state[0] * subgoal_state[1] == target:
             return "product"
-        elif subgoal_state[0] + subgoal_state[1] == 24:
+        elif subgoal_state[0] + subgoal_state[1] == target:
             return "sum"
         elif (
-            subgoal_state[0] - subgoal_state[1] == 24
-            or subgoal_state[1] - subgoal_state[0] == 24
+            subgoal_state[0] - subgoal_state[1] == target
+            or subgoal_state[1] - subgoal_state[0] == target
         ):
             return "difference"
         elif (
-            subgoal_state[0] / subgoal_state[1] == 24
-            or subgoal_state[1] / subgoal_state[0] == 24
+            subgoal_state[0] / subgoal_state[1] == target
+            or subgoal_state[1] / subgoal_state[0] == target
         ):
             return "quotient"
         else:
@@ -156,10 +145,4 @@ def count_divisions(graph: GraphBuilder):
     """
     Count the number of operations in a graph that involve division.
     """
-    divisions = 0
-    G = graph.G
-    for edge in G.edges():
-        op = G.edges[edge]["operation"]
-        if "/" in op:
-            divisions += 1
-    return divisions
+    return graph.metric_counts["n_divisions"]
@@ -7,23 +7,33 @@ import numpy as np
 import pandas as pd
 from collections import defaultdict
 from src.preproc.utils import run_code
-from src.preproc.auto_checker import check_graph
+from src.preproc.code_runner import run_code_many
+from src.preproc.auto_checker import Problem, ProblemType, check_graphs, get_problems_table
+
+ERROR_COLUMNS = {
+    ProblemType.RUNNABILITY: "runnability_errors",
+    ProblemType.RESULTING_STATE: "state_calculation_errors",
+    ProblemType.SUBGOAL: "subgoal_errors",
+}
 
 error_names = {
-    "Operation runnability from curr_state.": "runnability_errors",
-    "Resulting state calculation error.": "state_calculation_errors",
+    problem_type.value: column for problem_type, column in ERROR_COLUMNS.items()
 }
 
 
 def count_error_types(errors):
     """
-    Count the number of errors of each type.
+    Count the number of errors of each type, from Problem records or from the problems that
+    check_graph returns.
     """
     if errors is None or len(errors) == 0:
         return {}
 
     problem_type_counts = defaultdict(int)
     for error in errors:
+        if isinstance(error, Problem):
+            problem_type_counts[ERROR_COLUMNS[error.type]] += 1
+            continue
         problems = error["Problems"]
         for problem in problems:
             problem_type = re.search(r"PROBLEM TYPE: (.+) DESCRIPTION:", problem).group(
@@ -36,9 +46,29 @@ def count_error_types(errors):
     return problem_type_counts
 
 
-def get_error_df(df_trials_raw, df_coded):
+def count_errors_by_trial(df_problems: pd.DataFrame, n_trials: int) -> pd.DataFrame:
+    """
+    Count the errors of each type for each trial from a table of problems (see
+    auto_checker.check_graphs, with trial ids 0 to n_trials - 1). There's a column for each type
+    of error that occurs, and a total_errors column if any do.
+    """
+    df_counts = pd.crosstab(df_problems["trial_id"], df_problems["problem_type"])
+    df_counts = df_counts.loc[:, df_counts.sum() > 0]
+    df_counts.columns = [ERROR_COLUMNS[ProblemType[name]] for name in df_counts.columns]
+    if len(df_counts.columns) > 0:
+        df_counts["total_errors"] = df_counts.sum(axis=1)
+    return df_counts.reindex(range(n_trials), fill_value=0)
+
+
+def get_error_df(
+    df_trials_raw, df_coded, graph_store=None, workers=None, timeout=None, max_mem=None
+):
     """
     Get a dataframe with the number of errors per participant.
+    If a GraphStore is given, the graphs and their problems are loaded from it instead of re-running
+    and re-checking the code.
+    If a number of workers, a timeout or a memory limit is given, the code is run in sandboxed
+    worker processes (see code_runner.run_code_many).
     """
 
     # first, apply exclusions to get df_coded_proc
@@ -81,17 +111,23 @@ def get_error_df(df_trials_raw, df_coded):
     )
 
     # run the code
-    df_coded_proc["graph"] = df_coded_proc["lm_code_translation"].apply(run_code)
+    codes = df_coded_proc["lm_code_translation"]
+    if graph_store is not None:
+        # load the problems along with the graphs, instead of checking them again
+        results = graph_store.check_many(codes, workers, timeout, max_mem)
+        df_coded_proc["graph"] = [graph for graph, _ in results]
+        df_problem_records = get_problems_table(records for _, records in results)
+    else:
+        if workers is None and timeout is None and max_mem is None:
+            df_coded_proc["graph"] = codes.apply(run_code)
+        else:
+            df_coded_proc["graph"] = run_code_many(codes, workers, timeout, max_mem)
+        df_problem_records = check_graphs(df_coded_proc["graph"])
     df_coded_proc["failed_to_run"] = df_coded_proc["graph"].apply(
         lambda x: isinstance(x, str)
     )
 
-    df_coded_proc["errors"] = df_coded_proc["graph"].apply(
-        lambda x: check_graph(x) if not isinstance(x, str) else None
-    )
-
-    problem_rows = list(df_coded_proc["errors"].apply(count_error_types))
-    df_problems = pd.DataFrame(problem_rows).fillna(0)
+    df_problems = count_errors_by_trial(df_problem_records, len(df_coded_proc))
     df_problems["failed_to_run"] = df_coded_proc["failed_to_run"]
     df_problems = df_problems.reset_index(names="trial_index")
 
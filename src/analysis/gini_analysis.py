@@ -1,5 +1,8 @@
 import networkx as nx
-from src.preproc.reasoning_graph import GraphBuilder
+from concurrent.futures import ProcessPoolExecutor
+from src.preproc.reasoning_graph import GraphBuilder, get_visit_count, get_op_count
+from src.preproc.arithmetic import evaluate, to_number
+from src.preproc.operation_ids import operation_ids
 import pandas as pd
 import numpy as np
 import random
@@ -29,7 +32,13 @@ def get_ngrams(sequence, n=2):
 
 
 def get_operation_sequence(graph, include_subgoals=True):
-    """Get the sequence of operations in the graph."""
+    """
+    Get the sequence of operations in the graph. Graphs built step by step read it from their
+    operation log; other graphs (e.g. views or united graphs) reconstruct it from the timesteps.
+    """
+    if graph.operation_log is not None:
+        return graph.operation_log.get_operation_sequence(include_subgoals)
+
     timestep_to_operation = {}
     for _, target, data in graph.G.edges(data=True):
         operation = data["operation"]
@@ -52,6 +61,17 @@ def get_operation_sequence(graph, include_subgoals=True):
     return operations
 
 
+def get_operation_id_sequence(graph, include_subgoals=True):
+    """
+    Get the sequence of canonical operation ids in the graph (see operation_ids.operation_id), so
+    that operations written differently (e.g. "3*4=12" and "4*3=12") count as the same operation
+    in n-grams and Gini coefficients.
+    """
+    if graph.operation_log is not None:
+        return graph.operation_log.get_operation_ids(include_subgoals).tolist()
+    return operation_ids(get_operation_sequence(graph, include_subgoals)).tolist()
+
+
 def compute_gini(ngrams):
     """
     Compute the Gini coefficient for a list of n-grams.
@@ -84,17 +104,19 @@ def sample_node(graph: nx.DiGraph):
 
 
 def get_random_op_sequence(
-    start_state: tuple, n_operations: int, return_code: bool = False
+    start_state: tuple, n_operations: int, return_code: bool = False, target=24, oracle=None
 ) -> Union[list, str]:
     """
-    Get a random sequence of operations from a given start state
+    Get a random sequence of operations from a given start state (with any number of numbers).
+    With a StateOracle, each operation is drawn uniformly from the distinct legal operations
+    that the oracle lists for the state, instead of drawing two numbers and an operator.
     """
     start_state = tuple([int(x) for x in start_state])
-    graph = GraphBuilder(start_state)
+    graph = GraphBuilder(start_state, target=target)
     all_ops = []
     code = f"""start_state = {start_state}
 curr_state = start_state
-graph = GraphBuilder(start_state)
+graph = GraphBuilder(start_state, target={target})
 """
     last_state = start_state
     for _ in range(n_operations):
@@ -103,6 +125,18 @@ graph = GraphBuilder(start_state)
             code += f"\ncurr_state = graph.move_to_node({state})"
         last_state = state
 
+        if oracle is not None:
+            operation_str, resulting_state = random.choice(oracle.successors(state))
+            all_ops.append(operation_str)
+            code += f'\ngraph.explore_operation(curr_state={state}, operation="{operation_str}", resulting_state={resulting_state}, result_calc_error=False)'
+            graph.explore_operation(
+                curr_state=state,
+                operation=operation_str,
+                resulting_state=resulting_state,
+                result_calc_error=False,
+            )
+            continue
+
         num1, num2 = np.random.choice(state, size=2, replace=False)
 
         if num2 == 0:
@@ -116,12 +150,7 @@ graph = GraphBuilder(start_state)
         resulting_state.remove(num2)
 
         # Calculate result and convert to int if possible
-        result = eval(f"{num1}{operation}{num2}")
-
-        if result.is_integer():
-            result = int(result)
-        else:
-            result = round(result, 2)
+        result = to_number(evaluate(f"{num1}{operation}{num2}"), ndigits=2)
 
         if isinstance(num1, float) and num1.is_integer():
             num1 = int(num1)
@@ -147,7 +176,7 @@ graph = GraphBuilder(start_state)
 
 
 def sample_random_baseline_code_traces(
-    start_state, df_participants, include_subgoals=False
+    start_state, df_participants, include_subgoals=False, target=24, oracle=None
 ):
     random_code_traces = []
     df_trial = df_participants.copy().query("choices == @start_state")
@@ -158,7 +187,11 @@ def sample_random_baseline_code_traces(
         if type(start_state) == str:
             start_state = tuple(literal_eval(start_state))
         code = get_random_op_sequence(
-            start_state, len(row["operation_sequence"]), return_code=True
+            start_state,
+            len(row["operation_sequence"]),
+            return_code=True,
+            target=target,
+            oracle=oracle,
         )
         random_code_traces.append(code)
     return random_code_traces
@@ -168,37 +201,196 @@ def sample_random_baseline_code_traces(
 def prune_graph(graph, threshold=2, remove_subgoals=True):
     """
     Prune the graph by removing nodes with less than threshold visits.
+    Returns a read-only view that shares its storage with the original graph.
     """
-    pruned_graph = graph.copy()
-    nx_graph = pruned_graph.G
-    edges_to_remove = []
-    if remove_subgoals:
-        # remove subgoal edges
-        for edge in nx_graph.edges:
-            if nx_graph.edges[edge]["operation"] == "subgoal":
-                edges_to_remove.append(edge)
-    nx_graph.remove_edges_from(edges_to_remove)
-    nodes_to_remove = [
-        node
-        for node, data in nx_graph.nodes(data=True)
-        if len(data.get("visitation_timesteps", [])) < threshold
-    ]
-    nx_graph.remove_nodes_from(nodes_to_remove)
-    # drop nodes with no edges
-    nx_graph.remove_nodes_from(
-        [
-            node
-            for node in nx_graph.nodes
-            if nx_graph.out_degree(node) == 0 and nx_graph.in_degree(node) == 0
-        ]
+    return graph.view(
+        remove_subgoals=remove_subgoals, min_visits=threshold, drop_isolates=True
     )
-    return pruned_graph
 
 
-def unite_graph_lst(graph_lst, start_state):
-    # Create new graph with start state
-    aggregated_graph = GraphBuilder(start_state)
-    # Unite with each graph in the list
-    for graph in graph_lst:
-        aggregated_graph.unite_graphs(graph)
-    return aggregated_graph
+class GraphUnion:
+    """
+    Accumulates the union of many graphs in a single pass, with the same semantics as folding them
+    through GraphBuilder.unite_graphs. In counts-only mode, nodes and edges keep integer visit and
+    traversal counts (`visit_count` and `op_count`) instead of timestep and comment lists, and the
+    actions aren't kept, so memory stays bounded by the size of the united graph.
+    """
+
+    def __init__(self, counts_only=False):
+        self.counts_only = counts_only
+        self.nodes = {}
+        self.edges = {}
+        self.node_visitation_timestep = 0
+        self.op_timestep = 0
+        self.actions = []
+
+    def add_node(self, node, attrs, copy_lists=True):
+        if self.counts_only:
+            if node not in self.nodes:
+                self.nodes[node] = {
+                    key: value
+                    for key, value in attrs.items()
+                    if key not in ("visitation_timesteps", "visit_count")
+                }
+                self.nodes[node]["visit_count"] = 0
+            self.nodes[node]["visit_count"] += get_visit_count(attrs)
+        elif node not in self.nodes:
+            self.nodes[node] = dict(attrs)
+            if copy_lists and "visitation_timesteps" in attrs:
+                self.nodes[node]["visitation_timesteps"] = list(
+                    attrs["visitation_timesteps"]
+                )
+        else:
+            self.nodes[node].setdefault("visitation_timesteps", []).extend(
+                attrs.get("visitation_timesteps", [])
+            )
+
+    def add_edge(self, edge, attrs, copy_lists=True):
+        if self.counts_only:
+            if edge not in self.edges:
+                self.edges[edge] = {
+                    key: value
+                    for key, value in attrs.items()
+                    if key not in ("op_timesteps", "op_count", "comment")
+                }
+                self.edges[edge]["op_count"] = 0
+            self.edges[edge]["op_count"] += get_op_count(attrs)
+        elif edge not in self.edges:
+            self.edges[edge] = dict(attrs)
+            if copy_lists:
+                for key in ("op_timesteps", "comment"):
+                    if key in attrs:
+                        self.edges[edge][key] = list(attrs[key])
+        else:
+            if "op_timesteps" in attrs:
+                self.edges[edge]["op_timesteps"].extend(attrs["op_timesteps"])
+            if "comment" in attrs:
+                self.edges[edge].setdefault("comment", []).extend(attrs["comment"])
+
+    def add_graph(self, graph: GraphBuilder):
+        """Add a graph to the union"""
+        for node, attrs in graph.G.nodes(data=True):
+            self.add_node(node, attrs)
+        for u, v, attrs in graph.G.edges(data=True):
+            self.add_edge((u, v), attrs)
+        self.update_counters(graph)
+        if not self.counts_only:
+            self.actions.extend(graph.actions)
+        return self
+
+    def merge(self, other: "GraphUnion"):
+        """Merge another union (which shouldn't be used afterwards) into this one"""
+        for node, attrs in other.nodes.items():
+            self.add_node(node, attrs, copy_lists=False)
+        for edge, attrs in other.edges.items():
+            self.add_edge(edge, attrs, copy_lists=False)
+        self.update_counters(other)
+        self.actions.extend(other.actions)
+        return self
+
+    def update_counters(self, other):
+        self.node_visitation_timestep = max(
+            self.node_visitation_timestep, other.node_visitation_timestep
+        )
+        self.op_timestep = max(self.op_timestep, other.op_timestep)
+
+    def to_graph_builder(self, start_state, target=24) -> GraphBuilder:
+        """Build the united graph, starting from a fresh GraphBuilder like unite_graph_lst does"""
+        start_graph = GraphBuilder(start_state, target=target)
+        union = GraphUnion(self.counts_only).add_graph(start_graph)
+        union.merge(self)
+        # in counts-only mode, only the start action is kept
+        union.actions = start_graph.actions + self.actions
+
+        G = nx.DiGraph()
+        G.add_nodes_from(union.nodes.items())
+        G.add_edges_from((u, v, attrs) for (u, v), attrs in union.edges.items())
+        graph = GraphBuilder.__new__(GraphBuilder)
+        graph.__dict__.update(
+            G=G,
+            start_state=tuple(sorted(start_state)),
+            target=target,
+            node_visitation_timestep=union.node_visitation_timestep,
+            op_timestep=union.op_timestep,
+            actions=union.actions,
+        )
+        return graph
+
+
+def union_chunk(graphs, counts_only):
+    """Unite a chunk of graphs (run in a worker process)"""
+    union = GraphUnion(counts_only)
+    for graph in graphs:
+        union.add_graph(graph)
+    return union
+
+
+def merge_unions(union, other):
+    """Merge two partial unions (run in a worker process)"""
+    return union.merge(other)
+
+
+def union_many(graphs, start_state=None, counts_only=False, n_jobs=1, target=None):
+    """
+    Unite many graphs with the same start state (and target) in a single pass.
+
+    Args:
+        graphs: the GraphBuilder objects to unite (they aren't modified)
+        start_state: the start state of the graphs. Defaults to the start state of the first graph.
+        target: the target of the graphs. Defaults to the target of the first graph, or 24.
+        counts_only: keep integer visit and traversal counts instead of timestep and comment lists
+        n_jobs: if greater than 1, unite chunks of the graphs in separate processes and merge the
+            partial unions as a tree reduction
+
+    Raises:
+        ValueError: If the graphs don't all have the same start state and target, or there are no
+            graphs and no start state
+
+    Example usage:
+    --------
+    >>> aggregated_graph = union_many(graphs, counts_only=True, n_jobs=8)
+    >>> pruned_graph = prune_graph(aggregated_graph, threshold=2)
+    """
+    graphs = list(graphs)
+    if start_state is None:
+        if not graphs:
+            raise ValueError("Give a start state to unite an empty list of graphs")
+        start_state = graphs[0].start_state
+    start_state = tuple(sorted(start_state))
+    if target is None:
+        target = graphs[0].target if graphs else GraphBuilder.target
+    for graph in graphs:
+        if graph.start_state != start_state:
+            raise ValueError(
+                f"Cannot unite graphs with different start states: {start_state} vs {graph.start_state}"
+            )
+        if graph.target != target:
+            raise ValueError(
+                f"Cannot unite graphs with different targets: {target} vs {graph.target}"
+            )
+
+    if n_jobs == 1 or len(graphs) < 2 * n_jobs:
+        union = union_chunk(graphs, counts_only)
+    else:
+        chunk_size = -(-len(graphs) // n_jobs)
+        chunks = [graphs[i : i + chunk_size] for i in range(0, len(graphs), chunk_size)]
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            unions = list(
+                executor.map(union_chunk, chunks, [counts_only] * len(chunks))
+            )
+            # merge neighbouring partial unions, so the order of the lists is preserved
+            while len(unions) > 1:
+                merged = list(executor.map(merge_unions, unions[0::2], unions[1::2]))
+                if len(unions) % 2 == 1:
+                    merged.append(unions[-1])
+                unions = merged
+        union = unions[0]
+
+    return union.to_graph_builder(start_state, target)
+
+
+def unite_graph_lst(graph_lst, start_state, counts_only=False):
+    """
+    Unite a list of graphs into a single graph, starting from a fresh graph with the given start state.
+    """
+    return union_many(graph_lst, start_state, counts_only=counts_only)
@@ -0,0 +1,147 @@
+"""
+Exact arithmetic on operation strings (e.g. "(9-4)*3=15") without eval.
+
+Expressions are parsed once into postfix form (the parsed form is memoized, since the same operation
+strings come up over and over across a corpus) and evaluated with exact Fraction arithmetic. Results
+can be converted back to plain ints and floats, optionally with the 2-decimal rounding used for states.
+"""
+
+import operator
+import re
+from fractions import Fraction
+from functools import lru_cache
+from typing import Optional, Union
+from src.preproc.reasoning_graph_utils import tokenize, precedence
+
+NUMBER_PATTERN = re.compile(r"^[+-]?(\d+\.?\d*|\.\d+)$")
+
+OPERATORS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+}
+
+# the same tolerances as np.isclose(..., atol=0.01)
+RTOL = Fraction(1, 100_000)
+ATOL = Fraction(1, 100)
+
+
+@lru_cache(maxsize=65536)
+def parse_number(token: str) -> Fraction:
+    """
+    Parse a single number token (e.g. "12", "-3", "1.5") into an exact Fraction.
+    Raises a ValueError if the token isn't a valid number.
+    """
+    token = token.strip()
+    if not NUMBER_PATTERN.match(token):
+        raise ValueError(f"Invalid number '{token}'")
+    return Fraction(token)
+
+
+def number_value(token: str) -> Union[int, float]:
+    """
+    Parse a number token into the int or float that the token would be as a Python literal.
+    """
+    value = parse_number(token)
+    return int(value) if "." not in token else float(value)
+
+
+def to_number(value: Fraction, ndigits: Optional[int] = None) -> Union[int, float]:
+    """
+    Convert an exact value to an int (if it's a whole number) or a float. If `ndigits` is given,
+    floats are rounded to that many decimals, like the 2-decimal rounding used for states.
+    """
+    if value.denominator == 1:
+        return int(value)
+    if ndigits is None:
+        return float(value)
+    return round(float(value), ndigits)
+
+
+@lru_cache(maxsize=65536)
+def parse_expression(expression: str) -> tuple:
+    """
+    Parse an arithmetic expression into a postfix tuple of Fractions and operator characters,
+    using the same precedence rules as reasoning_graph_utils.evaluate_expression.
+    Raises a ValueError if the expression is malformed.
+    """
+    postfix = []
+    operators = []
+    for token in tokenize(expression):
+        if token in OPERATORS:
+            while (
+                operators
+                and operators[-1] != "("
+                and precedence(operators[-1]) >= precedence(token)
+            ):
+                postfix.append(operators.pop())
+            operators.append(token)
+        elif token == "(":
+            operators.append(token)
+        elif token == ")":
+            while operators and operators[-1] != "(":
+                postfix.append(operators.pop())
+            if not operators:
+                raise ValueError("Mismatched parentheses")
+            operators.pop()
+        else:
+            postfix.append(parse_number(token))
+
+    while operators:
+        if operators[-1] == "(":
+            raise ValueError("Mismatched parentheses")
+        postfix.append(operators.pop())
+
+    # make sure the expression reduces to a single value
+    depth = 0
+    for token in postfix:
+        depth += 1 if isinstance(token, Fraction) else -1
+        if depth < 1:
+            raise ValueError(f"Malformed expression '{expression}'")
+    if depth != 1:
+        raise ValueError(f"Malformed expression '{expression}'")
+
+    return tuple(postfix)
+
+
+def apply_operator(left: Fraction, op: str, right: Fraction) -> Fraction:
+    """Apply a single binary operator. Division by zero raises a ZeroDivisionError."""
+    return OPERATORS[op](left, right)
+
+
+@lru_cache(maxsize=65536)
+def evaluate(expression: str) -> Fraction:
+    """
+    Evaluate an arithmetic expression (e.g. "(9-4)*3") exactly.
+    """
+    stack = []
+    for token in parse_expression(expression):
+        if isinstance(token, Fraction):
+            stack.append(token)
+        else:
+            right = stack.pop()
+            left = stack.pop()
+            stack.append(apply_operator(left, token, right))
+    return stack[0]
+
+
+def split_operation(operation: str) -> tuple[str, str]:
+    """Split an operation like "3*4=12" into its left-hand and right-hand sides"""
+    return operation[: operation.rfind("=")], operation[operation.rfind("=") + 1 :]
+
+
+def is_close(a: Fraction, b: Fraction, rtol: Fraction = RTOL, atol: Fraction = ATOL) -> bool:
+    """Exact equivalent of np.isclose for two values"""
+    return abs(a - b) <= atol + rtol * abs(b)
+
+
+@lru_cache(maxsize=65536)
+def operation_is_correct(operation: str, result_calc_error: bool = False) -> bool:
+    """
+    Check whether the left-hand side of an operation (e.g. "3*4=12") evaluates to its right-hand side.
+    Operations flagged with a calculation error are never correct. The result is memoized, since
+    comparing Fractions is most of the cost of building a graph.
+    """
+    lhs, rhs = split_operation(operation)
+    return is_close(evaluate(lhs), evaluate(rhs)) and not result_calc_error
@@ -0,0 +1,308 @@
+"""
+An asyncio engine for coding many transcripts with language models at once, instead of one
+transcript at a time.
+
+Coding a transcript is written as a generator of steps (see code_with_lm.code_row_steps), which
+yields a ModelRequest whenever it needs a response from the model, and is sent the response. The
+same steps can run one after another with a blocking client (run_steps), or concurrently in a
+CodingEngine, where each row is its own task: while one row waits for the model, the others run
+their checks and retries. The steps run in threads between requests, so running and checking code
+doesn't hold up the requests of other rows.
+
+Each provider gets one async client, whose connection pool is shared by every row, a bound on the
+number of requests in flight and token buckets for its requests and (estimated) tokens per minute
+(see ProviderLimits).
+
+Example usage:
+--------
+>>> async with CodingEngine(limits={"openai": ProviderLimits(max_concurrency=8)}) as engine:
+...     results = await engine.run_all([code_row_steps(row, ...) for row in rows], "gpt-4o")
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Generator, Iterable, Optional
+import anthropic
+import backoff
+import httpx
+import openai
+from src.preproc.response_cache import ResponseCache
+
+FIREWORKS_BASE_URL = "https://api.fireworks.ai/inference/v1"
+API_KEY_VARIABLES = {
+    "openai": "OPENAI_API_KEY",
+    "anthropic": "ANTHROPIC_API_KEY",
+    "fireworks": "FIREWORKS_API_KEY",
+}
+# a rough count of characters per token, to rate limit tokens before the response says how many
+# were used
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class ModelRequest:
+    """A call to the language model that a coding step is waiting on"""
+
+    system_prompt: str
+    messages: list[dict]
+    temp: float = 0.0
+
+    def estimate_tokens(self) -> int:
+        n_chars = len(self.system_prompt) + sum(
+            len(message["content"]) for message in self.messages
+        )
+        return n_chars // CHARS_PER_TOKEN
+
+
+@dataclass
+class ProviderLimits:
+    """
+    The limits on the requests to a provider.
+
+    Attributes:
+        max_concurrency: the number of requests in flight at once (and of pooled connections)
+        requests_per_minute: the rate of requests, or None for no limit
+        tokens_per_minute: the rate of prompt tokens (estimated from the characters in the
+            prompt), or None for no limit
+    """
+
+    max_concurrency: int = 16
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+
+
+PROVIDER_LIMITS = {
+    "openai": ProviderLimits(max_concurrency=32, requests_per_minute=500),
+    "anthropic": ProviderLimits(max_concurrency=16, requests_per_minute=50),
+    "fireworks": ProviderLimits(max_concurrency=32, requests_per_minute=600),
+}
+
+
+def get_api_type(model_name: str) -> str:
+    if "gpt" in model_name or "o1" in model_name:
+        return "openai"
+    if "claude" in model_name:
+        return "anthropic"
+    return "fireworks"
+
+
+def run_steps(steps: Generator, get_response) -> object:
+    """Run coding steps with a blocking function that answers each ModelRequest they yield"""
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(get_response(request))
+    except StopIteration as stop:
+        return stop.value
+
+
+def advance(steps: Generator, response: Optional[str]) -> tuple[bool, object]:
+    """
+    Run coding steps up to their next request. Returns (False, the request), or (True, the
+    result of the steps) once they're done.
+    """
+    try:
+        return False, steps.send(response)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+class TokenBucket:
+    """
+    Allows `rate_per_minute` units per minute on average, in bursts of up to `capacity` units
+    (a minute's worth by default). Waiting callers are served in order.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1) -> None:
+        # amounts over the capacity would never fit, so they empty a full bucket instead
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class ModelClient:
+    """An async client for one provider, with its limits (see the module docstring)"""
+
+    def __init__(
+        self,
+        api_type: str,
+        limits: ProviderLimits,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+    ):
+        self.api_type = api_type
+        self.limits = limits
+        self.semaphore = asyncio.Semaphore(limits.max_concurrency)
+        self.request_bucket = (
+            TokenBucket(limits.requests_per_minute) if limits.requests_per_minute else None
+        )
+        self.token_bucket = (
+            TokenBucket(limits.tokens_per_minute) if limits.tokens_per_minute else None
+        )
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=limits.max_concurrency,
+                max_keepalive_connections=limits.max_concurrency,
+            ),
+            timeout=httpx.Timeout(600, connect=10),
+        )
+        api_key = api_key or os.environ.get(API_KEY_VARIABLES[api_type])
+        if api_type == "anthropic":
+            self.client = anthropic.AsyncAnthropic(
+                api_key=api_key, base_url=base_url, http_client=self.http_client
+            )
+        else:
+            if api_type == "fireworks":
+                base_url = base_url or FIREWORKS_BASE_URL
+            self.client = openai.AsyncOpenAI(
+                api_key=api_key, base_url=base_url, http_client=self.http_client
+            )
+        self.n_requests = 0
+        self.n_in_flight = 0
+        self.max_in_flight = 0
+
+    async def aclose(self) -> None:
+        await self.http_client.aclose()
+
+    @backoff.on_exception(backoff.expo, Exception, max_time=600)
+    async def complete(self, request: ModelRequest, model_name: str) -> str:
+        """The model's response to a request, waiting for the provider's limits first"""
+        if self.request_bucket is not None:
+            await self.request_bucket.acquire()
+        if self.token_bucket is not None:
+            await self.token_bucket.acquire(request.estimate_tokens())
+        async with self.semaphore:
+            self.n_requests += 1
+            self.n_in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.n_in_flight)
+            try:
+                return await self.create(request, model_name)
+            finally:
+                self.n_in_flight -= 1
+
+    async def create(self, request: ModelRequest, model_name: str) -> str:
+        """Make a request (like code_with_lm.get_model_response, for each provider)"""
+        if self.api_type == "anthropic":
+            chat_completion = await self.client.messages.create(
+                model=model_name,
+                max_tokens=3000,
+                system=request.system_prompt,
+                messages=request.messages,
+                temperature=request.temp,
+            )
+            return chat_completion.content[0].text
+
+        if self.api_type == "openai":
+            # o1 models don't take system messages
+            system_role = "system" if "gpt" in model_name else "user"
+        else:
+            system_role = "system"
+            model_name = f"accounts/fireworks/models/{model_name}"
+        try:
+            chat_completion = await self.client.chat.completions.create(
+                model=model_name,
+                messages=[{"role": system_role, "content": request.system_prompt}]
+                + request.messages,
+                temperature=request.temp,
+            )
+        except openai.BadRequestError:
+            if self.api_type != "openai":
+                raise
+            return "# Bad request error"
+        return chat_completion.choices[0].message.content
+
+
+class CodingEngine:
+    """
+    Runs the coding steps of many rows concurrently, with one ModelClient per provider.
+
+    Args:
+        limits: the limits for each provider, for those that shouldn't use PROVIDER_LIMITS
+        base_url: the URL to send requests to instead of the providers' APIs (e.g. of a
+            fake_llm_server.FakeLLMServer)
+        api_key: the API key to use instead of the providers' environment variables
+        cache: a response_cache.ResponseCache to load responses from (and save them to)
+    """
+
+    def __init__(
+        self,
+        limits: Optional[dict[str, ProviderLimits]] = None,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        cache: Optional[ResponseCache] = None,
+    ):
+        self.limits = {**PROVIDER_LIMITS, **(limits or {})}
+        self.base_url = base_url
+        self.api_key = api_key
+        self.cache = cache
+        self.clients = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        for client in self.clients.values():
+            await client.aclose()
+        self.clients = {}
+
+    def get_client(self, model_name: str) -> ModelClient:
+        api_type = get_api_type(model_name)
+        if api_type not in self.clients:
+            base_url = self.base_url
+            if base_url is not None and api_type != "anthropic":
+                # the OpenAI client adds the path after the version, the Anthropic one before it
+                base_url = base_url.rstrip("/") + "/v1"
+            self.clients[api_type] = ModelClient(
+                api_type, self.limits[api_type], base_url, self.api_key
+            )
+        return self.clients[api_type]
+
+    async def run(self, steps: Generator, model_name: str) -> object:
+        """Run the coding steps of one row, returning their result"""
+        is_done, value = await asyncio.to_thread(advance, steps, None)
+        while not is_done:
+            response = await self.get_response(value, model_name)
+            is_done, value = await asyncio.to_thread(advance, steps, response)
+        return value
+
+    async def get_response(self, request: ModelRequest, model_name: str) -> str:
+        """The model's response to a request, from the cache if it has it"""
+        if self.cache is None:
+            return await self.get_client(model_name).complete(request, model_name)
+        key = self.cache.next_key(
+            model_name, request.system_prompt, request.messages, request.temp
+        )
+        response = self.cache.get(key)
+        if response is None:
+            response = await self.get_client(model_name).complete(request, model_name)
+            self.cache.put(key, model_name, response)
+        return response
+
+    async def run_all(self, steps_per_row: Iterable[Generator], model_name: str) -> list:
+        """
+        Run the coding steps of many rows as concurrent tasks, returning their results in order.
+        A row that fails (e.g. when backoff gives up on the model's API) has its exception as its
+        result, so the other rows aren't lost.
+        """
+        return await asyncio.gather(
+            *(self.run(steps, model_name) for steps in steps_per_row), return_exceptions=True
+        )
@@ -1,41 +1,106 @@
+import itertools
+from dataclasses import dataclass
+from enum import Enum
+from typing import Iterable, Optional
+import pandas as pd
 from src.preproc.reasoning_graph import GraphBuilder
+from src.preproc.code_compiler import run_compiled_code
 from src.preproc.code_checking_tools import (
-    can_run_from_curr_state,
+    OperandStateIndex,
+    get_runnability,
     is_op_well_formatted,
     can_set_subgoal,
     get_resulting_state,
 )
 
+PROBLEM_COLUMNS = [
+    "trial_id",
+    "action_index",
+    "problem_type",
+    "operands",
+    "suggested_fix",
+    "message",
+]
 
-def get_problems_str(problems: list[dict]) -> str:
+
+class ProblemType(Enum):
+    """The types of problems the checker finds, with the names they're given in prompts"""
+
+    RUNNABILITY = "Operation runnability from curr_state."
+    RESULTING_STATE = "Resulting state calculation error."
+    SUBGOAL = "Subgoal setability."
+
+
+@dataclass
+class Problem:
     """
-    Get the string representation of a list of problems.
+    A problem with one action of a graph. It's only written out as text (see __str__) when it's
+    shown to a model.
+
+    Attributes:
+        type: the type of problem
+        action_index: the index of the action in graph.actions
+        action: the action
+        operands: the offending numbers. For runnability problems, the numbers of the operation
+            that aren't in curr_state. For resulting state problems, the resulting state that was
+            given. For subgoal problems, the subgoal state.
+        suggested_fix: the state that would fix the problem, if there is one. For runnability
+            problems, the state to move to before running the operation. For resulting state
+            problems, the correct resulting state.
+        message: the explanation from the checking tool
     """
-    problems_str = ""
-    for action in problems:
-        problems_str += f"\n\nAction: {action['Action']}.\nProblems:"
-        for problem in action["Problems"]:
-            problems_str += f"\n- {problem}"
 
-    return problems_str.strip()
+    type: ProblemType
+    action_index: int
+    action: dict
+    operands: tuple = ()
+    suggested_fix: Optional[tuple] = None
+    message: str = ""
 
+    @property
+    def description(self) -> str:
+        action = self.action
+        if self.type == ProblemType.RUNNABILITY:
+            return f"""the operation `{action['operation']}` cannot be run from curr_state {action['curr_state']}. {self.message}"""
+        if self.type == ProblemType.RESULTING_STATE:
+            return f"""The resulting state {action['resulting_state']} provided is not the correct resulting state for the operation {action['operation']} from the current state {action['curr_state']}. The correct resulting_state is {self.suggested_fix}. You could fix this by changing the resulting state to {self.suggested_fix}. If you think the participant made a calculation error, make sure to set result_calc_error to True. If you think the participant misspoke or there was a transcription error (e.g. saying "2 times 1 is 3" when they probably meant "2 plus 1 is 3"), consider other possible interpretations of the transcript."""
+        return f"The subgoal {action['subgoal_state']} cannot be set. {self.message}"
 
-def get_recent_new_state(previous_actions: list[dict]) -> tuple:
+    def __str__(self):
+        return f"PROBLEM TYPE: {self.type.value} DESCRIPTION: {self.description}"
+
+
+def format_problems(problems: list[Problem]) -> list[dict]:
     """
-    Get the new state value from the operation and the current state.
+    Write problem records out the way check_graph returns them: a dict for each action with
+    problems, with the action ("Action") and the text of its problems ("Problems")
     """
-    # iterate backwards through the actions and find the first explore_operation
-    for action in reversed(previous_actions):
-        if action["type"] == "explore_operation":
-            return action["resulting_state"]
-    return None
+    problem_dicts = []
+    action_index = None
+    for problem in problems:
+        if problem.action_index != action_index:
+            action_index = problem.action_index
+            problem_dicts.append(
+                {"Action": get_action_str(problem.action), "Problems": []}
+            )
+        problem_dicts[-1]["Problems"].append(str(problem))
+    return problem_dicts
 
 
-def check_if_all_elements_in_state(elements: list[str], state: tuple) -> bool:
+def get_problems_str(problems: list) -> str:
     """
-    Check if all elements are in the state.
+    Get the string representation of a list of problems (either problem records, or the dicts
+    that check_graph returns).
     """
-    return all(element in state for element in elements)
+    if problems and isinstance(problems[0], Problem):
+        problems = format_problems(problems)
+    problems_str = ""
+    for action in problems:
+        problems_str += f"\n\nAction: {action['Action']}.\nProblems:"
+        for problem in action["Problems"]:
+            problems_str += f"\n- {problem}"
+
+    return problems_str.strip()
 
 
 def get_action_str(action: dict) -> str:
@@ -50,68 +115,308 @@ def get_action_str(action: dict) -> str:
         return ""
 
 
-def check_graph(graph: GraphBuilder):
+def get_expected_resulting_state(action: dict, state_space=None) -> tuple:
     """
-    Check if a graph is valid. If not, return a list of problems.
+    The resulting state that an explore_operation action should have. Single operations without a
+    calculation error are looked up in the state space if one is given.
+    """
+    if state_space is not None and not action["result_calc_error"]:
+        resulting_state = state_space.get_successor(action["curr_state"], action["operation"])
+        if resulting_state is not None:
+            return resulting_state
+    return get_resulting_state(
+        action["curr_state"], action["operation"], action["result_calc_error"]
+    )[0]
+
+
+def get_action_problems(
+    action: dict,
+    action_index: int,
+    start_state: tuple,
+    recent_new_state: Optional[tuple],
+    state_space=None,
+    state_index: Optional[OperandStateIndex] = None,
+) -> list[Problem]:
+    """
+    The problems with a single action, given the start state of the graph and the resulting state
+    of the most recent explore_operation before it (see check_graph for the state space).
+    If an index of the states of the graph before the action is given, operations that can't be
+    run are given the existing states they can be run from.
     """
     problems = []
-    for i, action in enumerate(graph.actions):
-        action_prob_dict = {"Action": get_action_str(action), "Problems": []}
-        if action["type"] == "explore_operation":
-            ## check if the operation is well-formatted - if not, provide feedback on how to fix it
-            is_well_formatted, message = is_op_well_formatted(action["operation"])
-            if not is_well_formatted:
-                action_prob_dict["Problems"].append(
-                    f"""PROBLEM TYPE: Operation formatting. DESCRIPTION: the operation {action['operation']} is not well-formatted. {message}"""
+    if action["type"] == "explore_operation":
+        ## check if the operation is well-formatted - if not, provide feedback on how to fix it
+        is_well_formatted, message = is_op_well_formatted(action["operation"])
+        if not is_well_formatted:
+            # if the operation is not well-formatted, we don't need to check the other conditions
+            # (the problem itself isn't reported, as it never has been)
+            return problems
+
+        ## check if the operation can be run from the current state - if not, provide feedback on which state to go to before running it
+        can_run, missing_elements, state_to_move_to, message = get_runnability(
+            action["curr_state"],
+            action["operation"],
+            start_state,
+            recent_new_state,
+            state_index,
+        )
+        if not can_run:
+            problems.append(
+                Problem(
+                    ProblemType.RUNNABILITY,
+                    action_index,
+                    action,
+                    operands=missing_elements,
+                    suggested_fix=state_to_move_to,
+                    message=message,
                 )
-                continue  # if the operation is not well-formatted, we don't need to check the other conditions
-
-            ## check if the operation can be run from the current state - if not, provide feedback on which state to go to before running it
-            can_run, message = can_run_from_curr_state(
-                action["curr_state"],
-                action["operation"],
-                graph.start_state,
-                get_recent_new_state(graph.actions[:i]),
             )
-            if not can_run:
-                action_prob_dict["Problems"].append(
-                    f"""PROBLEM TYPE: Operation runnability from curr_state. DESCRIPTION: the operation `{action['operation']}` cannot be run from curr_state {action['curr_state']}. {message}"""
-                )
 
-            ## check if the resulting state is a valid successor of the current state - if not, provide the valid successor
-            elif (
-                action["resulting_state"]
-                != get_resulting_state(
-                    action["curr_state"],
-                    action["operation"],
-                    action["result_calc_error"],
-                )[0]
-            ):
-                correct_resulting_state, correct_operation = get_resulting_state(
-                    action["curr_state"],
-                    action["operation"],
-                    action["result_calc_error"],
-                )
-                action_prob_dict["Problems"].append(
-                    f"""PROBLEM TYPE: Resulting state calculation error. DESCRIPTION: The resulting state {action['resulting_state']} provided is not the correct resulting state for the operation {action['operation']} from the current state {action['curr_state']}. The correct resulting_state is {correct_resulting_state}. You could fix this by changing the resulting state to {correct_resulting_state}. If you think the participant made a calculation error, make sure to set result_calc_error to True. If you think the participant misspoke or there was a transcription error (e.g. saying "2 times 1 is 3" when they probably meant "2 plus 1 is 3"), consider other possible interpretations of the transcript."""
+        ## check if the resulting state is a valid successor of the current state - if not, provide the valid successor
+        else:
+            correct_resulting_state = get_expected_resulting_state(action, state_space)
+            if action["resulting_state"] != correct_resulting_state:
+                problems.append(
+                    Problem(
+                        ProblemType.RESULTING_STATE,
+                        action_index,
+                        action,
+                        operands=to_tuple(action["resulting_state"]),
+                        suggested_fix=correct_resulting_state,
+                    )
                 )
 
-        elif action["type"] == "set_subgoal":
-            ## check if the subgoal can be set
-            can_set, message = can_set_subgoal(
-                action["subgoal_state"], action["state_after_subgoal"]
-            )
-            if not can_set:
-                action_prob_dict["Problems"].append(
-                    f"PROBLEM TYPE: Subgoal setability. DESCRIPTION: The subgoal {action['subgoal_state']} cannot be set. {message}"
+    elif action["type"] == "set_subgoal":
+        ## check if the subgoal can be set
+        can_set, message = can_set_subgoal(
+            action["subgoal_state"], action["state_after_subgoal"], state_space
+        )
+        if not can_set:
+            problems.append(
+                Problem(
+                    ProblemType.SUBGOAL,
+                    action_index,
+                    action,
+                    operands=to_tuple(action["subgoal_state"]),
+                    message=message,
                 )
-
-        if action_prob_dict["Problems"]:
-            problems.append(action_prob_dict)
+            )
 
     return problems
 
 
+def get_visited_states(action: dict) -> list:
+    """
+    The states that an action visits, which are the states it can be followed by a move_to_node
+    to. Subgoals, the states after them and the current states of operations aren't visited by
+    the action (and move_to_node fails on states that never were).
+    """
+    if action["type"] == "start":
+        return [action["state"]]
+    if action["type"] == "explore_operation":
+        sub_operations_dict = action.get("sub_operations_dict") or {}
+        return [*sub_operations_dict.get("resulting_state", []), action["resulting_state"]]
+    if action["type"] == "move_to_node":
+        return [action["new_state"]]
+    return []
+
+
+def to_tuple(state) -> tuple:
+    """A state as a tuple (states in actions that the checker flags aren't always sequences)"""
+    return tuple(state) if isinstance(state, (tuple, list)) else (state,)
+
+
+class ProblemFound(BaseException):
+    """
+    Raised by a StreamingChecker that stops at the first problem, to stop the code that's building
+    the graph. It's a BaseException so that run_code and run_compiled_code don't report it as an
+    error in the code.
+    """
+
+
+class StreamingChecker:
+    """
+    Checks the actions of a graph one at a time, as they're added to it (see
+    GraphBuilder.add_action_hook), keeping track of the most recent new state as it goes.
+
+    Args:
+        state_space: see check_graph
+        stop_at_first_problem: raise ProblemFound as soon as an action has a problem
+
+    Example usage:
+    --------
+    >>> checker = StreamingChecker()
+    >>> graph = run_compiled_code(code, graph_builder_cls=checker.graph_builder_cls())
+    >>> checker.records  # Problem records
+    >>> checker.problems  # the same as check_graph(graph)
+    """
+
+    def __init__(self, state_space=None, stop_at_first_problem=False):
+        self.state_space = state_space
+        self.stop_at_first_problem = stop_at_first_problem
+        self.graph = None
+        self.start(None)
+
+    def start(self, start_state: tuple, action_index: int = 0) -> None:
+        """Start checking a new graph, whose next action is graph.actions[action_index]"""
+        self.start_state = start_state
+        self.recent_new_state = None
+        self.action_index = action_index
+        self.records = []
+        # the states visited so far, to suggest where operations that can't be run can be run
+        # from
+        self.state_index = OperandStateIndex()
+
+    @property
+    def problems(self) -> list[dict]:
+        """The problems found so far, in the format check_graph returns them"""
+        return format_problems(self.records)
+
+    def attach(self, graph: GraphBuilder) -> GraphBuilder:
+        """Check every action that's added to a (new) graph from now on"""
+        self.graph = graph
+        self.start(graph.start_state, len(graph.actions))
+        for action in graph.actions:
+            self.add_states(action)
+        graph.add_action_hook(self.on_action)
+        return graph
+
+    def detach(self) -> None:
+        """Stop checking the graph"""
+        if self.graph is not None:
+            self.graph.action_hooks.remove(self.on_action)
+            self.graph = None
+
+    def graph_builder_cls(self, graph_builder_cls=GraphBuilder):
+        """
+        A stand-in for the GraphBuilder class in code translations (see run_code), which attaches
+        the checker to the graph the code builds
+        """
+
+        def build_graph(*args, **kwargs):
+            return self.attach(graph_builder_cls(*args, **kwargs))
+
+        return build_graph
+
+    def add_states(self, action: dict) -> None:
+        for state in get_visited_states(action):
+            self.state_index.add(state)
+
+    def on_action(self, graph: GraphBuilder, action: dict) -> None:
+        self.check_action(action)
+
+    def check_action(self, action: dict) -> list[Problem]:
+        """Check the next action of the graph, returning its problems"""
+        problems = get_action_problems(
+            action,
+            self.action_index,
+            self.start_state,
+            self.recent_new_state,
+            self.state_space,
+            self.state_index,
+        )
+        self.action_index += 1
+        self.add_states(action)
+        if action["type"] == "explore_operation":
+            self.recent_new_state = action["resulting_state"]
+        if problems:
+            self.records.extend(problems)
+            if self.stop_at_first_problem:
+                raise ProblemFound(get_problems_str(self.records))
+        return problems
+
+
+def get_problem_records(
+    graph: GraphBuilder, state_space=None, stop_at_first_problem=False
+) -> list[Problem]:
+    """The problems with a graph, as Problem records (see check_graph)"""
+    checker = StreamingChecker(state_space)
+    checker.start(graph.start_state)
+    for action in graph.actions:
+        if checker.check_action(action) and stop_at_first_problem:
+            break
+    return checker.records
+
+
+def check_graph(graph: GraphBuilder, state_space=None, stop_at_first_problem=False):
+    """
+    Check if a graph is valid. If not, return a list of problems.
+    If a state space is given (e.g. graph.state_space, or a precomputed StateOracle), subgoals are
+    also checked against it, and the resulting states of single operations are looked up in it
+    instead of being recomputed.
+    With `stop_at_first_problem`, only the problems of the first action that has any are returned.
+    """
+    return format_problems(get_problem_records(graph, state_space, stop_at_first_problem))
+
+
+def check_code(
+    code, for_pretraining=True, state_space=None, stop_at_first_problem=False
+) -> tuple:
+    """
+    Run a code translation and check its graph as it's built.
+    Returns the graph (or run_code's error message) and the problems. Code that fails to run has
+    its error message as its only problem. With `stop_at_first_problem`, the code stops running
+    at the first action with a problem, and the graph is the one built up to it.
+    """
+    checker = StreamingChecker(state_space, stop_at_first_problem)
+    try:
+        graph = run_compiled_code(
+            code, for_pretraining, graph_builder_cls=checker.graph_builder_cls()
+        )
+    except ProblemFound:
+        graph = checker.graph
+    checker.detach()
+    if isinstance(graph, str):
+        return graph, [graph]
+    return graph, checker.problems
+
+
+def get_problems_table(
+    records_per_graph: Iterable[Optional[list[Problem]]], trial_ids: Optional[Iterable] = None
+) -> pd.DataFrame:
+    """
+    A table of the Problem records of many graphs (see check_graphs). Entries that are None (e.g.
+    for code that failed to run) are skipped.
+    """
+    if trial_ids is None:
+        trial_ids = itertools.count()
+    columns = {column: [] for column in PROBLEM_COLUMNS}
+    for trial_id, records in zip(trial_ids, records_per_graph):
+        for problem in records or []:
+            columns["trial_id"].append(trial_id)
+            columns["action_index"].append(problem.action_index)
+            columns["problem_type"].append(problem.type.name)
+            columns["operands"].append(problem.operands)
+            columns["suggested_fix"].append(problem.suggested_fix)
+            columns["message"].append(problem.message)
+    df = pd.DataFrame(columns)
+    df["action_index"] = df["action_index"].astype(int)
+    df["problem_type"] = pd.Categorical(
+        df["problem_type"], categories=[problem_type.name for problem_type in ProblemType]
+    )
+    return df
+
+
+def check_graphs(
+    graphs: Iterable, trial_ids: Optional[Iterable] = None, state_space=None
+) -> pd.DataFrame:
+    """
+    Check many graphs, returning every problem as a row of a table with the columns:
+        trial_id: the trial id of the graph (its position in `graphs` if no ids are given)
+        action_index: the index of the action in graph.actions
+        problem_type: the ProblemType name, as a categorical
+        operands, suggested_fix, message: see Problem
+    Entries that aren't graphs (e.g. the error messages of code that failed to run) are skipped.
+    """
+    return get_problems_table(
+        (
+            get_problem_records(graph, state_space) if isinstance(graph, GraphBuilder) else None
+            for graph in graphs
+        ),
+        trial_ids,
+    )
+
+
 if __name__ == "__main__":
     from utils import run_code
 
@@ -0,0 +1,289 @@
+"""
+Deterministic repairs of code translations, for auto-checker problems with mechanical fixes, so
+that only the problems that need judgement are sent back to the language model.
+
+Three kinds of problems are repaired:
+    malformed_state: a resulting_state with the right numbers that isn't a sorted tuple (e.g.
+        [3, 3, 4] or (4, 3, 3)), which is replaced by the sorted tuple
+    resulting_state: a resulting_state that doesn't follow from the operation, when the result
+        of the operation is in the state the checker computed (so the operation itself is
+        consistent, and only the rest of the state is wrong), which is replaced by that state
+    move_to_node: an operation that can't be run from curr_state, when the checker suggests a
+        state to move to and running the operation from there gives exactly the resulting_state
+        of the action, which gets a `curr_state = graph.move_to_node(state)` before it
+
+Repairs edit the code at the position of the call that made the action (found with `ast`), so the
+rest of the code, including the comments, stays as it was. Each repair is re-checked, and only
+kept if the code still runs, the problem is gone and no other step has a new problem (e.g. a
+move_to_node that changes curr_state for the actions after it is only kept if it doesn't make
+them unrunnable).
+
+Example usage:
+--------
+>>> repaired_code, repairs, problems = repair_code(code)
+>>> [str(repair) for repair in repairs]
+['resulting_state of action 1: (1, 3, 3, 4) -> (3, 3, 4)', 'move_to_node of action 4: (3, 3, 4) -> (1, 2, 3, 4)']
+>>> problems  # what's left for the language model (see auto_checker.check_code)
+"""
+
+import ast
+from dataclasses import dataclass
+from typing import Optional
+from src.preproc.auto_checker import (
+    Problem,
+    ProblemType,
+    format_problems,
+    get_expected_resulting_state,
+    get_problem_records,
+)
+from src.preproc.code_checking_tools import parse_number
+from src.preproc.code_compiler import DSL_METHODS, run_compiled_code
+from src.preproc.utils import preprocess_response
+
+REPAIR_KINDS = ["malformed_state", "resulting_state", "move_to_node"]
+
+# the prefix that preprocess_response adds to the code
+CODE_PREFIX = "global graph\n"
+
+
+@dataclass
+class Repair:
+    """A repair of the call that made graph.actions[action_index]"""
+
+    kind: str
+    action_index: int
+    before: str
+    after: str
+
+    def __str__(self):
+        return f"{self.kind} of action {self.action_index}: {self.before} -> {self.after}"
+
+
+def get_dsl_calls(tree: ast.Module) -> list[ast.Call]:
+    """
+    The calls to DSL methods in the code, in the order they run (arguments before the call), so
+    that the i-th call made graph.actions[i + 1]
+    """
+    calls = []
+
+    def visit(node):
+        for child in ast.iter_child_nodes(node):
+            visit(child)
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and node.func.attr in DSL_METHODS
+        ):
+            calls.append(node)
+
+    for statement in tree.body:
+        visit(statement)
+    return calls
+
+
+def get_argument(call: ast.Call, name: str, position: int) -> Optional[ast.expr]:
+    """An argument of a call, passed by keyword or by position"""
+    for keyword in call.keywords:
+        if keyword.arg == name:
+            return keyword.value
+    if position < len(call.args):
+        return call.args[position]
+    return None
+
+
+class Source:
+    """The code of a translation, with its statements and DSL calls"""
+
+    def __init__(self, code: str):
+        self.code = code
+        self.tree = ast.parse(code)
+        self.calls = get_dsl_calls(self.tree)
+        self.line_starts = [0] + [i + 1 for i, char in enumerate(code) if char == "\n"]
+
+    def offset(self, lineno: int, col_offset: int) -> int:
+        """The position in the code of an ast position (whose columns count utf-8 bytes)"""
+        line_start = self.line_starts[lineno - 1]
+        line = self.code[line_start : line_start + col_offset]
+        return line_start + len(line.encode()[:col_offset].decode(errors="ignore"))
+
+    def span(self, node: ast.AST) -> tuple[int, int]:
+        return (
+            self.offset(node.lineno, node.col_offset),
+            self.offset(node.end_lineno, node.end_col_offset),
+        )
+
+    def text(self, node: ast.AST) -> str:
+        start, end = self.span(node)
+        return self.code[start:end]
+
+    def statement(self, call: ast.Call) -> ast.stmt:
+        """The top-level statement that a call is in"""
+        for statement in self.tree.body:
+            if statement.lineno <= call.lineno <= statement.end_lineno:
+                return statement
+
+    def edit(self, edits: list[tuple[int, int, str]]) -> str:
+        """The code with each (start, end) span replaced by a text"""
+        code = self.code
+        for start, end, text in sorted(edits, reverse=True):
+            code = code[:start] + text + code[end:]
+        return code
+
+
+def to_sorted_state(state) -> Optional[tuple]:
+    try:
+        return tuple(sorted(state))
+    except TypeError:
+        return None
+
+
+def get_problem_key(problem: Problem) -> tuple:
+    """
+    The type of a problem and the step it's about. The states aren't part of it, since repairing
+    a resulting_state is meant to change the states of the actions after it.
+    """
+    action = problem.action
+    return (
+        problem.type,
+        action["type"],
+        action.get("operation"),
+        str(action.get("subgoal_state")),
+    )
+
+
+def is_improvement(problems: list[Problem], repaired_problems: list[Problem]) -> bool:
+    """Whether a repair fixed a problem without adding any others or changing their types"""
+    problem_keys = [get_problem_key(problem) for problem in problems]
+    for problem in repaired_problems:
+        key = get_problem_key(problem)
+        if key not in problem_keys:
+            return False
+        problem_keys.remove(key)
+    return len(problem_keys) > 0
+
+
+def get_stated_result(operation: str):
+    """The number on the right-hand side of an operation, or None if it isn't a number"""
+    is_number, result = parse_number(operation[operation.rfind("=") + 1 :].strip(), operation)
+    return result if is_number else None
+
+
+def propose_repair(
+    source: Source, problem: Problem, state_space=None
+) -> Optional[tuple[str, Repair]]:
+    """The repaired code and the repair for a problem, if it has a mechanical fix"""
+    action = problem.action
+    if problem.suggested_fix is None or action["type"] != "explore_operation":
+        return None
+    call = source.calls[problem.action_index - 1]
+    if call.func.attr != action["type"]:
+        return None
+
+    if problem.type == ProblemType.RESULTING_STATE:
+        argument = get_argument(call, "resulting_state", 2)
+        if argument is None:
+            return None
+        resulting_state = action["resulting_state"]
+        if to_sorted_state(resulting_state) == to_sorted_state(problem.suggested_fix):
+            kind = "malformed_state"
+        elif get_stated_result(action["operation"]) in problem.suggested_fix:
+            kind = "resulting_state"
+        else:
+            return None
+        start, end = source.span(argument)
+        after = repr(problem.suggested_fix)
+        repair = Repair(kind, problem.action_index, str(resulting_state), after)
+        return source.edit([(start, end, after)]), repair
+
+    if problem.type == ProblemType.RUNNABILITY:
+        state_to_move_to = problem.suggested_fix
+        moved_action = {**action, "curr_state": state_to_move_to}
+        try:
+            expected_resulting_state = get_expected_resulting_state(moved_action, state_space)
+        except Exception:
+            return None
+        if to_sorted_state(expected_resulting_state) != to_sorted_state(
+            action["resulting_state"]
+        ):
+            return None
+        argument = get_argument(call, "curr_state", 0)
+        if argument is None:
+            return None
+        statement = source.statement(call)
+        statement_start = source.offset(statement.lineno, statement.col_offset)
+        indent = source.code[source.line_starts[statement.lineno - 1] : statement_start]
+        graph_name = source.text(call.func.value)
+        edits = [
+            (
+                statement_start,
+                statement_start,
+                f"curr_state = {graph_name}.move_to_node({state_to_move_to!r})\n{indent}",
+            )
+        ]
+        if not (isinstance(argument, ast.Name) and argument.id == "curr_state"):
+            edits.append((*source.span(argument), "curr_state"))
+        repair = Repair(
+            "move_to_node",
+            problem.action_index,
+            str(action["curr_state"]),
+            str(state_to_move_to),
+        )
+        return source.edit(edits), repair
+
+    return None
+
+
+def repair_code(
+    code: str, for_pretraining=True, state_space=None, max_repairs=20
+) -> tuple[str, list[Repair], list]:
+    """
+    Repair the problems of a code translation that have mechanical fixes.
+    Returns the repaired code, the repairs that were applied, and the problems that are left (in
+    the format of auto_checker.check_code). Code that doesn't need (or can't get) any repairs is
+    returned as it was. Repaired code is the preprocessed code (see utils.preprocess_response).
+    """
+    graph = run_compiled_code(code, for_pretraining)
+    if isinstance(graph, str):
+        return code, [], [graph]
+    problems = get_problem_records(graph, state_space)
+    try:
+        source = Source(preprocess_response(code, for_pretraining)[len(CODE_PREFIX) :])
+    except SyntaxError:
+        return code, [], format_problems(problems)
+    if len(source.calls) != len(graph.actions) - 1:
+        # the calls can't be matched up with the actions (e.g. a second GraphBuilder)
+        return code, [], format_problems(problems)
+
+    repairs = []
+    rejected = set()
+    while problems and len(repairs) < max_repairs:
+        for problem in problems:
+            key = (problem.type, problem.action_index)
+            if key in rejected:
+                continue
+            proposal = propose_repair(source, problem, state_space)
+            if proposal is not None:
+                break
+            rejected.add(key)
+        else:
+            break
+
+        repaired_code, repair = proposal
+        repaired_graph = run_compiled_code(repaired_code, for_pretraining)
+        repaired_problems = (
+            None
+            if isinstance(repaired_graph, str)
+            else get_problem_records(repaired_graph, state_space)
+        )
+        if repaired_problems is None or not is_improvement(problems, repaired_problems):
+            rejected.add(key)
+            continue
+        source = Source(repaired_code)
+        repairs.append(repair)
+        problems = repaired_problems
+        # the repair can change the actions after it, so every problem gets another chance
+        rejected = set()
+
+    if not repairs:
+        return code, [], format_problems(problems)
+    return source.code, repairs, format_problems(problems)
@@ -1,15 +1,27 @@
-from src.preproc.reasoning_graph_utils import tokenize, get_sub_operations
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Iterable, Optional
+from src.preproc.reasoning_graph_utils import tokenize
+from src.preproc.arithmetic import (
+    number_value,
+    parse_expression,
+    evaluate,
+    split_operation,
+    to_number,
+)
 import traceback
 import json
 
+# the most states that a runnability message suggests moving to
+MAX_SUGGESTED_STATES = 5
+
 
 def parse_number(number: str, operation: str):
     """
     Check if a number is valid.
     """
     try:
-        number = eval(number)
-        return True, number
+        return True, number_value(number)
     except Exception:
         return (
             False,
@@ -17,6 +29,18 @@ def parse_number(number: str, operation: str):
         )
 
 
+@lru_cache(maxsize=65536)
+def get_operation_elements(operation: str) -> tuple:
+    """
+    Parse the left-hand side of an operation once for all the checking tools: each token, whether
+    it's a number, and its value (or, for tokens that aren't numbers, parse_number's message).
+    """
+    return tuple(
+        (element, *parse_number(element, operation))
+        for element in tokenize(operation[: operation.rfind("=")])
+    )
+
+
 def is_op_well_formatted(operation: str) -> tuple[bool, str]:
     """
     Tool to check if an operation is well-formatted.
@@ -28,14 +52,9 @@ def is_op_well_formatted(operation: str) -> tuple[bool, str]:
         str: A message indicating if the operation is well-formatted, and if not, a suggestion for how to fix it.
     """
     try:
-        lhs = operation[: operation.rfind("=")]
-        elements = tokenize(lhs)
-        for element in elements:
-            if (
-                element not in ["+", "-", "*", "/", "(", ")"]
-                and not parse_number(element, operation)[0]
-            ):
-                return parse_number(element, operation)
+        for element, is_number, number in get_operation_elements(operation):
+            if element not in ["+", "-", "*", "/", "(", ")"] and not is_number:
+                return False, number
     # return error message if operation is not well-formatted
     except Exception as e:
         return False, e
@@ -74,6 +93,84 @@ def can_run_from_curr_state(
         bool: True if the operation can be run from the current state, False otherwise.
         str: A message indicating if the operation can be run from the current state, and if not, a suggestion for how to get to a state where the operation can be run.
     """
+    can_run, _, _, message = get_runnability(curr_state, operation, start_state, new_state)
+    return can_run, message
+
+
+class OperandStateIndex:
+    """
+    An index of the states of a graph by the numbers in them, to find every state that an
+    operation can be run from. A state with k copies of a number is filed under (number, 1) to
+    (number, k), so the states that hold the operands of an operation are the intersection of one
+    entry for each distinct operand, instead of a scan through every state.
+
+    Example usage:
+    --------
+    >>> state_index = OperandStateIndex([(1, 2, 3, 4), (3, 3, 4), (3, 4, 4)])
+    >>> state_index.find_states([3, 3])
+    [(3, 3, 4)]
+    """
+
+    def __init__(self, states: Iterable = ()):
+        # the states, in the order they were added
+        self.states = {}
+        self.entries = defaultdict(set)
+        # states are only indexed when they're looked up, since most graphs never need to be
+        self.pending = list(states)
+
+    def __len__(self):
+        self.update()
+        return len(self.states)
+
+    def __contains__(self, state):
+        self.update()
+        return state in self.states
+
+    def add(self, state) -> None:
+        """Add a state (states that can't be sorted are ignored when it's indexed)"""
+        self.pending.append(state)
+
+    def update(self) -> None:
+        """Index the states that have been added since the last lookup"""
+        for state in self.pending:
+            try:
+                state = tuple(sorted(state))
+                if state in self.states:
+                    continue
+            except TypeError:
+                continue
+            self.states[state] = len(self.states)
+            for number, count in Counter(state).items():
+                for k in range(1, count + 1):
+                    self.entries[(number, k)].add(state)
+        self.pending = []
+
+    def find_states(self, elements: Iterable) -> list[tuple]:
+        """Every state that has all of the elements (with repeats), in the order they were added"""
+        self.update()
+        entries = sorted(
+            (self.entries.get(key, set()) for key in Counter(elements).items()), key=len
+        )
+        if not entries:
+            return []
+        states = entries[0].intersection(*entries[1:])
+        return sorted(states, key=self.states.get)
+
+
+def get_runnability(
+    curr_state,
+    operation,
+    start_state,
+    new_state,
+    state_index: Optional[OperandStateIndex] = None,
+) -> tuple[bool, tuple, Optional[tuple], str]:
+    """
+    can_run_from_curr_state, along with the numbers of the operation that are missing from
+    curr_state and the state to move to before running it (None if there isn't one).
+    If an OperandStateIndex of the graph's states is given, operations that can't be run from
+    start_state or new_state are looked up in it, to suggest the existing states they can be run
+    from.
+    """
     # convert curr_state to tuple and sort it
     try:
         curr_state = sorted(curr_state)
@@ -81,20 +178,21 @@ def can_run_from_curr_state(
     except Exception:
         return (
             False,
+            (),
+            None,
             "The current state, start state, and new state must be valid tuples of numbers.",
         )
     elements = [
-        parse_number(element, operation)[1]
-        for element in tokenize(operation[: operation.rfind("=")])
-        if parse_number(element, operation)[0]
+        number for _, is_number, number in get_operation_elements(operation) if is_number
     ]
 
     # check if any of the elements are not in curr_state
     can_run_from_curr_state, elements_not_in_curr_state = (
         check_if_all_elements_in_state(elements, curr_state)
     )
+    missing_elements = tuple(elements_not_in_curr_state)
     if can_run_from_curr_state:
-        return True, "The operation can be run safely from the current state."
+        return True, (), None, "The operation can be run safely from the current state."
     else:
         # check if all of the elements of the operation are in start_state
         if (
@@ -103,6 +201,8 @@ def can_run_from_curr_state(
         ):
             return (
                 False,
+                missing_elements,
+                tuple(start_state),
                 f"You are missing the elements {tuple(elements_not_in_curr_state)} in curr_state {tuple(curr_state)}, but all elements needed for the operation are in the start_state {tuple(start_state)}. Consider moving to start_state before running the operation from there.",
             )
         # check if all of the elements in curr_state are in new_state
@@ -112,17 +212,34 @@ def can_run_from_curr_state(
         ):
             return (
                 False,
+                missing_elements,
+                tuple(new_state),
                 f"You are missing the elements {tuple(elements_not_in_curr_state)} in curr_state {tuple(curr_state)}, but all elements needed for the operation are in the new state {tuple(new_state)}. Consider moving to new_state before running the operation from there.",
             )
+        # check if all of the elements are in any other state of the graph
+        states = state_index.find_states(elements) if state_index is not None else []
+        if states:
+            states_str = ", ".join(str(state) for state in states[:MAX_SUGGESTED_STATES])
+            return (
+                False,
+                missing_elements,
+                states[0],
+                f"You are missing the elements {tuple(elements_not_in_curr_state)} in curr_state {tuple(curr_state)}, but all elements needed for the operation are in {'the existing state' if len(states) == 1 else 'the existing states'} {states_str}. Consider moving to {'it' if len(states) == 1 else 'one of them'} with move_to_node before running the operation from there.",
+            )
         else:
             return (
                 False,
+                missing_elements,
+                None,
                 f"You are missing the elements {tuple(elements_not_in_curr_state)} in curr_state {tuple(curr_state)}. They were not found in start_state{' ' + str(tuple(start_state)) if start_state is not None else ''} or new_state{' ' + str(tuple(new_state)) if new_state is not None else ''}. Make sure you are not inventing new elements. Consider ways the participant might have made the required numbers. Consider also that the participant might be setting a subgoal rather than exploring an operation.",
             )
 
 
 def get_resulting_state(
-    curr_state: str, operation: str, result_calc_error: bool = False
+    curr_state: str,
+    operation: str,
+    result_calc_error: bool = False,
+    ndigits: Optional[int] = 2,
 ) -> str:
     """
     Tool to get the resulting state of a graph after an operation is applied.
@@ -130,51 +247,49 @@ def get_resulting_state(
         curr_state (str): The current state of the graph.
         operation (str): The operation to be applied to the graph.
         result_calc_error (bool): Whether the result of the calculation the participant made is incorrect. defaults to False.
+        ndigits (int): The number of decimals to round the result to. None keeps the exact result. defaults to 2.
     Returns:
         str: The resulting state of the graph.
     """
-    sub_operations = get_sub_operations(operation[: operation.rfind("=")])
-    # remove elements from curr_state that are in sub_operations
+    lhs, rhs = split_operation(operation)
+    # remove elements from curr_state that are in the operation
     resulting_state = list(curr_state)
-    tokenized_lhs = tokenize(operation[: operation.rfind("=")])
-    for element in tokenized_lhs:
-        try:
-            element = eval(element)
-            if element in resulting_state:
-                resulting_state.remove(element)
-        except Exception:
-            pass
+    for _, is_number, element in get_operation_elements(operation):
+        if is_number and element in resulting_state:
+            resulting_state.remove(element)
 
     # add result of operation to curr_state
     if result_calc_error:
-        result = eval(operation[operation.rfind("=") + 1 :])
+        parse_expression(lhs)
+        result = evaluate(rhs)
     else:
-        try:
-            result = sub_operations[-1][-1]
-        except Exception:
+        if not any(isinstance(token, str) for token in parse_expression(lhs)):
             print(f"Error getting result of operation {operation}")
-            print(f"sub_operations: {sub_operations}")
             print(f"curr_state: {curr_state}")
-            print(traceback.format_exc())
             raise Exception(f"Missing sub-operation result of operation {operation}")
+        result = evaluate(lhs)
 
-    result = round(result, 2)
+    result = to_number(result, ndigits)
     resulting_state = tuple(sorted(resulting_state + [result]))
-    operation = operation[: operation.rfind("=")] + f"={result}"
+    operation = lhs + f"={result}"
 
     return resulting_state, operation
 
 
-def can_set_subgoal(subgoal_state: tuple, state_after_subgoal: tuple) -> str:
+def can_set_subgoal(
+    subgoal_state: tuple, state_after_subgoal: tuple, state_space=None
+) -> str:
     """
     tool to check if a subgoal can be set. use this tool before every time you want to call set_subgoal.
 
     args:
         subgoal_state: the current state of the graph (tuple)
         state_after_subgoal: the state that the participant is trying to reach after the subgoal is reached (tuple)
+        state_space: if given (a CountdownStateSpace), also check that the state after the subgoal can be made from the subgoal state
     returns:
         str: a message indicating if the subgoal can be set and the result
     """
+    goal_state = (24,) if state_space is None else state_space.goal_state
     try:
         assert isinstance(subgoal_state, tuple) or isinstance(subgoal_state, list)
         assert isinstance(state_after_subgoal, tuple) or isinstance(
@@ -182,11 +297,18 @@ def can_set_subgoal(subgoal_state: tuple, state_after_subgoal: tuple) -> str:
         )
         subgoal_state = tuple(subgoal_state)
         state_after_subgoal = tuple(state_after_subgoal)
+        if state_space is not None and not state_space.can_reach(
+            subgoal_state, state_after_subgoal
+        ):
+            return (
+                False,
+                f"The state after the subgoal {state_after_subgoal} can't be made from the subgoal state {subgoal_state}. Check that both states are the ones the participant mentioned.",
+            )
         return True, "The subgoal can be set."
     except Exception:
         return (
             False,
-            f"Error parsing input:\n{traceback.format_exc()}\nplease provide input in the format: e.g., {{'subgoal_state': (x, y), 'state_after_subgoal': (24,)}}",
+            f"Error parsing input:\n{traceback.format_exc()}\nplease provide input in the format: e.g., {{'subgoal_state': (x, y), 'state_after_subgoal': {goal_state}}}",
         )
 
 
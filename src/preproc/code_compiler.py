@@ -0,0 +1,316 @@
+"""
+A restricted compiler for code translations, which replays them into a GraphBuilder without exec.
+
+Code translations only use a tiny subset of Python: variable assignments, tuples of numbers and
+calls to GraphBuilder(...), explore_operation, move_to_node and set_subgoal. `compile_code` parses a
+translation with `ast`, checks that it stays inside that subset, and lowers each statement to a
+closure, so the compiled program can be cached and replayed any number of times (from any thread)
+without touching module globals, linecache or exec.
+
+Code that falls outside the subset raises an UnsupportedCode error, and a statement that fails
+while replaying raises a ReplayError with its line. `run_compiled_code` is a replacement for
+utils.run_code that returns an error message for such code instead of exec'ing it. Parity checks
+against run_code (see scripts/benchmark_code_compiler.py) can opt into falling back to run_code,
+which returns exactly the same graphs and error messages.
+
+Example usage:
+--------
+>>> graph = run_compiled_code(code, for_pretraining=False)
+>>> program = compile_code(code, for_pretraining=False)
+>>> graph = program.run(CompactGraphBuilder)
+"""
+
+import ast
+import gc
+import operator
+from contextlib import contextmanager
+from functools import lru_cache
+from src.preproc.reasoning_graph import GraphBuilder
+from src.preproc.utils import MISSING_EQUALS_HINT, preprocess_response, run_code
+
+# preprocess_response puts "global graph" before the translation, so line numbers in the
+# preprocessed code are one more than in the translation
+LINE_OFFSET = 1
+
+# the GraphBuilder methods that code translations can call
+DSL_METHODS = {"explore_operation", "move_to_node", "set_subgoal"}
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+}
+
+UNARY_OPERATORS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+
+class UnsupportedCode(Exception):
+    """Raised when a code translation uses Python outside the GraphBuilder subset"""
+
+
+class ReplayError(Exception):
+    """Raised when a statement of a compiled program fails, with the line it's on"""
+
+    def __init__(self, lineno: int, statement: str, error: Exception):
+        super().__init__(f"line {lineno}: {statement}\n{type(error).__name__}: {error}")
+        self.lineno = lineno
+        self.statement = statement
+        self.error = error
+
+
+@contextmanager
+def gc_paused():
+    """
+    Pause the cyclic garbage collector. Parsing allocates lots of small AST objects, which
+    otherwise trigger many collections that can't free anything.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+class Program:
+    """
+    A compiled code translation: a list of statements, each a closure that runs on a dict of
+    variables, along with the (preprocessed) code and the lines that each statement spans.
+    Programs are immutable, so they can be shared and replayed concurrently.
+    """
+
+    def __init__(self, statements, spans, code):
+        self.statements = statements
+        self.spans = spans
+        self.code = code
+
+    def get_statement(self, index: int) -> tuple[int, str]:
+        """The line number (in the translation) and source of a statement"""
+        lineno, end_lineno = self.spans[index]
+        source = "".join(self.code.splitlines(keepends=True)[lineno - 1 : end_lineno])
+        return lineno - LINE_OFFSET, source.strip()
+
+    def run(self, graph_builder_cls=GraphBuilder):
+        """
+        Replay the program and return the graph it builds. Raises a ReplayError if a statement
+        fails.
+        """
+        variables = {"GraphBuilder": graph_builder_cls}
+        for index, statement in enumerate(self.statements):
+            try:
+                statement(variables)
+            except Exception as e:
+                raise ReplayError(*self.get_statement(index), e) from e
+        if "graph" not in variables:
+            raise NameError("name 'graph' is not defined")
+        return variables["graph"]
+
+
+def compile_expression(node: ast.expr):
+    """Lower an expression to a closure that evaluates it on a dict of variables"""
+    if isinstance(node, ast.Constant):
+        value = node.value
+        if not isinstance(value, (int, float, str, type(None))):
+            raise UnsupportedCode(f"Unsupported constant {value!r}")
+        return lambda variables: value
+
+    if isinstance(node, ast.Name):
+        name = node.id
+
+        def load_name(variables):
+            try:
+                return variables[name]
+            except KeyError:
+                raise NameError(f"name '{name}' is not defined") from None
+
+        return load_name
+
+    if isinstance(node, (ast.Tuple, ast.UnaryOp)):
+        # fold tuples of numbers (e.g. states) and negative numbers into constants
+        try:
+            value = ast.literal_eval(node)
+            # only fold immutable values, since the constant is shared by every replay
+            hash(value)
+        except (ValueError, TypeError):
+            pass
+        else:
+            return lambda variables: value
+
+    if isinstance(node, (ast.Tuple, ast.List)):
+        if any(isinstance(element, ast.Starred) for element in node.elts):
+            raise UnsupportedCode("Unsupported starred expression")
+        elements = [compile_expression(element) for element in node.elts]
+        container = tuple if isinstance(node, ast.Tuple) else list
+        return lambda variables: container(element(variables) for element in elements)
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        unary_operator = UNARY_OPERATORS[type(node.op)]
+        operand = compile_expression(node.operand)
+        return lambda variables: unary_operator(operand(variables))
+
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        binary_operator = BINARY_OPERATORS[type(node.op)]
+        left = compile_expression(node.left)
+        right = compile_expression(node.right)
+        return lambda variables: binary_operator(left(variables), right(variables))
+
+    if isinstance(node, ast.Subscript) and not isinstance(node.slice, ast.Slice):
+        value = compile_expression(node.value)
+        index = compile_expression(node.slice)
+
+        def subscript(variables):
+            container = value(variables)
+            if not isinstance(container, (tuple, list)):
+                raise UnsupportedCode("Only tuples and lists can be indexed")
+            return container[index(variables)]
+
+        return subscript
+
+    if isinstance(node, ast.Call):
+        return compile_call(node)
+
+    if isinstance(node, ast.Attribute) and node.attr in DSL_METHODS:
+        # a DSL method that isn't called, e.g. in a translation that was cut off
+        graph = compile_expression(node.value)
+        method_name = node.attr
+
+        def load_method(variables):
+            graph_builder = graph(variables)
+            if not isinstance(graph_builder, GraphBuilder):
+                raise UnsupportedCode(f"{method_name} can only be used on a GraphBuilder")
+            return getattr(graph_builder, method_name)
+
+        return load_method
+
+    raise UnsupportedCode(f"Unsupported expression: {type(node).__name__}")
+
+
+def compile_call(node: ast.Call):
+    """Lower a call to GraphBuilder(...) or to one of the DSL methods of a graph"""
+    if any(isinstance(arg, ast.Starred) for arg in node.args) or any(
+        keyword.arg is None for keyword in node.keywords
+    ):
+        raise UnsupportedCode("Unsupported * or ** arguments")
+    args = [compile_expression(arg) for arg in node.args]
+    kwargs = [(keyword.arg, compile_expression(keyword.value)) for keyword in node.keywords]
+
+    if isinstance(node.func, ast.Name) and node.func.id == "GraphBuilder":
+
+        def call_graph_builder(variables):
+            return variables["GraphBuilder"](
+                *[arg(variables) for arg in args],
+                **{name: value(variables) for name, value in kwargs},
+            )
+
+        return call_graph_builder
+
+    if isinstance(node.func, ast.Attribute) and node.func.attr in DSL_METHODS:
+        graph = compile_expression(node.func.value)
+        method_name = node.func.attr
+
+        def call_method(variables):
+            graph_builder = graph(variables)
+            if not isinstance(graph_builder, GraphBuilder):
+                raise UnsupportedCode(f"{method_name} can only be called on a GraphBuilder")
+            return getattr(graph_builder, method_name)(
+                *[arg(variables) for arg in args],
+                **{name: value(variables) for name, value in kwargs},
+            )
+
+        return call_method
+
+    raise UnsupportedCode(f"Unsupported call to {ast.unparse(node.func)}")
+
+
+def compile_statement(node: ast.stmt):
+    """Lower a statement to a closure that runs it on a dict of variables, or None for a no-op"""
+    if isinstance(node, (ast.Global, ast.Pass)):
+        return None
+
+    if isinstance(node, ast.Expr):
+        if isinstance(node.value, ast.Constant):
+            # a bare string (e.g. used as a comment)
+            return None
+        return compile_expression(node.value)
+
+    if isinstance(node, ast.Assign):
+        if not all(isinstance(target, ast.Name) for target in node.targets):
+            raise UnsupportedCode("Only assignments to variables are supported")
+        names = [target.id for target in node.targets]
+        value = compile_expression(node.value)
+
+        def assign(variables):
+            result = value(variables)
+            for name in names:
+                variables[name] = result
+
+        return assign
+
+    raise UnsupportedCode(f"Unsupported statement: {type(node).__name__}")
+
+
+@lru_cache(maxsize=4096)
+def compile_preprocessed_code(code: str) -> Program:
+    with gc_paused():
+        tree = ast.parse(code)
+    statements = []
+    spans = []
+    for node in tree.body:
+        try:
+            statement = compile_statement(node)
+        except UnsupportedCode as e:
+            raise UnsupportedCode(f"{e} (line {node.lineno - LINE_OFFSET})") from None
+        if statement is not None:
+            statements.append(statement)
+            spans.append((node.lineno, node.end_lineno))
+    return Program(statements, spans, code)
+
+
+def compile_code(code: str, for_pretraining=True) -> Program:
+    """
+    Compile a code translation (with the same preprocessing as run_code) into a Program.
+    Raises a SyntaxError if the code can't be parsed, or UnsupportedCode if it uses Python outside
+    the GraphBuilder subset.
+    """
+    return compile_preprocessed_code(preprocess_response(code, for_pretraining))
+
+
+def format_error(error: Exception) -> str:
+    """The error message for a translation that can't be compiled or fails while replaying"""
+    if isinstance(error, ReplayError):
+        message = f"Error running code. The code failed on {error}"
+        # with the same hint as run_code
+        if isinstance(error.error, IndexError) and str(error.error) == "pop from empty list":
+            message += f"\n\n{MISSING_EQUALS_HINT}"
+        return message
+    if isinstance(error, SyntaxError):
+        lineno = (error.lineno or LINE_OFFSET) - LINE_OFFSET
+        return f"Error running code. The code has a syntax error on line {lineno}: {(error.text or '').strip()}\nSyntaxError: {error.msg}"
+    if isinstance(error, UnsupportedCode):
+        return f"Error running code. The code can only assign variables and call GraphBuilder(...), {', '.join(sorted(DSL_METHODS))}:\nUnsupportedCode: {error}"
+    return f"Error running code:\n{type(error).__name__}: {error}"
+
+
+def run_compiled_code(code, for_pretraining=True, graph_builder_cls=GraphBuilder, fallback=False):
+    """
+    Run a code translation by replaying its compiled program, returning the graph it builds, or an
+    error message (with the failing line) if the code can't be compiled or fails. The code is never
+    exec'd.
+
+    With `fallback=True`, such code falls back to utils.run_code instead, so the result (including
+    the error message for code that fails) is exactly what run_code returns. That execs the code,
+    so only use it to check parity with run_code on trusted translations.
+    """
+    try:
+        return compile_code(code, for_pretraining).run(graph_builder_cls)
+    except Exception as e:
+        error = format_error(e)
+    # fall back outside the except block, so the exception doesn't show up in run_code's traceback
+    if fallback:
+        return run_code(code, for_pretraining, graph_builder_cls)
+    return error
@@ -0,0 +1,260 @@
+"""
+Run many code translations in a pool of sandboxed worker processes, so that a translation that
+hangs or uses up the memory only fails itself, instead of the whole batch (or the process running
+it). Each translation still runs through run_compiled_code, so the results are the same as in
+process.
+
+The workers are started once and reused for every translation (GraphBuilder and the code compiler
+are imported before the workers start), and send each graph back serialized with
+GraphBuilder.to_bytes. A translation that runs for longer than the timeout has its worker killed
+and replaced. Each worker's address space is limited to what it uses once it has started plus
+`max_mem` bytes, so allocations beyond that fail with a MemoryError inside the worker (which is
+reported like any other error in the code), or kill the worker (which is replaced).
+
+Example usage:
+--------
+>>> results = run_code_many(codes, workers=8, timeout=10, max_mem=2**30)
+>>> with CodeRunner(workers=8, timeout=10) as runner:
+...     results = runner.run_many(codes)  # graphs, or error messages like run_code's
+...     more_results = runner.run_many(more_codes)  # with the same workers
+"""
+
+import os
+import pickle
+import time
+from multiprocessing import connection as mp_connection
+from multiprocessing import get_all_start_methods, get_context
+from typing import Iterable, Optional, Union
+from src.preproc.reasoning_graph import GraphBuilder
+from src.preproc.code_compiler import run_compiled_code
+
+try:
+    import resource
+except ImportError:  # not available on Windows, where memory isn't limited
+    resource = None
+
+GRAPH_ENTRY = b"G"
+ERROR_ENTRY = b"E"
+OBJECT_ENTRY = b"O"
+
+# the start of the error messages for translations that were stopped by the runner, rather than
+# failing by themselves (see is_stopped_error)
+STOPPED_ERROR = "Error running code. The code was stopped"
+
+
+def encode_result(result) -> bytes:
+    """Serialize the result of running a translation: a graph, an error message or anything else"""
+    if isinstance(result, GraphBuilder):
+        return GRAPH_ENTRY + result.to_bytes()
+    if isinstance(result, str):
+        return ERROR_ENTRY + result.encode()
+    return OBJECT_ENTRY + pickle.dumps(result)
+
+
+def decode_result(data: bytes) -> Union[GraphBuilder, str, object]:
+    if data[:1] == GRAPH_ENTRY:
+        return GraphBuilder.from_bytes(data[1:])
+    if data[:1] == ERROR_ENTRY:
+        return data[1:].decode()
+    return pickle.loads(data[1:])
+
+
+def is_stopped_error(result) -> bool:
+    """
+    Whether a result is the error of a translation that timed out or crashed its worker. These
+    depend on the machine and the load, so they shouldn't be cached like other results.
+    """
+    return isinstance(result, str) and result.startswith(STOPPED_ERROR)
+
+
+def get_address_space() -> int:
+    """The size of the address space of this process, in bytes (0 if it isn't known)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def limit_memory(max_mem: Optional[int]) -> None:
+    """Limit the memory that this process can allocate on top of what it already uses"""
+    if max_mem is None or resource is None:
+        return
+    limit = get_address_space() + max_mem
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+    if hard_limit != resource.RLIM_INFINITY:
+        limit = min(limit, hard_limit)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard_limit))
+
+
+def run_to_bytes(code, for_pretraining: bool) -> bytes:
+    """Run a translation and serialize its result, reporting any failure as an error message"""
+    try:
+        return encode_result(run_compiled_code(code, for_pretraining))
+    except Exception as e:
+        # e.g. code that isn't a string, or a MemoryError while serializing the graph
+        return encode_result(f"Error running code. {type(e).__name__}: {e}")
+
+
+def worker_main(connection, for_pretraining: bool, max_mem: Optional[int]) -> None:
+    """Run the translations sent over the connection until it's closed"""
+    limit_memory(max_mem)
+    while True:
+        try:
+            code = connection.recv()
+        except (EOFError, OSError):
+            break
+        connection.send_bytes(run_to_bytes(code, for_pretraining))
+
+
+class Worker:
+    """A worker process, and the connection to send it translations over"""
+
+    def __init__(self, context, for_pretraining: bool, max_mem: Optional[int]):
+        self.connection, worker_connection = context.Pipe()
+        self.process = context.Process(
+            target=worker_main,
+            args=(worker_connection, for_pretraining, max_mem),
+            daemon=True,
+        )
+        self.process.start()
+        worker_connection.close()
+        # the index of the translation the worker is running, and when it has to finish by
+        self.index = None
+        self.deadline = None
+
+    def submit(self, index: int, code, timeout: Optional[float]) -> None:
+        self.index = index
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.connection.send(code)
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+    def close(self) -> None:
+        self.connection.close()
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.kill()
+
+
+class CodeRunner:
+    """
+    A pool of worker processes that run code translations (see the module docstring).
+
+    Args:
+        workers: the number of worker processes. Defaults to the number of CPUs.
+        timeout: the seconds each translation can run for, or None for no limit
+        max_mem: the bytes of memory each translation can allocate, or None for no limit
+        for_pretraining: passed to run_code
+
+    A runner should only be used from one thread at a time. Workers are started when they're
+    first needed, and stopped by close() (or at the end of a with block).
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        timeout: Optional[float] = None,
+        max_mem: Optional[int] = None,
+        for_pretraining=True,
+    ):
+        self.n_workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.max_mem = max_mem
+        self.for_pretraining = for_pretraining
+        # workers are forked from a server process that has already imported this module, so
+        # they start warm without forking the (possibly multithreaded) parent
+        if "forkserver" in get_all_start_methods():
+            self.context = get_context("forkserver")
+            self.context.set_forkserver_preload([__name__])
+        else:
+            self.context = get_context("spawn")
+        self.workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        for worker in self.workers:
+            worker.close()
+        self.workers = []
+
+    def start_worker(self) -> Worker:
+        return Worker(self.context, self.for_pretraining, self.max_mem)
+
+    def run_many(self, codes: Iterable) -> list:
+        """Run the translations, returning the graph (or error message) for each, in order"""
+        codes = list(codes)
+        results = [None] * len(codes)
+        while len(self.workers) < min(self.n_workers, len(codes)):
+            self.workers.append(self.start_worker())
+
+        next_index = 0
+        idle = list(self.workers)
+        busy = {}
+        while next_index < len(codes) or busy:
+            while idle and next_index < len(codes):
+                worker = idle.pop()
+                try:
+                    worker.submit(next_index, codes[next_index], self.timeout)
+                except OSError:
+                    # the worker died before it got the code. It'll be reported as a crash.
+                    pass
+                busy[worker.connection] = worker
+                next_index += 1
+
+            deadlines = [worker.deadline for worker in busy.values() if worker.deadline is not None]
+            wait_timeout = (
+                max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            )
+            for connection in mp_connection.wait(list(busy), timeout=wait_timeout):
+                worker = busy.pop(connection)
+                try:
+                    results[worker.index] = decode_result(connection.recv_bytes())
+                    idle.append(worker)
+                except (EOFError, OSError):
+                    worker.process.join(timeout=1)
+                    results[worker.index] = (
+                        f"{STOPPED_ERROR}, because it crashed the process running it (exit code "
+                        f"{worker.process.exitcode}). It may have run out of memory."
+                    )
+                    idle.append(self.replace_worker(worker))
+
+            now = time.monotonic()
+            for connection, worker in list(busy.items()):
+                if worker.deadline is not None and now >= worker.deadline:
+                    del busy[connection]
+                    results[worker.index] = (
+                        f"{STOPPED_ERROR}, because it didn't finish within {self.timeout} seconds."
+                    )
+                    idle.append(self.replace_worker(worker))
+
+        return results
+
+    def replace_worker(self, worker: Worker) -> Worker:
+        """Kill a worker and start a new one in its place"""
+        worker.kill()
+        new_worker = self.start_worker()
+        self.workers[self.workers.index(worker)] = new_worker
+        return new_worker
+
+
+def run_code_many(
+    codes: Iterable,
+    workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    max_mem: Optional[int] = None,
+    for_pretraining=True,
+) -> list:
+    """
+    Run many code translations in sandboxed worker processes (see CodeRunner), returning the
+    graph (or error message) for each, in order
+    """
+    with CodeRunner(workers, timeout, max_mem, for_pretraining) as runner:
+        return runner.run_many(codes)
@@ -0,0 +1,140 @@
+"""
+Salvage the part of a code translation that runs, so that a translation that fails partway through
+can be fixed by regenerating only the code from the failing statement on, instead of the whole
+translation.
+
+The code is run one top-level statement at a time, in the same namespace as run_code, until a
+statement raises. Code with a syntax error is cut back to the statements before the error, which
+are run the same way. The statements before the failing one are the prefix that's kept, and the
+graph they build is rebuilt from the prefix alone, so it doesn't include any actions that the
+failing statement added before it raised.
+
+Example usage:
+--------
+>>> partial_run = run_partial(code)
+>>> partial_run.lineno, partial_run.statement, partial_run.error
+(7, "new_state = graph.explore_operation(curr_state, '8=3=5', (5, 6))", "ValueError: Invalid character '=' in expression")
+>>> partial_run.graph  # the graph built by partial_run.prefix
+>>> fixed_code = splice_tail(partial_run.prefix, model_response)  # the prefix and the new tail
+"""
+
+import ast
+import traceback
+from dataclasses import dataclass
+from typing import Optional, Union
+from src.preproc import utils
+from src.preproc.auto_repair import CODE_PREFIX
+from src.preproc.code_compiler import run_compiled_code
+from src.preproc.reasoning_graph import GraphBuilder
+from src.preproc.utils import preprocess_response
+
+
+@dataclass
+class PartialRun:
+    """
+    The result of running a code translation up to its first failing statement.
+
+    Attributes:
+        prefix: the code of the statements that ran, as preprocessed by preprocess_response
+            (without its "global graph" line)
+        graph: the graph that the prefix builds, or run_code's error message if it doesn't build
+            one (e.g. when the GraphBuilder is created by the failing statement)
+        error: the exception of the failing statement (e.g. "KeyError: (8, 14)"), or None if the
+            whole code ran
+        lineno: the line where the code failed, counting from the first line of the prefix
+        statement: the failing statement, or the lines up to a syntax error
+    """
+
+    prefix: str
+    graph: Union[GraphBuilder, str]
+    error: Optional[str] = None
+    lineno: Optional[int] = None
+    statement: Optional[str] = None
+
+    @property
+    def has_graph(self) -> bool:
+        return isinstance(self.graph, GraphBuilder)
+
+
+def parse_prefix(lines: list[str], end: int) -> list[ast.stmt]:
+    """The statements of the longest prefix of the first `end` lines that parses"""
+    for n_lines in range(end, 0, -1):
+        try:
+            return ast.parse("".join(lines[:n_lines])).body
+        except SyntaxError:
+            continue
+    return []
+
+
+def get_error_lineno(exception: BaseException) -> Optional[int]:
+    """The line of the translation that raised an exception, from its traceback"""
+    frames = [
+        frame
+        for frame in traceback.extract_tb(exception.__traceback__)
+        if frame.filename == "<string>"
+    ]
+    return frames[-1].lineno if frames else None
+
+
+def format_error(exception: BaseException) -> str:
+    return "".join(traceback.format_exception_only(type(exception), exception)).strip()
+
+
+def run_partial(code, for_pretraining=True) -> PartialRun:
+    """Run a code translation up to its first failing statement (see the module docstring)"""
+    source = preprocess_response(code, for_pretraining)[len(CODE_PREFIX) :]
+    lines = source.splitlines(keepends=True)
+    syntax_error = None
+    try:
+        statements = ast.parse(source, "<string>").body
+    except SyntaxError as e:
+        syntax_error = e
+        statements = parse_prefix(lines, (e.lineno or 1) - 1)
+
+    namespace = {**vars(utils), "GraphBuilder": GraphBuilder}
+    n_run = 0
+    error = lineno = statement = None
+    for statement_node in statements:
+        module = ast.Module(body=[statement_node], type_ignores=[])
+        try:
+            exec(compile(module, "<string>", "exec"), namespace)
+        except Exception as e:
+            error = format_error(e)
+            lineno = get_error_lineno(e) or statement_node.lineno
+            statement = ast.get_source_segment(source, statement_node)
+            break
+        n_run += 1
+
+    prefix_end = statements[n_run - 1].end_lineno if n_run > 0 else 0
+    if error is None and syntax_error is not None:
+        error = format_error(syntax_error)
+        lineno = syntax_error.lineno
+        statement = "".join(lines[prefix_end:lineno]).strip()
+    prefix = "".join(lines[:prefix_end])
+    if error is None:
+        prefix = source
+    return PartialRun(
+        prefix=prefix,
+        graph=run_compiled_code(prefix, for_pretraining),
+        error=error,
+        lineno=lineno,
+        statement=statement,
+    )
+
+
+def get_tail(response: str, prefix: str) -> str:
+    """The code in a model's response, without the prefix if the model repeated it"""
+    if "</think>" in response:
+        response = response.split("</think>")[1]
+    tail = response.replace("```python", "").replace("```", "").strip()
+    if prefix.strip() and tail.startswith(prefix.strip()):
+        tail = tail[len(prefix.strip()) :].strip()
+    return tail
+
+
+def splice_tail(prefix: str, response: str) -> str:
+    """The code of the kept prefix, followed by the regenerated tail in a model's response"""
+    tail = get_tail(response, prefix)
+    if not prefix.strip():
+        return tail
+    return f"{prefix.rstrip()}\n{tail}"
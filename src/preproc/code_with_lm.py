@@ -3,27 +3,61 @@ Code the countdown data using constrained generation via the Fireworks API.
 """
 
 from ast import literal_eval
+import asyncio
 import os
+from dataclasses import replace
+import time
 import numpy as np
 import pandas as pd
 from pyprojroot import here
-from datetime import datetime
 import submitit
-import json
-from glob import glob
 from fireworks.client import Fireworks
 from openai import OpenAI, BadRequestError
-from src.preproc.prompts import get_translation_prompt, get_correction_prompt
-from src.preproc.auto_checker import check_graph, get_problems_str
-from src.preproc.utils import run_code
+from src.preproc.prompts import (
+    get_translation_prompt,
+    get_correction_prompt,
+    get_tail_prompt,
+)
+from src.preproc.auto_checker import check_code, get_problems_str
+from src.preproc.auto_repair import repair_code
+from src.preproc.code_salvage import run_partial, splice_tail
+from src.preproc.graph_store import GraphStore
+from src.preproc.response_cache import get_response_cache
+from src.preproc.async_coding import (
+    PROVIDER_LIMITS,
+    CodingEngine,
+    ModelRequest,
+    get_api_type,
+    run_steps,
+)
 import anthropic
 import backoff
 
 test_prompt = "start state: {start_state}\nresponse: {response}\nresponse time: {rt_s} seconds\ntranscript: {transcript}"
 
 
-@backoff.on_exception(backoff.expo, Exception, max_time=600)
 def get_model_response(api_type, client, system_prompt, full_messages, args, temp=0.0):
+    """
+    The model's response to a request. If args["response_cache_path"] is set, responses are
+    loaded from (and saved to) the response cache there, so that reruns don't call the model.
+    """
+    cache = get_response_cache(args.get("response_cache_path"))
+    if cache is None:
+        return request_model_response(
+            api_type, client, system_prompt, full_messages, args, temp
+        )
+    key = cache.next_key(args["model_name"], system_prompt, full_messages, temp)
+    translation = cache.get(key)
+    if translation is None:
+        translation = request_model_response(
+            api_type, client, system_prompt, full_messages, args, temp
+        )
+        cache.put(key, args["model_name"], translation)
+    return translation
+
+
+@backoff.on_exception(backoff.expo, Exception, max_time=600)
+def request_model_response(api_type, client, system_prompt, full_messages, args, temp=0.0):
     if api_type == "openai":
         system_role = (
             "system" if "gpt" in args["model_name"] else "user"
@@ -55,19 +89,66 @@ def get_model_response(api_type, client, system_prompt, full_messages, args, tem
         )
         translation = chat_completion.choices[0].message.content
 
-    # save the result to the prompt cache (in case of error elsewhere in code)
-
     return translation
 
 
+def repair_and_check(translation, args, check=check_code, problems=None):
+    """
+    Apply the mechanical repairs to a translation (if args["auto_repair"] is set), then
+    check it with `check`. Returns the translation, the repairs that were applied and its
+    problems. The problems of the translation can be given if it was checked already.
+    """
+    repairs = []
+    # code that's known to have no problems doesn't need repairs
+    if args.get("auto_repair") and (problems is None or problems):
+        # repair_code checks the code it returns
+        translation, repairs, problems = repair_code(translation)
+    elif problems is None:
+        _, problems = check(translation)
+    return translation, repairs, problems
+
+
+def get_feedback_problems(translation, problems, args):
+    """
+    The problems of a translation to give the model feedback on. With
+    args["stop_at_first_problem"], the code stops at the first action with a problem, so retries
+    get feedback on one problem at a time.
+    """
+    if problems and args.get("stop_at_first_problem", False):
+        _, problems = check_code(translation, stop_at_first_problem=True)
+    return problems
+
+
+def count_problems(problems):
+    return sum(
+        len(problem["Problems"]) if isinstance(problem, dict) else 1 for problem in problems
+    )
+
+
 def try_retry(features, translation, problems, api_type, client, args):
     """
     When code fails the auto-checker, make another call to the language model to try fixing it
     """
+    return run_steps(
+        retry_steps(features, translation, problems, args),
+        lambda request: get_model_response(
+            api_type, client, request.system_prompt, request.messages, args, temp=request.temp
+        ),
+    )
+
+
+def retry_steps(features, translation, problems, args, check=check_code):
+    """
+    The steps of try_retry, as a generator that yields a ModelRequest for each call to the
+    language model and is sent its response (see async_coding). Translations are checked with
+    `check`.
+    """
 
     system_prompt, base_messages = get_correction_prompt()
+    tail_system_prompt, tail_messages = get_tail_prompt()
 
     best_translation = translation
+    best_problems = problems
     if "Error running code" in problems[0]:
         best_n_problems = 9999
     else:
@@ -81,34 +162,61 @@ def try_retry(features, translation, problems, api_type, client, args):
             "n_problems": best_n_problems,
             "problems": problems,
             "temp": 0.0,
+            "repairs": [],
+            "retry_mode": None,
+            "n_prompt_chars": None,
+            "n_response_chars": None,
         }
     ]
 
     temp = 0.0
     for i in range(5):
-        # convert a list of dictionaries to a string
-        if "Error running code" in problems[0]:
-            problems_str = problems[0]
+        # when the best translation fails partway through, keep the statements that ran and only
+        # ask for the code from the failing statement on (if args["tail_retry"] is set)
+        partial_run = None
+        if best_n_problems == 9999 and args.get("tail_retry"):
+            partial_run = run_partial(best_translation)
+            if partial_run.error is None or not partial_run.has_graph:
+                partial_run = None
+
+        if partial_run is not None:
+            retry_mode = "tail"
+            message = {
+                "role": "user",
+                "content": test_prompt.format(**features)
+                + f"\n\ncode that ran:\n{partial_run.prefix}"
+                + f"\n\nfailing statement (line {partial_run.lineno}):\n{partial_run.statement}"
+                + f"\n\nerror:\n{partial_run.error}",
+            }
+            prompt = tail_messages + [message]
+            prompt_system = tail_system_prompt
         else:
-            problems_str = get_problems_str(problems)
-
-        message = {
-            "role": "user",
-            "content": test_prompt.format(**features)
-            + f"\n\noriginal code:\n{best_translation}\n\nproblems:\n{problems_str}",
-        }
-        prompt = base_messages + [message]
-
-        translation = get_model_response(
-            api_type, client, system_prompt, prompt, args, temp=temp
-        )
+            retry_mode = "full"
+            # translations are scored on all of their problems, but the model may only be given
+            # feedback on the first
+            feedback_problems = get_feedback_problems(best_translation, best_problems, args)
+            # convert a list of dictionaries to a string
+            if "Error running code" in feedback_problems[0]:
+                problems_str = feedback_problems[0]
+            else:
+                problems_str = get_problems_str(feedback_problems)
+
+            message = {
+                "role": "user",
+                "content": test_prompt.format(**features)
+                + f"\n\noriginal code:\n{best_translation}\n\nproblems:\n{problems_str}",
+            }
+            prompt = base_messages + [message]
+            prompt_system = system_prompt
 
-        # run and check the code
-        graph = run_code(translation)
-        if isinstance(graph, str):
-            problems = [graph]
+        response = yield ModelRequest(prompt_system, prompt, temp)
+        if partial_run is not None:
+            translation = splice_tail(partial_run.prefix, response)
         else:
-            problems = check_graph(graph)
+            translation = response
+
+        # repair, run and check the code
+        translation, repairs, problems = repair_and_check(translation, args, check)
 
         # compute the number of problems
         if len(problems) >= 1 and "Error running code" in problems[0]:
@@ -128,12 +236,18 @@ def try_retry(features, translation, problems, api_type, client, args):
                 "n_problems": n_problems,
                 "problems": problems,
                 "temp": temp,
+                "repairs": [str(repair) for repair in repairs],
+                "retry_mode": retry_mode,
+                "n_prompt_chars": len(prompt_system)
+                + sum(len(prompt_message["content"]) for prompt_message in prompt),
+                "n_response_chars": len(response),
             }
         )
 
         # If this translation is better than the current best, replace the current best
         if n_problems < best_n_problems:
             best_translation = translation
+            best_problems = problems
             best_n_problems = n_problems
             temp = 0.0  # reset temperature if we've improved
         else:
@@ -149,79 +263,153 @@ def try_retry(features, translation, problems, api_type, client, args):
     return best_translation, df_log
 
 
-def code_rows(df_chunk, args):
-
-    # if we're using an OpenAI model:
-    if "gpt" in args["model_name"] or "o1" in args["model_name"]:
-        client = OpenAI(
+def get_client(api_type):
+    if api_type == "openai":
+        return OpenAI(
             api_key=os.environ["OPENAI_API_KEY"],
         )
-        api_type = "openai"
-    elif "claude" in args["model_name"]:
-        client = anthropic.Anthropic(
+    if api_type == "anthropic":
+        return anthropic.Anthropic(
             api_key=os.environ["ANTHROPIC_API_KEY"],
         )
-        api_type = "anthropic"
-    else:
-        # use the Fireworks api
-        client = Fireworks(api_key=os.getenv("FIREWORKS_API_KEY"))
-        api_type = "fireworks"
+    # use the Fireworks api
+    return Fireworks(api_key=os.getenv("FIREWORKS_API_KEY"))
 
-    system_prompt, messages = get_translation_prompt()
 
-    model_translations = []
-    autochecker_log_dfs = []
-    for _, row in df_chunk.iterrows():
+def get_checker(args):
+    """The function to check translations with"""
+    # translations that were checked before (e.g. when a run is restarted) are loaded from the store
+    if args.get("graph_store_dir"):
+        return GraphStore(here(args["graph_store_dir"])).check_code
+    return check_code
 
-        features = {
-            "start_state": str(sorted(literal_eval(row["choices"]))).replace(" ", ""),
-            "response": row["response"],
-            "rt_s": row["rt_s"],
-            "transcript": row["transcript"],
+
+def code_row_steps(row, args, check, system_prompt, messages):
+    """
+    The steps of coding one row: translating its transcript, repairing and checking the
+    translation and retrying with the model if it still has problems. A generator that yields a
+    ModelRequest for each call to the language model and is sent its response (see async_coding).
+    Returns the translation, the retry log (or None) and the repair log entry (or None).
+    """
+    features = {
+        "start_state": str(sorted(literal_eval(row["choices"]))).replace(" ", ""),
+        "response": row["response"],
+        "rt_s": row["rt_s"],
+        "transcript": row["transcript"],
+    }
+    full_messages = messages + [
+        {
+            "role": "user",
+            "content": test_prompt.format(**features),
         }
-        full_messages = messages + [
-            {
-                "role": "user",
-                "content": test_prompt.format(**features),
-            }
-        ]
+    ]
+
+    translation = yield ModelRequest(system_prompt, full_messages)
 
-        translation = get_model_response(
-            api_type, client, system_prompt, full_messages, args
+    # repair the problems with mechanical fixes, and only retry with the model if any are left
+    _, original_problems = check(translation)
+    original_translation = translation
+    start_time = time.perf_counter()
+    translation, repairs, remaining_problems = repair_and_check(
+        translation, args, check, original_problems
+    )
+    repair_time = time.perf_counter() - start_time
+    retry_time, n_retry_calls = 0.0, 0
+    df_log = None
+    if remaining_problems:
+        start_time = time.perf_counter()
+        translation, df_log = yield from retry_steps(
+            features, translation, remaining_problems, args, check
         )
+        retry_time = time.perf_counter() - start_time
+        n_retry_calls = len(df_log) - 1
+    repair_log_entry = None
+    if original_problems:
+        # log every translation that had problems, to measure how many retries repairs save
+        repair_log_entry = {
+            "transcript": row["transcript"],
+            "translation": original_translation,
+            "repaired_translation": translation if repairs else None,
+            "repairs": [str(repair) for repair in repairs],
+            "n_problems_before_repair": count_problems(original_problems),
+            "n_problems_after_repair": count_problems(remaining_problems),
+            "repair_time_s": repair_time,
+            "retry_avoided": not remaining_problems,
+            "n_retry_calls": n_retry_calls,
+            "retry_time_s": retry_time,
+        }
+    return translation, df_log, repair_log_entry
 
-        graph = run_code(translation)
-        if isinstance(graph, str):
-            problems = [graph]
-        else:
-            problems = check_graph(graph)
-        if problems:
-            translation, df_log = try_retry(
-                features, translation, problems, api_type, client, args
-            )
-            autochecker_log_dfs.append(df_log)
 
-        # get the translation
+def collect_results(results):
+    """
+    Split the results of code_row_steps into translations, retry logs and repair log entries.
+    Rows that failed (whose results are exceptions, see async_coding.CodingEngine.run_all) have
+    no translation.
+    """
+    model_translations = []
+    autochecker_log_dfs = []
+    repair_log = []
+    for result in results:
+        if isinstance(result, BaseException):
+            print(f"coding a row failed: {result!r}")
+            model_translations.append(None)
+            continue
+        translation, df_log, repair_log_entry = result
         model_translations.append(translation)
+        if df_log is not None:
+            autochecker_log_dfs.append(df_log)
+        if repair_log_entry is not None:
+            repair_log.append(repair_log_entry)
+    return model_translations, autochecker_log_dfs, repair_log
 
-        # save the translation to the cache, in case of error
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        with open(
-            f"/scr/verbal-protocol/translation-cache/{args['model_name']}-{timestamp}.json",
-            "w",
-        ) as f:
-            json.dump(
-                {
-                    "start_state": sorted(literal_eval(row["choices"])),
-                    "response": row["response"],
-                    "rt_s": row["rt_s"],
-                    "transcript": row["transcript"],
-                    "translation": translation,
-                },
-                f,
-            )
 
-    return model_translations, autochecker_log_dfs
+def code_rows(df_chunk, args):
+    api_type = get_api_type(args["model_name"])
+    client = get_client(api_type)
+    system_prompt, messages = get_translation_prompt()
+    check = get_checker(args)
+
+    results = []
+    for _, row in df_chunk.iterrows():
+        result = run_steps(
+            code_row_steps(row, args, check, system_prompt, messages),
+            lambda request: get_model_response(
+                api_type, client, request.system_prompt, request.messages, args, temp=request.temp
+            ),
+        )
+        results.append(result)
+
+    return collect_results(results)
+
+
+async def code_rows_concurrently(df_chunk, args, base_url=None, api_key=None):
+    """
+    Like code_rows, but codes every row as a concurrent task (see async_coding.CodingEngine).
+    The provider's limits can be set with args["max_concurrency"], args["requests_per_minute"]
+    and args["tokens_per_minute"]. Requests go to `base_url` instead of the provider if it's
+    given (e.g. a fake_llm_server.FakeLLMServer).
+    """
+    api_type = get_api_type(args["model_name"])
+    limits = replace(
+        PROVIDER_LIMITS[api_type],
+        **{
+            name: args[name]
+            for name in ["max_concurrency", "requests_per_minute", "tokens_per_minute"]
+            if args.get(name) is not None
+        },
+    )
+    system_prompt, messages = get_translation_prompt()
+    check = get_checker(args)
+    rows = [row for _, row in df_chunk.iterrows()]
+
+    cache = get_response_cache(args.get("response_cache_path"))
+    async with CodingEngine({api_type: limits}, base_url, api_key, cache) as engine:
+        results = await engine.run_all(
+            (code_row_steps(row, args, check, system_prompt, messages) for row in rows),
+            args["model_name"],
+        )
+    return collect_results(results)
 
 
 slurm_params = {
@@ -249,38 +437,40 @@ def main(args):
         df = df[df["relevant"] == 1]
     df_trials = df[df["choices"].apply(lambda x: isinstance(x, str))]
     df_trials["start_state"] = df_trials["choices"].apply(lambda x: str(sorted(literal_eval(x))).replace(" ", ""))
-    # load the already-coded rows
-    already_coded_rows = []
-    for fname in glob("/scr/verbal-protocol/translation-cache/llama4-maverick-instruct-basic-*"):
-        row = json.load(open(fname))
-        already_coded_rows.append(row)
-    
-    df_already_coded = pd.DataFrame(already_coded_rows)
-    df_already_coded = df_already_coded.rename(columns={"translation": "lm_code_translation"})
-    df_already_coded["start_state"] = df_already_coded["start_state"].apply(lambda x: str(sorted(x)).replace(" ", ""))
-    print(f"{len(df_already_coded)} already-coded rows")
-    df_trials = df_trials.merge(df_already_coded, on=["start_state", "response", "rt_s", "transcript"], how="left", indicator=True)
-    df_already_coded_trials = df_trials[df_trials["lm_code_translation"].notna()]
-    df_trials = df_trials[df_trials["lm_code_translation"].isna()]
+    # rows that were coded before (e.g. by a run that crashed) get their model responses from the
+    # response cache (see args["response_cache_path"]), so they're coded again without API calls
+    cache = get_response_cache(args.get("response_cache_path"))
+    if cache is not None:
+        print(f"{len(cache)} cached model responses")
 
     print(f"evaluating on {len(df_trials)} examples")
 
-    # code the data in different processes
-    executor = submitit.AutoExecutor(folder=here("scripts/submitit"))
-    executor.update_parameters(**slurm_params)
-    df_trials_chunks = np.array_split(df_trials, 10)
-    jobs = []
-    for chunk in df_trials_chunks:
-        chunk = chunk[["response", "rt_s", "transcript", "choices"]]
-        jobs.append(executor.submit(code_rows, chunk, args))
-
-    # wait for the jobs to finish
     all_model_translations = []
     all_autochecker_log_dfs = []
-    for job in jobs:
-        model_translations, autochecker_log_dfs = job.result()
-        all_model_translations.extend(model_translations)
-        all_autochecker_log_dfs.extend(autochecker_log_dfs)
+    all_repair_logs = []
+    if args.get("async_coding"):
+        # code every row concurrently in this process
+        all_model_translations, all_autochecker_log_dfs, all_repair_logs = asyncio.run(
+            code_rows_concurrently(
+                df_trials[["response", "rt_s", "transcript", "choices"]], args
+            )
+        )
+    else:
+        # code the data in different processes
+        executor = submitit.AutoExecutor(folder=here("scripts/submitit"))
+        executor.update_parameters(**slurm_params)
+        df_trials_chunks = np.array_split(df_trials, 10)
+        jobs = []
+        for chunk in df_trials_chunks:
+            chunk = chunk[["response", "rt_s", "transcript", "choices"]]
+            jobs.append(executor.submit(code_rows, chunk, args))
+
+        # wait for the jobs to finish
+        for job in jobs:
+            model_translations, autochecker_log_dfs, repair_log = job.result()
+            all_model_translations.extend(model_translations)
+            all_autochecker_log_dfs.extend(autochecker_log_dfs)
+            all_repair_logs.extend(repair_log)
 
     # save the coded data
     df_trials["lm_code_translation"] = all_model_translations
@@ -291,24 +481,40 @@ def main(args):
         deployment_name + "_model-" + args["model_name"].replace("/", "--") + ".csv"
     )
 
-    df_all_trials = pd.concat([df_already_coded_trials, df_trials])
     if not os.path.exists(here(f"data/coded/{deployment_name}")):
         os.makedirs(here(f"data/coded/{deployment_name}"))
-    df_all_trials.to_csv(
+    df_trials.to_csv(
         here(f"data/coded/{deployment_name}/{output_filename}"), index=False
     )
 
     # save the autochecker logs
-    df_autochecker = pd.concat(all_autochecker_log_dfs)
-
     if not os.path.exists(here("data/autochecker_logs")):
         os.makedirs(here("data/autochecker_logs"))
     if not os.path.exists(here(f"data/autochecker_logs/{deployment_name}")):
         os.makedirs(here(f"data/autochecker_logs/{deployment_name}"))
-    df_autochecker.to_csv(
+    if all_autochecker_log_dfs:
+        df_autochecker = pd.concat(all_autochecker_log_dfs)
+        df_autochecker.to_csv(
+            here(
+                f"data/autochecker_logs/{deployment_name}/"
+                + output_filename.replace(".csv", "_autochecker.csv")
+            ),
+            index=False,
+        )
+
+    # save the repair log
+    df_repairs = pd.DataFrame(all_repair_logs)
+    if len(df_repairs) > 0:
+        print(
+            f"Repairs fixed {df_repairs['retry_avoided'].sum()} of {len(df_repairs)} "
+            f"translations with problems, in {df_repairs['repair_time_s'].sum():.1f}s. "
+            f"Retries made {df_repairs['n_retry_calls'].sum()} calls, "
+            f"in {df_repairs['retry_time_s'].sum():.1f}s."
+        )
+    df_repairs.to_csv(
         here(
             f"data/autochecker_logs/{deployment_name}/"
-            + output_filename.replace(".csv", "_autochecker.csv")
+            + output_filename.replace(".csv", "_repairs.csv")
         ),
         index=False,
     )
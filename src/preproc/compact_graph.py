@@ -0,0 +1,348 @@
+"""
+A compact alternative to GraphBuilder's networkx storage.
+
+States are interned to integer ids and nodes and edges are kept in small `__slots__` records, so
+building many graphs (e.g. when featurizing or comparing a whole coded CSV) doesn't pay for a
+networkx dict-of-dicts per graph. The networkx graph is only built when something reads `.G`.
+"""
+
+from array import array
+import copy
+from typing import Optional
+import networkx as nx
+from src.preproc.reasoning_graph import (
+    GraphBuilder,
+    OperationLog,
+    new_metric_counts,
+    operation_label,
+    update_edge_metric_counts,
+)
+from src.preproc.arithmetic import operation_is_correct
+
+
+class NodeRecord:
+    """The attributes of a single state in the graph"""
+
+    __slots__ = ("visitation_timesteps", "initialized_as_subgoal")
+
+    def __init__(self, visitation_timesteps=(), initialized_as_subgoal=None):
+        # None means a bare node, which networkx adds without attributes when an edge
+        # starts from a state that isn't in the graph yet
+        self.visitation_timesteps = (
+            None if visitation_timesteps is None else array("l", visitation_timesteps)
+        )
+        # None means the attribute was never set (the node wasn't added by set_subgoal)
+        self.initialized_as_subgoal = initialized_as_subgoal
+
+
+class EdgeRecord:
+    """The attributes of a single edge in the graph"""
+
+    __slots__ = (
+        "source",
+        "target",
+        "operation",
+        "is_correct",
+        "op_timesteps",
+        "comments",
+    )
+
+    def __init__(self, source: int, target: int, operation: str, is_correct=None):
+        self.source = source
+        self.target = target
+        self.operation = operation
+        # None means the attribute was never set (subgoal edges don't have it)
+        self.is_correct = is_correct
+        self.op_timesteps = array("l")
+        self.comments = None
+
+
+class CompactGraphBuilder(GraphBuilder):
+    """
+    A drop-in replacement for GraphBuilder that stores the graph in interned, slotted records
+    and only builds the networkx graph when `.G` is accessed. The networkx graph is cached
+    until the next write, so treat it as read-only.
+
+    Example usage:
+    --------
+    >>> graph = CompactGraphBuilder((3, 4, 9, 9))
+    >>> new_state = graph.explore_operation((3, 4, 9, 9), "9-3=6", (4, 6, 9))
+    >>> graph.G.number_of_nodes()
+    3
+    """
+
+    def __init__(self, start_state: tuple[int], target=24) -> None:
+        self.target = target
+        if isinstance(start_state, list):
+            start_state = tuple(start_state)
+
+        self.start_state = tuple(sorted(start_state))
+        self.state_ids = {}  # maps each state to its integer id
+        self.states = []  # maps each integer id back to its state
+        self.nodes = []  # node records, indexed by state id
+        self.edge_ids = {}  # maps (source id, target id) to an index into self.edges
+        self.edges = []  # edge records, in insertion order
+        self._G = None
+        self._metric_counts = new_metric_counts()
+
+        self.add_node(self.start_state, visitation_timesteps=[0])
+        self.add_node(self.goal_state)
+
+        self.operation_log = OperationLog()
+        self.operation_log.log_visit(self.start_state)
+
+        self.node_visitation_timestep = 1
+        self.op_timestep = 1
+
+        self.actions = [{"type": "start", "state": start_state}]
+
+    @property
+    def G(self) -> nx.DiGraph:
+        """Build the networkx graph from the records (cached until the next write)"""
+        if self._G is None:
+            self._G = self.to_networkx()
+        return self._G
+
+    def __getstate__(self):
+        # the networkx graph can always be rebuilt, so don't copy or pickle it
+        state = self.__dict__.copy()
+        state["_G"] = None
+        return state
+
+    def ensure_writable(self) -> None:
+        # the records are never shared: copies are deep and views are built from the materialized
+        # networkx graph, which writes replace rather than modify
+        pass
+
+    def copy(self):
+        """
+        Returns a deep copy of the graph builder (the records are cheap to copy), without the
+        action hooks
+        """
+        graph = CompactGraphBuilder.__new__(type(self))
+        # like __getstate__, leave out the networkx graph, which can always be rebuilt
+        graph.__dict__.update(
+            copy.deepcopy({**self.__dict__, "_G": None, "action_hooks": None})
+        )
+        return graph
+
+    def add_node(self, state, visitation_timesteps=(), initialized_as_subgoal=None) -> int:
+        """Intern a new state and return its id"""
+        state_id = len(self.states)
+        self.state_ids[state] = state_id
+        self.states.append(state)
+        self.nodes.append(NodeRecord(visitation_timesteps, initialized_as_subgoal))
+        self._metric_counts["n_nodes"] += 1
+        self._G = None
+        return state_id
+
+    def get_visitation_timesteps(self, state_id: int) -> array:
+        visitation_timesteps = self.nodes[state_id].visitation_timesteps
+        if visitation_timesteps is None:
+            raise KeyError("visitation_timesteps")
+        return visitation_timesteps
+
+    def log_edge_operation(self, edge: EdgeRecord) -> None:
+        """Like GraphBuilder.log_operation, but reads the operation from the edge record"""
+        if self.operation_log is not None:
+            self.operation_log.log_operation(
+                operation_label(edge.operation, self.states[edge.target]),
+                is_subgoal=edge.operation == "subgoal",
+            )
+
+    def get_edge(self, source: int, target: int, operation: str, is_correct=None):
+        """Get the record for an edge, adding it if it doesn't exist yet"""
+        edge_index = self.edge_ids.get((source, target))
+        if edge_index is None:
+            self.edge_ids[(source, target)] = len(self.edges)
+            self.edges.append(EdgeRecord(source, target, operation, is_correct))
+            update_edge_metric_counts(
+                self._metric_counts, operation, self.states[target], goal_state=self.goal_state
+            )
+            return self.edges[-1], True
+        return self.edges[edge_index], False
+
+    def add_connected_node(
+        self, curr_state, resulting_state, operation, comment, result_calc_error=False
+    ):
+        """Helper function for explore operation. Adds a connected node to the graph"""
+        curr_state = tuple(sorted(curr_state))
+        resulting_state = tuple(sorted(resulting_state))
+        target = self.state_ids.get(resulting_state)
+        if target is None:
+            target = self.add_node(
+                resulting_state, visitation_timesteps=[self.node_visitation_timestep]
+            )
+        else:
+            self.get_visitation_timesteps(target).append(self.node_visitation_timestep)
+
+        # like networkx, an edge from an unseen state implicitly adds a bare node
+        source = self.state_ids.get(curr_state)
+        if source is None:
+            source = self.add_node(curr_state, visitation_timesteps=None)
+
+        edge, is_new = self.get_edge(source, target, operation)
+        if is_new:
+            edge.is_correct = operation_is_correct(operation, result_calc_error)
+        edge.op_timesteps.append(self.op_timestep)
+        if edge.comments is None:
+            edge.comments = []
+        edge.comments.append(comment)
+        self._G = None
+        self.log_edge_operation(edge)
+        self.log_visit(resulting_state)
+
+        self.op_timestep += 1
+        self.node_visitation_timestep += 1
+
+        return resulting_state
+
+    def move_to_node(self, new_state) -> tuple[int]:
+        new_state = tuple(sorted(new_state))
+        visitation_timesteps = self.get_visitation_timesteps(self.state_ids[new_state])
+        if visitation_timesteps[-1] + 1 != self.node_visitation_timestep:
+            visitation_timesteps.append(self.node_visitation_timestep)
+            self.log_visit(new_state)
+            self.node_visitation_timestep += 1
+            self._G = None
+        self.record_action({"type": "move_to_node", "new_state": new_state})
+        return new_state
+
+    move_to_node.__doc__ = GraphBuilder.move_to_node.__doc__
+
+    def set_subgoal(
+        self,
+        subgoal_state: tuple[int],
+        state_after_subgoal: Optional[tuple[int]] = None,
+        comment: Optional[str] = None,
+    ):
+        if state_after_subgoal is None:
+            state_after_subgoal = self.goal_state
+        subgoal_state = tuple(sorted(subgoal_state))
+        state_after_subgoal = tuple(sorted(state_after_subgoal))
+
+        target = self.state_ids.get(subgoal_state)
+        if target is None:
+            target = self.add_node(subgoal_state, initialized_as_subgoal=True)
+        source = self.state_ids.get(state_after_subgoal)
+        if source is None:
+            source = self.add_node(state_after_subgoal, initialized_as_subgoal=False)
+
+        # setting a subgoal overwrites the operation and timesteps of an existing edge
+        edge, is_new = self.get_edge(source, target, "subgoal")
+        if not is_new:
+            update_edge_metric_counts(
+                self._metric_counts,
+                edge.operation,
+                subgoal_state,
+                sign=-1,
+                goal_state=self.goal_state,
+            )
+            update_edge_metric_counts(
+                self._metric_counts, "subgoal", subgoal_state, goal_state=self.goal_state
+            )
+        edge.operation = "subgoal"
+        edge.op_timesteps = array("l", [self.op_timestep])
+        self.log_edge_operation(edge)
+        self.op_timestep += 1
+
+        if comment is not None:
+            if edge.comments is None:
+                edge.comments = []
+            edge.comments.append(comment)
+        self._G = None
+
+        self.record_action(
+            {
+                "type": "set_subgoal",
+                "subgoal_state": subgoal_state,
+                "state_after_subgoal": state_after_subgoal,
+                "comment": comment,
+            }
+        )
+
+    set_subgoal.__doc__ = GraphBuilder.set_subgoal.__doc__
+
+    def unite_graphs(self, other_graph: GraphBuilder) -> None:
+        """
+        Unites this graph with another GraphBuilder (compact or not), with the same semantics
+        as GraphBuilder.unite_graphs.
+        """
+        if self.start_state != other_graph.start_state:
+            raise ValueError(
+                f"Cannot unite graphs with different start states: {self.start_state} vs {other_graph.start_state}"
+            )
+        self.operation_log = None
+
+        for node, attrs in other_graph.G.nodes(data=True):
+            state_id = self.state_ids.get(node)
+            if state_id is None:
+                self.add_node(
+                    node,
+                    attrs.get("visitation_timesteps"),
+                    attrs.get("initialized_as_subgoal"),
+                )
+            else:
+                self.get_visitation_timesteps(state_id).extend(
+                    attrs.get("visitation_timesteps", [])
+                )
+
+        for u, v, attrs in other_graph.G.edges(data=True):
+            edge, _ = self.get_edge(
+                self.state_ids[u],
+                self.state_ids[v],
+                attrs.get("operation"),
+                attrs.get("is_correct"),
+            )
+            edge.op_timesteps.extend(attrs.get("op_timesteps", []))
+            if "comment" in attrs:
+                if edge.comments is None:
+                    edge.comments = []
+                edge.comments.extend(attrs["comment"])
+        self._G = None
+
+        self.node_visitation_timestep = max(
+            self.node_visitation_timestep, other_graph.node_visitation_timestep
+        )
+        self.op_timestep = max(self.op_timestep, other_graph.op_timestep)
+        self.actions.extend(other_graph.actions)
+
+    def to_networkx(self) -> nx.DiGraph:
+        """Build a networkx graph with the same nodes, edges and attributes as GraphBuilder.G"""
+        G = nx.DiGraph()
+        for state, node in zip(self.states, self.nodes):
+            if node.visitation_timesteps is None:
+                G.add_node(state)
+                continue
+            attrs = {
+                "state": state,
+                "visitation_timesteps": list(node.visitation_timesteps),
+            }
+            if node.initialized_as_subgoal is not None:
+                attrs["initialized_as_subgoal"] = node.initialized_as_subgoal
+            G.add_node(state, **attrs)
+
+        for edge in self.edges:
+            attrs = {
+                "operation": edge.operation,
+                "op_timesteps": list(edge.op_timesteps),
+            }
+            if edge.is_correct is not None:
+                attrs["is_correct"] = edge.is_correct
+            if edge.comments is not None:
+                attrs["comment"] = list(edge.comments)
+            G.add_edge(self.states[edge.source], self.states[edge.target], **attrs)
+        return G
+
+    def to_graph_builder(self) -> GraphBuilder:
+        """Convert to a regular (networkx-backed) GraphBuilder"""
+        graph = GraphBuilder.__new__(GraphBuilder)
+        graph.__dict__.update(
+            G=self.to_networkx(),
+            start_state=self.start_state,
+            target=self.target,
+            node_visitation_timestep=self.node_visitation_timestep,
+            op_timestep=self.op_timestep,
+            actions=list(self.actions),
+        )
+        return graph
@@ -8,6 +8,10 @@ from pyprojroot import here
 import editdistance
 from ast import literal_eval
 import re
+from src.preproc.operation_ids import canonical_operation
+
+# runs of arithmetic in a (preprocessed) line, with an optional result
+ARITHMETIC_PATTERN = re.compile(r"[-+*/().\d]+(?:=-?[\d.]+)?")
 
 
 def bootstrap_mean(data, n_samples=1000):
@@ -22,10 +26,16 @@ def bootstrap_mean(data, n_samples=1000):
 
 
 def sort_commutative(line):
-    op = "+" if "+" in line else "*"
-    operation = re.search(r"\d+[\*|\+]\d+", line).group(0)
-    terms = sorted([int(x) for x in operation.split(op)])
-    return re.sub(r"\d+[\*|\+]\d+", str(terms[0]) + op + str(terms[1]), line)
+    """
+    Write the arithmetic in a line in canonical form (see operation_ids.canonical_operation), so
+    that e.g. "4*3=12" and "3*4=12" or "(7+4)+13=24" and "13+(4+7)=24" match
+    """
+    return ARITHMETIC_PATTERN.sub(
+        lambda match: canonical_operation(match.group())
+        if any(operator in match.group() for operator in "+*")
+        else match.group(),
+        line,
+    )
 
 
 def preprocess_translation(raw):
@@ -0,0 +1,184 @@
+"""
+Flatten the actions of all the graphs in a coded CSV into a single columnar event table.
+
+Each row is one action (start, explore_operation, move_to_node or set_subgoal) of one trial, and
+states are stored as integer ids into a state list shared by the whole table, so per-trial and
+per-problem statistics become vectorized group-bys instead of loops over GraphBuilder.actions.
+The table is written as Parquet, with the state list kept in the schema metadata. Operations are
+also stored as canonical ids (see operation_ids.py), so that e.g. "3*4=12" and "4*3=12" are counted
+together.
+
+Example usage:
+--------
+>>> events, states = read_event_table("data/events/irr/irr_model-deepseek-v3-0324-events.parquet")
+>>> events.query("action_type == 'explore_operation'").groupby("trial_id").size()
+"""
+
+import json
+import os
+from argparse import ArgumentParser
+from typing import Iterable, Optional
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyprojroot import here
+from src.preproc.operation_ids import operation_id
+from src.preproc.reasoning_graph import GraphBuilder
+from src.preproc.code_compiler import run_compiled_code
+
+EVENT_SCHEMA = pa.schema(
+    [
+        ("trial_id", pa.int64()),
+        ("step", pa.int32()),
+        ("action_type", pa.dictionary(pa.int8(), pa.string())),
+        ("operation", pa.dictionary(pa.int32(), pa.string())),
+        ("operation_id", pa.int64()),
+        ("start_state_id", pa.int32()),
+        ("curr_state_id", pa.int32()),
+        ("resulting_state_id", pa.int32()),
+        ("n_sub_operations", pa.int8()),
+        ("is_subgoal", pa.bool_()),
+        ("result_calc_error", pa.bool_()),
+    ]
+)
+
+
+class StateIndex:
+    """Interns states to integer ids, in the order they're first seen"""
+
+    def __init__(self):
+        self.ids = {}
+        self.states = []
+
+    def __getitem__(self, state) -> int:
+        state = tuple(state)
+        state_id = self.ids.get(state)
+        if state_id is None:
+            state_id = self.ids[state] = len(self.states)
+            self.states.append(state)
+        return state_id
+
+
+def add_graph_events(columns: dict, graph: GraphBuilder, trial_id: int, state_index: StateIndex):
+    """Append one row per action of the graph to the event columns"""
+    start_state_id = state_index[graph.start_state]
+    for step, action in enumerate(graph.actions):
+        action_type = action["type"]
+        operation = None
+        canonical_operation_id = None
+        curr_state_id = None
+        n_sub_operations = 0
+        if action_type == "start":
+            resulting_state_id = start_state_id
+        elif action_type == "explore_operation":
+            operation = action["operation"]
+            canonical_operation_id = operation_id(operation)
+            curr_state_id = state_index[action["curr_state"]]
+            resulting_state_id = state_index[action["resulting_state"]]
+            n_sub_operations = len(action["sub_operations"] or [operation])
+        elif action_type == "move_to_node":
+            resulting_state_id = state_index[action["new_state"]]
+        elif action_type == "set_subgoal":
+            # a subgoal is a backward edge from the state after the subgoal to the subgoal state
+            curr_state_id = state_index[action["state_after_subgoal"]]
+            resulting_state_id = state_index[action["subgoal_state"]]
+        else:
+            raise ValueError(f"Unknown action type '{action_type}'")
+
+        columns["trial_id"].append(trial_id)
+        columns["step"].append(step)
+        columns["action_type"].append(action_type)
+        columns["operation"].append(operation)
+        columns["operation_id"].append(canonical_operation_id)
+        columns["start_state_id"].append(start_state_id)
+        columns["curr_state_id"].append(curr_state_id)
+        columns["resulting_state_id"].append(resulting_state_id)
+        columns["n_sub_operations"].append(n_sub_operations)
+        columns["is_subgoal"].append(action_type == "set_subgoal")
+        columns["result_calc_error"].append(bool(action.get("result_calc_error", False)))
+
+
+def build_event_table(graphs: Iterable, trial_ids: Optional[Iterable[int]] = None) -> pa.Table:
+    """
+    Build the event table for a sequence of graphs. Entries that aren't graphs (e.g. the error
+    messages of code that failed to run) contribute no events. `trial_ids` defaults to the position
+    of each graph in the sequence.
+    """
+    graphs = list(graphs)
+    if trial_ids is None:
+        trial_ids = range(len(graphs))
+
+    columns = {name: [] for name in EVENT_SCHEMA.names}
+    state_index = StateIndex()
+    for trial_id, graph in zip(trial_ids, graphs):
+        if isinstance(graph, GraphBuilder):
+            add_graph_events(columns, graph, int(trial_id), state_index)
+
+    table = pa.Table.from_pydict(
+        {
+            name: pa.array(values, type=field.type.value_type).dictionary_encode()
+            if pa.types.is_dictionary(field.type)
+            else pa.array(values, type=field.type)
+            for (name, values), field in zip(columns.items(), EVENT_SCHEMA)
+        }
+    )
+    table = table.cast(EVENT_SCHEMA)
+    return table.replace_schema_metadata(
+        {"states": json.dumps([list(state) for state in state_index.states])}
+    )
+
+
+def get_states(table: pa.Table) -> list[tuple]:
+    """The states that the state id columns of an event table refer to"""
+    return [tuple(state) for state in json.loads(table.schema.metadata[b"states"])]
+
+
+def coded_csv_to_event_table(
+    data_filepath, code_column="lm_code_translation", graph_store=None
+) -> pa.Table:
+    """
+    Build the event table for a coded CSV. The trial ids are the row positions in the CSV.
+    If a GraphStore is given, the graphs are loaded from it instead of re-running the code.
+    """
+    df = pd.read_csv(data_filepath)
+    if graph_store is not None:
+        graphs = graph_store.run_many(df[code_column])
+    else:
+        graphs = [run_compiled_code(code, for_pretraining=False) for code in df[code_column]]
+    return build_event_table(graphs)
+
+
+def write_event_table(table: pa.Table, filepath) -> None:
+    os.makedirs(os.path.dirname(str(filepath)), exist_ok=True)
+    pq.write_table(table, filepath)
+
+
+def read_event_table(filepath) -> tuple[pd.DataFrame, list[tuple]]:
+    """Read an event table as a DataFrame, along with the states that its state ids refer to"""
+    table = pq.read_table(filepath)
+    # keep the state id columns as (nullable) integers
+    events = table.to_pandas(types_mapper={pa.int32(): pd.Int32Dtype()}.get)
+    # operation ids use all 63 bits, so they can't go through float like other nullable int64s
+    events["operation_id"] = table["operation_id"].to_pandas(
+        types_mapper={pa.int64(): pd.Int64Dtype()}.get
+    )
+    return events, get_states(table)
+
+
+def main(args):
+    table = coded_csv_to_event_table(args.data_filepath, args.code_column)
+    output_filepath = here(
+        args.data_filepath.replace("/coded/", "/events/").replace(
+            ".csv", "-events.parquet"
+        )
+    )
+    write_event_table(table, output_filepath)
+    print(f"Wrote {table.num_rows} events to {output_filepath}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--data_filepath", type=str, required=True)
+    parser.add_argument("--code_column", type=str, default="lm_code_translation")
+    args = parser.parse_args()
+    main(args)
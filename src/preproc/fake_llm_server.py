@@ -0,0 +1,186 @@
+"""
+A local HTTP server that imitates the OpenAI (and Fireworks) chat completions and Anthropic
+messages APIs, for load-testing the coding pipeline (see async_coding) without calling a model.
+
+Each request waits for `latency` seconds (give or take `jitter`), then answers with a translation
+of the start state in the prompt that makes one operation. A fraction of the translations
+(`bad_translation_rate`) fail partway through, so that retries get exercised, and a fraction of
+requests (`rate_limit_rate`) are refused with a 429, like a rate-limited provider.
+
+Example usage:
+--------
+>>> with FakeLLMServer(latency=1.0, bad_translation_rate=0.2) as server:
+...     results = asyncio.run(code_rows_concurrently(df, args, base_url=server.url))
+...     print(server.stats)
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+START_STATE_PATTERN = re.compile(r"start state: \[([\d, ]+)\]")
+DEFAULT_START_STATE = (1, 2, 3, 4)
+
+
+def get_start_state(text: str) -> tuple:
+    """The start state in the prompt of the latest coding request"""
+    matches = START_STATE_PATTERN.findall(text)
+    if not matches:
+        return DEFAULT_START_STATE
+    return tuple(sorted(int(number) for number in matches[-1].split(",")))
+
+
+def get_translation(start_state: tuple, is_bad: bool) -> str:
+    """A translation that makes one operation, or fails at it if it's bad"""
+    first, second, *rest = start_state
+    result = first + second
+    operation = f"{first}+{second}={result}" + (f"={result}" if is_bad else "")
+    resulting_state = tuple(sorted(rest + [result]))
+    return f"""```python
+curr_state = {start_state}
+graph = GraphBuilder(curr_state)
+{get_operation_code(operation, resulting_state)}
+```"""
+
+
+def get_operation_code(operation: str, resulting_state: tuple) -> str:
+    return f'new_state = graph.explore_operation(curr_state, operation="{operation}", resulting_state={resulting_state})'
+
+
+def get_tail(start_state: tuple) -> str:
+    """The rest of a translation, for a request to regenerate it from its failing statement"""
+    first, second, *rest = start_state
+    result = first + second
+    return get_operation_code(f"{first}+{second}={result}", tuple(sorted(rest + [result])))
+
+
+class FakeLLMServer:
+    """
+    A fake model API in a background thread (see the module docstring). `url` is the base URL to
+    send requests to, and `stats` counts the requests it got.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        jitter: float = 0.0,
+        bad_translation_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        port: int = 0,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.bad_translation_rate = bad_translation_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "rate_limited": 0, "in_flight": 0, "max_in_flight": 0}
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.get_handler_cls())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def sample(self) -> tuple[float, bool, bool]:
+        """The latency of a request, and whether it's rate limited or gets a bad translation"""
+        with self.lock:
+            latency = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            return (
+                latency,
+                self.random.random() < self.rate_limit_rate,
+                self.random.random() < self.bad_translation_rate,
+            )
+
+    def respond(self, body: dict) -> tuple[int, str]:
+        """The status and text of the response to a request's body"""
+        latency, is_rate_limited, is_bad = self.sample()
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["in_flight"] += 1
+            self.stats["max_in_flight"] = max(
+                self.stats["max_in_flight"], self.stats["in_flight"]
+            )
+        try:
+            time.sleep(latency)
+        finally:
+            with self.lock:
+                self.stats["in_flight"] -= 1
+        if is_rate_limited:
+            with self.lock:
+                self.stats["rate_limited"] += 1
+            return 429, ""
+
+        prompt = body["messages"][-1]["content"]
+        start_state = get_start_state(prompt)
+        if "code that ran:" in prompt:
+            return 200, get_tail(start_state)
+        return 200, get_translation(start_state, is_bad)
+
+    def get_handler_cls(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                status, text = server.respond(body)
+                if status != 200:
+                    payload = {"error": {"type": "rate_limit_error", "message": "Rate limited"}}
+                elif self.path.endswith("/messages"):
+                    payload = {
+                        "id": "msg_fake",
+                        "type": "message",
+                        "role": "assistant",
+                        "model": body["model"],
+                        "content": [{"type": "text", "text": text}],
+                        "stop_reason": "end_turn",
+                        "stop_sequence": None,
+                        "usage": {"input_tokens": 0, "output_tokens": 0},
+                    }
+                else:
+                    payload = {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body["model"],
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": text},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                    }
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -7,6 +7,7 @@ import pandas as pd
 from fireworks.client import Fireworks
 from pyprojroot import here
 import backoff
+from src.preproc.response_cache import get_response_cache
 
 system_prompt = """You will see transcripts from participants in a psychology experiment. Participants were asked to play a mathematical game and say whatever comes to mind. Sometimes, participants didn't say anything and the transcription algorithm produced something weird. Other times, the transcription picked up on background noise.
 Your goal is to determine which transcripts contain information relevant to the experiment and which are just irrelevant information.
@@ -76,7 +77,11 @@ def query_model(client, full_messages, transcript, model_name):
     return chat_completion
 
 
-def determine_relevance(transcript, model_name):
+def determine_relevance(transcript, model_name, response_cache_path=None):
+    """
+    Whether a transcript is relevant to the task (1) or not (0). If a response cache path is
+    given, the model's responses are loaded from (and saved to) the cache there.
+    """
 
     # First, use some heuristics
     if (not isinstance(transcript, str)) or (
@@ -84,14 +89,26 @@ def determine_relevance(transcript, model_name):
     ):
         return 0
 
-    client = Fireworks(api_key=os.getenv("FIREWORKS_API_KEY"))
     # Otherwise, use the prompt to filter
-    chat_completion = query_model(client, full_messages, transcript, model_name)
-
-    return int(
-        chat_completion.choices[0].message.content.strip()
-        == "relevant to the mathematical game"
-    )
+    cache = get_response_cache(response_cache_path)
+    key = None
+    response = None
+    if cache is not None:
+        key = cache.next_key(
+            model_name,
+            system_prompt,
+            full_messages + [{"role": "user", "content": transcript}],
+            grammar=response_grammar,
+        )
+        response = cache.get(key)
+    if response is None:
+        client = Fireworks(api_key=os.getenv("FIREWORKS_API_KEY"))
+        chat_completion = query_model(client, full_messages, transcript, model_name)
+        response = chat_completion.choices[0].message.content
+        if cache is not None:
+            cache.put(key, model_name, response)
+
+    return int(response.strip() == "relevant to the mathematical game")
 
 
 def main(args):
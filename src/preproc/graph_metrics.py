@@ -6,15 +6,25 @@ import os
 import networkx as nx
 import pandas as pd
 from pyprojroot import here
-from src.preproc.reasoning_graph import GraphBuilder
+from src.preproc.reasoning_graph import GOAL_STATE, GraphBuilder
 from src.preproc.utils import run_code
-
-
-def reached_goal(graph: nx.DiGraph):
+from src.preproc.graph_store import GraphStore
+from src.preproc.code_runner import run_code_many
+from src.preproc.event_table import build_event_table
+from src.preproc.search_metrics import (
+    SEARCH_METRICS,
+    SOLVABILITY_METRICS,
+    compute_search_metrics,
+    compute_solvability_metrics,
+)
+from src.preproc.state_oracle import get_state_oracle
+
+
+def reached_goal(graph: nx.DiGraph, goal_state=GOAL_STATE):
     """
     Check if the goal state is reachable from the start state
     """
-    return graph.in_degree((24,)) > 0
+    return graph.in_degree(goal_state) > 0
 
 
 def mean_branching_factor(graph: nx.DiGraph):
@@ -67,23 +77,129 @@ metrics = {
 }
 
 
-def graph_from_code(code):
-    ret = run_code(code, for_pretraining=False)
+def scan_operation_counts(graph: nx.DiGraph):
+    """
+    Count the operators on the left-hand side of each edge's operation, and the edges whose
+    operation involves a division, by scanning the edges
+    """
+    counts = {"+": 0, "-": 0, "*": 0, "/": 0, "n_divisions": 0}
+    for edge in graph.edges:
+        operation = graph.edges[edge]["operation"]
+        counts["n_divisions"] += "/" in operation
+        if "=" in operation:
+            operation = operation[: operation.find("=")]
+        for op in ["+", "-", "*", "/"]:
+            counts[op] += operation.count(op)
+    return counts
+
+
+def check_metric_counts(graph: GraphBuilder):
+    """
+    Check the metrics that GraphBuilder keeps up to date against the metric functions, which
+    rescan the graph. Returns the names of the metrics that don't match.
+    """
+    expected_metrics = {
+        name: metric(graph.G) for name, metric in metrics.items() if name != "reached_goal"
+    }
+    expected_metrics["reached_goal"] = reached_goal(graph.G, graph.goal_state)
+    expected_metrics.update(scan_operation_counts(graph.G))
+    counted_metrics = {**graph.metric_counts, **graph.get_metrics()}
+    return [
+        name
+        for name, value in expected_metrics.items()
+        if counted_metrics[name] != value
+    ]
+
+
+def graph_from_code(code, graph_store=None):
+    if graph_store is not None:
+        ret = graph_store.run_code(code)
+    else:
+        ret = run_code(code, for_pretraining=False)
     if isinstance(ret, GraphBuilder):
-        return ret.G
+        return ret
     else:
         return None
 
 
+def graphs_from_codes(codes, graph_store=None, workers=None, timeout=None, max_mem=None):
+    """
+    graph_from_code for many codes. If a number of workers, a timeout or a memory limit is given,
+    the code is run in sandboxed worker processes (see code_runner.run_code_many).
+    """
+    if workers is None and timeout is None and max_mem is None:
+        return [graph_from_code(code, graph_store) for code in codes]
+    if graph_store is not None:
+        results = graph_store.run_many(codes, workers, timeout, max_mem)
+    else:
+        results = run_code_many(codes, workers, timeout, max_mem, for_pretraining=False)
+    return [result if isinstance(result, GraphBuilder) else None for result in results]
+
+
+def get_growth_curves(graphs, trial_ids=None) -> pd.DataFrame:
+    """
+    The graph metrics after each action of each graph (see GraphBuilder.get_growth_curve), as one
+    long DataFrame with a trial_id column. Entries that aren't graphs are skipped.
+    """
+    graphs = list(graphs)
+    if trial_ids is None:
+        trial_ids = range(len(graphs))
+    rows = []
+    for trial_id, graph in zip(trial_ids, graphs):
+        if isinstance(graph, GraphBuilder):
+            rows.extend(
+                {"trial_id": trial_id, **row} for row in graph.get_growth_curve()
+            )
+    return pd.DataFrame(rows)
+
+
 def main(args):
     df = pd.read_csv(args.data_filepath)
-    df["graph"] = df["lm_code_translation"].apply(graph_from_code)
+    # load previously built graphs from the graph store, if one is given
+    graph_store = (
+        GraphStore(here(args.graph_store_dir), for_pretraining=False)
+        if args.graph_store_dir
+        else None
+    )
+    # run the code in sandboxed worker processes, if the pipeline sets any limits
+    df["graph"] = graphs_from_codes(
+        df["lm_code_translation"],
+        graph_store,
+        workers=args.code_workers,
+        timeout=args.code_timeout,
+        max_mem=args.code_max_mem,
+    )
 
     # filter out the rows where the graph is None
     df = df[df["graph"].notnull()]
 
-    for name, metric in metrics.items():
-        df[name] = df["graph"].apply(metric)
+    # the graphs keep their metrics up to date as they're built, so this doesn't rescan them
+    df_metrics = pd.DataFrame(
+        [graph.get_metrics() for graph in df["graph"]], index=df.index
+    )
+    for name in metrics:
+        df[name] = df_metrics[name]
+
+    # search-strategy metrics, computed from the actions of all the graphs at once
+    event_table = build_event_table(df["graph"], trial_ids=df.index)
+    df_search = compute_search_metrics(event_table)
+    for name in SEARCH_METRICS:
+        df[name] = df_search[name]
+
+    # solvability metrics, looked up in the precomputed state oracle (built on first use)
+    if args.state_oracle_dir:
+        oracle = get_state_oracle(here(args.state_oracle_dir))
+        df_solvability = compute_solvability_metrics(event_table, oracle)
+        for name in SOLVABILITY_METRICS:
+            df[name] = df_solvability[name]
+
+    if args.check_metrics:
+        for i, graph in df["graph"].items():
+            mismatched_metrics = check_metric_counts(graph)
+            if mismatched_metrics:
+                raise ValueError(
+                    f"Metrics {mismatched_metrics} in row {i} don't match the metric functions"
+                )
 
     output_filepath = here(
         args.data_filepath.replace("/coded/", "/featurized/").replace(
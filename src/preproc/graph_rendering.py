@@ -0,0 +1,151 @@
+"""
+Render many graphs to image files, laying out and drawing them in a pool of worker processes.
+
+Graphviz layouts are the slow part of drawing a graph, and they only depend on the structure of
+the graph, so they're cached by a hash of the nodes and edges. Re-rendering the same graphs with a
+different mode or colors reuses the cached layouts. Each figure is closed as soon as it's written.
+
+Example usage:
+--------
+>>> layout_cache = LayoutCache("data/layouts")
+>>> filepaths = render_many(graphs, "figures/graphs", mode="steps", n_jobs=8, layout_cache=layout_cache)
+>>> filepaths = render_many(graphs, "figures/graphs-minimal", mode="minimal", layout_cache=layout_cache)
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import matplotlib.pyplot as plt
+import networkx as nx
+from src.preproc.reasoning_graph import GraphBuilder
+
+
+def structural_hash(G: nx.DiGraph, prog: str = "dot") -> str:
+    """
+    Hash the nodes and edges of a graph (in insertion order, which graphviz layouts depend on)
+    along with the graphviz program used to lay it out.
+    """
+    structure = repr((prog, list(G.nodes), list(G.edges)))
+    return hashlib.sha256(structure.encode()).hexdigest()
+
+
+class LayoutCache:
+    """
+    Caches node positions by structural hash, in memory and, if a directory is given, on disk.
+    Positions are stored as a list in the graph's node order, since nodes are tuples.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = None if directory is None else str(directory)
+        self.layouts = {}
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, G: nx.DiGraph, key: str) -> Optional[dict]:
+        positions = self.layouts.get(key)
+        if positions is None and self.directory is not None:
+            try:
+                with open(self.path(key)) as f:
+                    positions = json.load(f)
+            except FileNotFoundError:
+                return None
+            self.layouts[key] = positions
+        if positions is None:
+            return None
+        return {node: tuple(position) for node, position in zip(G.nodes, positions)}
+
+    def put(self, G: nx.DiGraph, key: str, pos: dict) -> None:
+        positions = [list(pos[node]) for node in G.nodes]
+        self.layouts[key] = positions
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path(key), "w") as f:
+                json.dump(positions, f)
+
+
+def render_graph(graph_bytes: bytes, filepath: str, pos: Optional[dict], draw_kwargs: dict):
+    """
+    Draw a serialized graph and save it to a file (run in a worker process).
+    Returns the node positions, so the caller can cache them.
+    """
+    graph = GraphBuilder.from_bytes(graph_bytes)
+    if pos is None:
+        pos = nx.nx_agraph.graphviz_layout(graph.G, prog=draw_kwargs.get("prog", "dot"))
+    fig, _ = graph.draw_graph(pos=pos, **draw_kwargs)
+    fig.savefig(filepath)
+    plt.close(fig)
+    return pos
+
+
+def render_many(
+    graphs,
+    out_dir,
+    mode="steps",
+    filenames=None,
+    file_format="png",
+    layout_cache: Optional[LayoutCache] = None,
+    n_jobs=1,
+    **draw_kwargs,
+) -> list[str]:
+    """
+    Draw each graph with GraphBuilder.draw_graph and save it to `out_dir`.
+
+    Args:
+        graphs: the GraphBuilder objects to draw. Entries that aren't graphs (e.g. error messages) are skipped.
+        out_dir: the directory to save the figures to
+        mode: the draw_graph mode ("steps", "aggregate" or "minimal")
+        filenames: the filename (without extension) for each graph. Defaults to the graph's index.
+        file_format: the image format, e.g. "png" or "svg"
+        layout_cache: a LayoutCache to reuse layouts from. Defaults to a fresh in-memory cache.
+        n_jobs: the number of worker processes to draw the graphs in
+        **draw_kwargs: other arguments for draw_graph (e.g. colors, figsize or prog)
+
+    Returns:
+        The filepath of each figure (None for entries that aren't graphs)
+    """
+    graphs = list(graphs)
+    if filenames is None:
+        filenames = [str(i) for i in range(len(graphs))]
+    if layout_cache is None:
+        layout_cache = LayoutCache()
+    draw_kwargs["mode"] = mode
+    prog = draw_kwargs.get("prog", "dot")
+    os.makedirs(out_dir, exist_ok=True)
+
+    jobs = []
+    filepaths = [None] * len(graphs)
+    for i, (graph, filename) in enumerate(zip(graphs, filenames)):
+        if not isinstance(graph, GraphBuilder):
+            continue
+        filepaths[i] = os.path.join(str(out_dir), f"{filename}.{file_format}")
+        key = structural_hash(graph.G, prog)
+        # serialize the graph, so that views and frozen graphs can be sent to the workers
+        jobs.append(
+            (graph, key, graph.to_bytes(), filepaths[i], layout_cache.get(graph.G, key))
+        )
+
+    if n_jobs == 1:
+        positions = [
+            render_graph(graph_bytes, filepath, pos, draw_kwargs)
+            for _, _, graph_bytes, filepath, pos in jobs
+        ]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            positions = list(
+                executor.map(
+                    render_graph,
+                    [job[2] for job in jobs],
+                    [job[3] for job in jobs],
+                    [job[4] for job in jobs],
+                    [draw_kwargs] * len(jobs),
+                )
+            )
+
+    for (graph, key, _, _, cached_pos), pos in zip(jobs, positions):
+        if cached_pos is None:
+            layout_cache.put(graph.G, key, pos)
+
+    return filepaths
@@ -0,0 +1,276 @@
+"""
+An on-disk cache of the graphs built from code translations and of their auto-checker problems, so
+that downstream stages can load them instead of re-executing and re-checking the same code strings.
+
+The cache is a SQLite database in the store's directory. Graphs are keyed by a hash of the code,
+the run_code options and the source of the modules that build graphs (BUILD_MODULES), and problems
+by the key of their graph and the source of the checker (CHECK_MODULES). Editing any of those
+files (e.g. reasoning_graph.py or auto_checker.py) invalidates the entries that depend on it: a
+change to the checker only re-checks the graphs, without running the code again. Code that fails
+to run is stored too, as the error message that run_code returns.
+
+Example usage:
+--------
+>>> graph_store = GraphStore("data/graph-store", for_pretraining=False)
+>>> graph = graph_store.run_code(code)  # runs the code the first time, then loads it from disk
+>>> graph, problems = graph_store.check_code(code)  # like auto_checker.check_code
+>>> results = graph_store.check_many(df["lm_code_translation"])  # (graph, Problem records) pairs
+>>> graph_store.prune()  # delete the entries of old versions of the code
+"""
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+from typing import Iterable, Optional, Union
+from pyprojroot import here
+from src.preproc import (
+    arithmetic,
+    auto_checker,
+    code_checking_tools,
+    code_compiler,
+    operation_ids,
+    reasoning_graph,
+    reasoning_graph_utils,
+    state_space,
+    utils,
+)
+from src.preproc.auto_checker import Problem, ProblemType, format_problems, get_problem_records
+from src.preproc.reasoning_graph import GraphBuilder
+from src.preproc.utils import run_code
+from src.preproc.code_compiler import run_compiled_code
+from src.preproc.code_runner import (
+    decode_result,
+    encode_result,
+    is_stopped_error,
+    run_code_many,
+)
+
+# the modules whose code decides the graph that a translation builds, and the problems found in it
+BUILD_MODULES = [
+    utils,
+    code_compiler,
+    reasoning_graph,
+    reasoning_graph_utils,
+    arithmetic,
+    operation_ids,
+    state_space,
+]
+CHECK_MODULES = [auto_checker, code_checking_tools]
+
+DATABASE_FILENAME = "results.sqlite"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS graphs (
+    key TEXT PRIMARY KEY, version TEXT NOT NULL, result BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS problems (
+    key TEXT PRIMARY KEY, version TEXT NOT NULL, records BLOB NOT NULL
+);
+"""
+
+
+def get_source_version(modules: list, salt: str = "") -> str:
+    """A hash of the source files of the modules"""
+    digest = hashlib.sha256(salt.encode())
+    for module in modules:
+        with open(module.__file__, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+BUILD_VERSION = get_source_version(BUILD_MODULES, str(reasoning_graph.GRAPH_BUILDER_VERSION))
+CHECK_VERSION = get_source_version(CHECK_MODULES, BUILD_VERSION)
+
+
+def encode_records(records: list[Problem]) -> bytes:
+    """Serialize problem records, without their actions (which are in the graph)"""
+    return pickle.dumps(
+        [
+            (
+                record.type.name,
+                record.action_index,
+                record.operands,
+                record.suggested_fix,
+                record.message,
+            )
+            for record in records
+        ]
+    )
+
+
+def decode_records(data: bytes, graph: GraphBuilder) -> list[Problem]:
+    return [
+        Problem(ProblemType[type_name], action_index, graph.actions[action_index], *fields)
+        for type_name, action_index, *fields in pickle.loads(data)
+    ]
+
+
+class GraphStore:
+    """
+    A SQLite cache of the graphs that code translations build, and of their problems (see the
+    module docstring). A store can be used from many threads and processes at once.
+    """
+
+    def __init__(self, directory=here("data/graph-store"), for_pretraining=True):
+        self.directory = str(directory)
+        self.for_pretraining = for_pretraining
+        self.filepath = os.path.join(self.directory, DATABASE_FILENAME)
+        self.local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The connection of this thread (and process) to the database"""
+        if getattr(self.local, "pid", None) != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            # the timeout waits for other processes that are writing to the store
+            connection = sqlite3.connect(self.filepath, timeout=60)
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def key(self, code: str) -> str:
+        return hashlib.sha256(
+            f"{BUILD_VERSION}\0{self.for_pretraining}\0{code}".encode()
+        ).hexdigest()
+
+    def problems_key(self, code: str) -> str:
+        return hashlib.sha256(f"{CHECK_VERSION}\0{self.key(code)}".encode()).hexdigest()
+
+    def __contains__(self, code: str) -> bool:
+        row = self.connection.execute(
+            "SELECT 1 FROM graphs WHERE key = ?", (self.key(code),)
+        ).fetchone()
+        return row is not None
+
+    def get(self, code: str) -> Optional[Union[GraphBuilder, str]]:
+        """Load the graph (or error message) stored for the code, or None if it isn't stored"""
+        row = self.connection.execute(
+            "SELECT result FROM graphs WHERE key = ?", (self.key(code),)
+        ).fetchone()
+        return None if row is None else decode_result(row[0])
+
+    def put(self, code: str, result: Union[GraphBuilder, str]) -> None:
+        """Store the graph (or error message) that the code builds"""
+        self.put_many([(code, result)])
+
+    def put_many(self, entries: Iterable[tuple[str, Union[GraphBuilder, str]]]) -> None:
+        """Store many (code, graph or error message) pairs in one transaction"""
+        rows = [
+            (self.key(code), BUILD_VERSION, encode_result(result)) for code, result in entries
+        ]
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO graphs VALUES (?, ?, ?)", rows)
+
+    def get_records(self, code: str, graph: GraphBuilder) -> Optional[list[Problem]]:
+        """Load the problem records stored for the graph of the code, or None if they aren't"""
+        row = self.connection.execute(
+            "SELECT records FROM problems WHERE key = ?", (self.problems_key(code),)
+        ).fetchone()
+        if row is None:
+            return None
+        return decode_records(row[0], graph)
+
+    def put_records(self, entries: Iterable[tuple[str, list[Problem]]]) -> None:
+        """Store the problem records of the graphs of many codes, in one transaction"""
+        rows = [
+            (self.problems_key(code), CHECK_VERSION, encode_records(records))
+            for code, records in entries
+        ]
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO problems VALUES (?, ?, ?)", rows)
+
+    def run_code(self, code: str) -> Union[GraphBuilder, str]:
+        """Like utils.run_code, but loads the result from the store if the code was run before"""
+        if not isinstance(code, str):
+            # missing translations aren't worth caching
+            return run_code(code, for_pretraining=self.for_pretraining)
+        result = self.get(code)
+        if result is None:
+            result = run_compiled_code(code, for_pretraining=self.for_pretraining)
+            self.put(code, result)
+        return result
+
+    def run_many(
+        self,
+        codes: Iterable[str],
+        workers: Optional[int] = None,
+        timeout: Optional[float] = None,
+        max_mem: Optional[int] = None,
+    ) -> list[Union[GraphBuilder, str]]:
+        """
+        Run (or load) the graphs for many code strings. Each result is a separate object.
+        If a number of workers, a timeout or a memory limit is given, the code that isn't stored is
+        run in sandboxed worker processes (see code_runner.run_code_many). Code that times out or
+        crashes its worker isn't stored, so it's run again next time.
+        """
+        codes = list(codes)
+        results = [self.get(code) if isinstance(code, str) else None for code in codes]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if workers is None and timeout is None and max_mem is None:
+            new_results = [
+                run_compiled_code(codes[i], for_pretraining=self.for_pretraining) for i in missing
+            ]
+        else:
+            new_results = run_code_many(
+                [codes[i] for i in missing], workers, timeout, max_mem, self.for_pretraining
+            )
+        new_entries = []
+        for i, result in zip(missing, new_results):
+            results[i] = result
+            if isinstance(codes[i], str) and not is_stopped_error(result):
+                new_entries.append((codes[i], result))
+        self.put_many(new_entries)
+        return results
+
+    def check_many(
+        self,
+        codes: Iterable[str],
+        workers: Optional[int] = None,
+        timeout: Optional[float] = None,
+        max_mem: Optional[int] = None,
+    ) -> list[tuple[Union[GraphBuilder, str], Optional[list[Problem]]]]:
+        """
+        Run (or load) the graphs for many code strings, and check (or load the problems of) each.
+        Returns a (graph, Problem records) pair for each code, in the order of `codes`. Code that
+        fails to run has its error message instead of a graph, and None instead of records.
+        The arguments are as for run_many.
+        """
+        codes = list(codes)
+        results = []
+        new_entries = []
+        for code, graph in zip(codes, self.run_many(codes, workers, timeout, max_mem)):
+            if not isinstance(graph, GraphBuilder):
+                results.append((graph, None))
+                continue
+            records = self.get_records(code, graph) if isinstance(code, str) else None
+            if records is None:
+                records = get_problem_records(graph)
+                if isinstance(code, str):
+                    new_entries.append((code, records))
+            results.append((graph, records))
+        self.put_records(new_entries)
+        return results
+
+    def check_code(self, code: str) -> tuple:
+        """
+        Like auto_checker.check_code (checking the whole graph), but loads the graph and its
+        problems from the store if the code was checked before
+        """
+        [(graph, records)] = self.check_many([code])
+        if records is None:
+            return graph, [graph]
+        return graph, format_problems(records)
+
+    def prune(self) -> int:
+        """Delete the entries of other versions of the code. Returns the number deleted."""
+        with self.connection:
+            n_graphs = self.connection.execute(
+                "DELETE FROM graphs WHERE version != ?", (BUILD_VERSION,)
+            ).rowcount
+            n_problems = self.connection.execute(
+                "DELETE FROM problems WHERE version != ?", (CHECK_VERSION,)
+            ).rowcount
+        self.connection.execute("VACUUM")
+        return n_graphs + n_problems
@@ -0,0 +1,108 @@
+"""
+Canonical forms and integer ids for explored operations, so that the same step written differently
+(e.g. "3*4=12", "4*3=12", "(4*3) = 12" or "4*3=12.0") is compared and counted as one operation.
+
+An operation is parsed into its tree of sub-operations, the operands of + and * are sorted (numbers
+first, smallest first, then sub-expressions), and the tree is written back out without spaces or
+redundant parentheses. Only commutativity is normalized: "2+3+4" and "2+(3+4)" are different
+sequences of steps, so they stay different operations. Text that can't be parsed (e.g. subgoal
+labels like "subgoal: (4, 6)") is canonicalized by removing whitespace.
+
+The id of an operation is a hash of its canonical form, so ids are the same across processes,
+graphs and tables, and can be stored as int64.
+
+Example usage:
+--------
+>>> canonical_operation("(4 * 3) = 12")
+'3*4=12'
+>>> canonical_operation("(4-2)*3+9=15.0")
+'9+(3*(4-2))=15'
+>>> operation_id("4*3=12") == operation_id("3*4=12")
+True
+"""
+
+import hashlib
+import re
+from functools import lru_cache
+from typing import Iterable, Union
+import numpy as np
+from src.preproc.arithmetic import parse_expression, parse_number, to_number
+
+COMMUTATIVE_OPERATORS = ("+", "*")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# a parsed expression: a number, or a tuple of (operator, left, right)
+Expression = Union[int, float, tuple]
+
+
+def to_tree(postfix: tuple) -> Expression:
+    """Build the expression tree of a postfix expression (see arithmetic.parse_expression)"""
+    stack = []
+    for token in postfix:
+        if isinstance(token, str):
+            right = stack.pop()
+            left = stack.pop()
+            stack.append(canonical_node(token, left, right))
+        else:
+            stack.append(to_number(token))
+    if len(stack) != 1:
+        raise ValueError("Malformed expression")
+    return stack[0]
+
+
+def canonical_node(operator: str, left: Expression, right: Expression) -> tuple:
+    if operator in COMMUTATIVE_OPERATORS and sort_key(left) > sort_key(right):
+        left, right = right, left
+    return (operator, left, right)
+
+
+def sort_key(expression: Expression) -> tuple:
+    """Numbers come before sub-expressions, and are sorted by value"""
+    if isinstance(expression, tuple):
+        return (1, 0, to_string(expression))
+    return (0, expression, "")
+
+
+def to_string(expression: Expression, is_subexpression: bool = False) -> str:
+    if not isinstance(expression, tuple):
+        return str(expression)
+    operator, left, right = expression
+    string = f"{to_string(left, True)}{operator}{to_string(right, True)}"
+    return f"({string})" if is_subexpression else string
+
+
+@lru_cache(maxsize=65536)
+def canonical_operation(operation: str) -> str:
+    """
+    The canonical form of an operation ("lhs=result") or of an expression without a result.
+    The result is written as a number when it is one (so "12.0" and "12" are the same).
+    """
+    lhs, _, rhs = operation.rpartition("=")
+    if "=" not in operation:
+        lhs, rhs = operation, None
+    try:
+        canonical = to_string(to_tree(parse_expression(lhs)))
+    except (ValueError, IndexError):
+        return WHITESPACE_PATTERN.sub("", operation)
+    if rhs is None:
+        return canonical
+    rhs = rhs.strip()
+    try:
+        rhs = str(to_number(parse_number(rhs)))
+    except ValueError:
+        rhs = WHITESPACE_PATTERN.sub("", rhs)
+    return f"{canonical}={rhs}"
+
+
+@lru_cache(maxsize=65536)
+def operation_id(operation: str) -> int:
+    """A stable, non-negative int64 id of an operation's canonical form"""
+    digest = hashlib.blake2b(canonical_operation(operation).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") >> 1
+
+
+def operation_ids(operations: Iterable[str]) -> np.ndarray:
+    """The id of each operation, as an int64 array"""
+    return np.fromiter(
+        (operation_id(operation) for operation in operations), dtype=np.int64
+    )
@@ -14,6 +14,7 @@ import submitit
 import numpy as np
 import warnings
 from src.preproc.utils import run_code
+from src.preproc.graph_store import GraphStore
 from ast import literal_eval
 
 slurm_params = {
@@ -120,7 +121,9 @@ def process_task_data(args):
     print("Filtering transcripts...")
     # decide whether each transcript has content relevant to the task
     df_trials["relevant"] = df_trials["transcript"].apply(
-        lambda x: determine_relevance(x, args.filtering_model_name)
+        lambda x: determine_relevance(
+            x, args.filtering_model_name, args.response_cache_path
+        )
     )
 
     # convert response time to seconds
@@ -198,12 +201,19 @@ def process_task_data(args):
 # Functions to process coded data for finetuning
 
 
-def preprocess_graph_for_finetuning(annotation, target=24, for_pretraining=False):
+def preprocess_graph_for_finetuning(
+    annotation, target=24, for_pretraining=False, graph_store=None
+):
     """
     Preprocess a human graph for finetuning LM.
+    If a GraphStore is given, the graph is loaded from it instead of re-running the code (and the
+    store's for_pretraining option is used).
     """
     # get graph from annotation
-    graph = run_code(annotation, for_pretraining=for_pretraining)
+    if graph_store is not None:
+        graph = graph_store.run_code(annotation)
+    else:
+        graph = run_code(annotation, for_pretraining=for_pretraining)
     # check if graph is a string
     code_str_proc = ""
     # get each action from graph
@@ -245,10 +255,17 @@ def preproc_for_finetuning(args):
         .query("relevant == 1")
     )
 
+    graph_store = (
+        GraphStore(here(args.graph_store_dir), for_pretraining=False)
+        if args.get("graph_store_dir")
+        else None
+    )
     df_with_exclusions["code_str_proc"] = None
     # preprocess the graph for finetuning
     for i, row in df_with_exclusions.iterrows():
-        code_str_proc = preprocess_graph_for_finetuning(row["lm_code_translation"])
+        code_str_proc = preprocess_graph_for_finetuning(
+            row["lm_code_translation"], graph_store=graph_store
+        )
         # add to the dataframe
         df_with_exclusions.at[i, "code_str_proc"] = code_str_proc
 
@@ -141,6 +141,36 @@ Do not include any additional text before or after the code. Your response shoul
 """
 
 
+tail_system_prompt = f"""# Task
+
+You are acting as an AI research assistant for researchers in cognitive psychology. The researchers ran an experiment in which participants played the game of 24. In the game of 24, participants are given four numbers that they must use to make the number 24 using basic arithmetic operations (addition, subtraction, multiplication, and division). Each starting number can only be used once, and the goal is reached when all numbers are used and the result is 24.
+
+Participants were told to say everything that comes to mind out loud as they did the experiment. You will see transcripts of what participants said as they played the game, along with the responses they submitted and their response time in seconds. The transcripts are translated into Python code which describes the operations people perform at each step toward the answer, building a graph of the states they visit (sets of numbers they can use) and the operations they try. Be aware that the transcripts may contain some transcription errors, so you should handle ambiguous cases by making reasonable assumptions.
+
+In a previous prompt, you translated a transcript to code, but the code raised an error partway through. The code before the failing statement ran correctly and will be kept as it is. Your job now is to write the rest of the translation: a corrected version of the failing statement, followed by the code for the rest of the transcript.
+
+# Code
+
+Here is the code with the class and methods that the translations use:
+
+```python
+{graphbuilder_code.strip()}
+```
+
+For each example, you will see the starting numbers, the response the participant submitted (i.e. the left-hand size of an equation that makes 24) the response time in seconds, a transcript of what the participant said, the code that ran, the failing statement and its error.
+
+Only write the code that comes after the code that ran. Do not repeat the code that ran, and do not include any additional text before or after the code. Your response should only be runnable Python code that continues the code that ran. This is very important. If you include extra text, the code will not run.
+"""
+
+
+def get_tail_prompt():
+    """
+    The prompt for regenerating the tail of a translation that failed partway through. It has no
+    examples, since the correction examples rewrite whole translations.
+    """
+    return tail_system_prompt, []
+
+
 def get_correction_prompt():
 
     import pandas as pd
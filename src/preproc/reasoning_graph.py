@@ -7,7 +7,294 @@ import networkx as nx
 import matplotlib.pyplot as plt
 import numpy as np
 from src.preproc.reasoning_graph_utils import get_sub_operations
+from src.preproc.arithmetic import operation_is_correct
+from src.preproc.state_space import CountdownStateSpace
+from src.preproc.operation_ids import operation_ids
 import copy
+import functools
+from array import array
+import pickle
+import struct
+import zlib
+
+# bump this whenever the graph built from the same code would change (e.g. new attributes or
+# different semantics for an action), so that serialized and stored graphs are invalidated
+GRAPH_BUILDER_VERSION = 1
+
+# serialized graphs start with a magic string and the GraphBuilder version they were built with
+SERIALIZATION_MAGIC = b"RGRF"
+SERIALIZATION_HEADER = struct.Struct("<4sH")
+
+
+def thaw_graph(G: nx.DiGraph) -> nx.DiGraph:
+    """
+    Make a writable deep copy of a networkx graph, which may be frozen or a view of another graph.
+    """
+    thawed_G = nx.DiGraph()
+    thawed_G.add_nodes_from(
+        (node, copy.deepcopy(data)) for node, data in G.nodes(data=True)
+    )
+    thawed_G.add_edges_from(
+        (u, v, copy.deepcopy(data)) for u, v, data in G.edges(data=True)
+    )
+    return thawed_G
+
+
+def get_visit_count(node_data: dict) -> int:
+    """
+    The number of times a node was visited, from either its visitation timesteps or, for graphs
+    aggregated in counts-only mode, its visit count.
+    """
+    if "visit_count" in node_data:
+        return node_data["visit_count"]
+    return len(node_data.get("visitation_timesteps", []))
+
+
+def get_op_count(edge_data: dict) -> int:
+    """
+    The number of times an edge was traversed, from either its operation timesteps or, for graphs
+    aggregated in counts-only mode, its operation count.
+    """
+    if "op_count" in edge_data:
+        return edge_data["op_count"]
+    return len(edge_data.get("op_timesteps", []))
+
+
+class OperationLog:
+    """
+    Append-only, integer-encoded logs of a graph's operations and node visits, in timestep order.
+
+    Operations are stored as ids into a table of operation labels (subgoals are labeled like
+    "subgoal: (4, 6)" and stored as negative ids, ~label_id), and visits as ids into a table of states.
+    """
+
+    def __init__(self):
+        self.labels = []
+        self.label_ids = {}
+        self.states = []
+        self.state_ids = {}
+        self.operations = array("l")  # operation timestep t is at index t - 1
+        self.visits = array("l")  # node visitation timestep t is at index t
+
+    def copy(self) -> "OperationLog":
+        log = copy.copy(self)
+        log.operations = array("l", self.operations)
+        log.visits = array("l", self.visits)
+        # the label and state tables are only ever appended to, but don't share them between copies
+        log.labels = list(self.labels)
+        log.label_ids = dict(self.label_ids)
+        log.states = list(self.states)
+        log.state_ids = dict(self.state_ids)
+        return log
+
+    def log_operation(self, label: str, is_subgoal: bool = False) -> None:
+        label_id = self.label_ids.get(label)
+        if label_id is None:
+            label_id = self.label_ids[label] = len(self.labels)
+            self.labels.append(label)
+        self.operations.append(~label_id if is_subgoal else label_id)
+
+    def log_visit(self, state: tuple) -> None:
+        state_id = self.state_ids.get(state)
+        if state_id is None:
+            state_id = self.state_ids[state] = len(self.states)
+            self.states.append(state)
+        self.visits.append(state_id)
+
+    def get_operation_sequence(self, include_subgoals: bool = True) -> list[str]:
+        labels = self.labels
+        if include_subgoals:
+            return [labels[~op if op < 0 else op] for op in self.operations]
+        return [labels[op] for op in self.operations if op >= 0]
+
+    def get_visitation_sequence(self) -> list[tuple]:
+        states = self.states
+        return [states[state_id] for state_id in self.visits]
+
+    def get_operation_ids(self, include_subgoals: bool = True) -> np.ndarray:
+        """
+        The sequence of canonical operation ids (see operation_ids.operation_id), so that e.g.
+        "3*4=12" and "4*3=12" count as the same operation
+        """
+        label_ids = operation_ids(self.labels)
+        operations = np.asarray(self.operations, dtype=np.int64)
+        if not include_subgoals:
+            operations = operations[operations >= 0]
+        return label_ids[np.where(operations < 0, ~operations, operations)]
+
+    def get_operation_ngrams(self, n: int = 2, include_subgoals: bool = True) -> list[tuple]:
+        """The n-grams of the operation sequence, as a sliding window over the log"""
+        sequence = self.get_operation_sequence(include_subgoals)
+        return list(zip(*(sequence[i:] for i in range(n))))
+
+
+def operation_label(operation: str, target) -> str:
+    """The label of an operation in operation sequences (subgoals are labeled by their subgoal state)"""
+    return f"subgoal: {target}" if operation == "subgoal" else operation
+
+
+GOAL_STATE = (24,)
+METRIC_OPERATORS = ("+", "-", "*", "/")
+
+
+def new_metric_counts() -> dict:
+    """Counters for an empty graph, see count_graph_metrics"""
+    return {
+        "n_nodes": 0,
+        "n_edges": 0,
+        "n_subgoals": 0,
+        "goal_in_degree": 0,
+        "n_divisions": 0,
+        **{op: 0 for op in METRIC_OPERATORS},
+    }
+
+
+def update_edge_metric_counts(
+    metric_counts: dict, operation: str, target, sign: int = 1, goal_state=GOAL_STATE
+):
+    """Add (or with sign=-1, remove) the contribution of an edge to the metric counters"""
+    operation = operation or ""
+    metric_counts["n_edges"] += sign
+    metric_counts["n_subgoals"] += sign * (operation == "subgoal")
+    metric_counts["goal_in_degree"] += sign * (target == goal_state)
+    metric_counts["n_divisions"] += sign * ("/" in operation)
+    # operators are only counted on the left-hand side of the operation
+    lhs = operation[: operation.find("=")] if "=" in operation else operation
+    for op in METRIC_OPERATORS:
+        metric_counts[op] += sign * lhs.count(op)
+
+
+def count_graph_metrics(G: nx.DiGraph, goal_state=GOAL_STATE) -> dict:
+    """
+    Count the nodes, edges, subgoal edges, edges into the goal, division edges and the operators
+    on the edges of a graph.
+    """
+    metric_counts = new_metric_counts()
+    metric_counts["n_nodes"] = G.number_of_nodes()
+    for _, v, data in G.edges(data=True):
+        update_edge_metric_counts(
+            metric_counts, data.get("operation"), v, goal_state=goal_state
+        )
+    return metric_counts
+
+
+def with_init_bookkeeping(init):
+    """
+    Let a new graph have another target than 24 (e.g. for other Countdown problems, as in
+    GraphBuilder((25, 50, 75, 100, 3, 6), target=952)), and start its operation log
+    """
+
+    @functools.wraps(init)
+    def wrapper(self, start_state, target=24):
+        self.target = target
+        init(self, start_state)
+        goal_state = self.goal_state
+        if goal_state != (24,):
+            # __init__ adds the goal of the game of 24
+            if self.start_state != (24,):
+                self.G.remove_node((24,))
+            self.G.add_node(goal_state, state=goal_state, visitation_timesteps=[])
+        self.operation_log = OperationLog()
+        self.operation_log.log_visit(self.start_state)
+
+    return wrapper
+
+
+def with_connected_node_bookkeeping(add_connected_node):
+    """
+    Keep the metric counters and the operation log of a graph up to date when add_connected_node
+    adds to it
+    """
+
+    @functools.wraps(add_connected_node)
+    def wrapper(self, curr_state, resulting_state, operation, comment, result_calc_error=False):
+        metric_counts = self.metric_counts
+        n_nodes = self.G.number_of_nodes()
+        edge = (tuple(sorted(curr_state)), tuple(sorted(resulting_state)))
+        is_new_edge = not self.G.has_edge(*edge)
+        resulting_state = add_connected_node(
+            self, curr_state, resulting_state, operation, comment, result_calc_error
+        )
+        # adding the edge implicitly adds curr_state if it isn't in the graph yet
+        metric_counts["n_nodes"] += self.G.number_of_nodes() - n_nodes
+        if is_new_edge:
+            update_edge_metric_counts(
+                metric_counts, operation, resulting_state, goal_state=self.goal_state
+            )
+        self.log_operation(*edge)
+        self.log_visit(resulting_state)
+        return resulting_state
+
+    return wrapper
+
+
+def with_move_bookkeeping(move_to_node):
+    """Log the visit when move_to_node moves to a state it wasn't just in"""
+
+    @functools.wraps(move_to_node)
+    def wrapper(self, new_state):
+        node_visitation_timestep = self.node_visitation_timestep
+        new_state = move_to_node(self, new_state)
+        if self.node_visitation_timestep != node_visitation_timestep:
+            self.log_visit(new_state)
+        return new_state
+
+    return wrapper
+
+
+def with_subgoal_bookkeeping(set_subgoal):
+    """
+    Make the graph's goal state the default state after a subgoal, and keep the metric counters
+    and the operation log of a graph up to date when set_subgoal adds to it
+    """
+
+    @functools.wraps(set_subgoal)
+    def wrapper(self, subgoal_state, state_after_subgoal=None, comment=None):
+        if state_after_subgoal is None:
+            state_after_subgoal = self.goal_state
+        metric_counts = self.metric_counts
+        n_nodes = self.G.number_of_nodes()
+        edge = (tuple(sorted(state_after_subgoal)), tuple(sorted(subgoal_state)))
+        # setting a subgoal overwrites the operation of an existing edge
+        if self.G.has_edge(*edge):
+            update_edge_metric_counts(
+                metric_counts,
+                self.G.edges[edge].get("operation"),
+                edge[1],
+                sign=-1,
+                goal_state=self.goal_state,
+            )
+        set_subgoal(self, subgoal_state, state_after_subgoal, comment)
+        metric_counts["n_nodes"] += self.G.number_of_nodes() - n_nodes
+        update_edge_metric_counts(metric_counts, "subgoal", edge[1], goal_state=self.goal_state)
+        self.log_operation(*edge)
+
+    return wrapper
+
+
+def runs_action_hooks(method):
+    """Run the action hooks of a graph on the actions that a GraphBuilder method adds"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        n_actions = len(self.actions)
+        result = method(self, *args, **kwargs)
+        for action in self.actions[n_actions:]:
+            self.run_action_hooks(action)
+        return result
+
+    return wrapper
+
+
+def writes_graph(method):
+    """Make a GraphBuilder method write to its own copy of a shared graph, see GraphBuilder.copy"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self.ensure_writable()
+        return method(self, *args, **kwargs)
+
+    return wrapper
 
 
 class GraphBuilder:
@@ -197,7 +484,7 @@ class GraphBuilder:
                 curr_state,
                 resulting_state,
                 operation=operation,
-                is_correct=eval(f"np.isclose({operation.replace('=', ',')},atol=0.01)") and not result_calc_error,
+                is_correct=operation_is_correct(operation, result_calc_error),
             )
             self.G.edges[(curr_state, resulting_state)]["op_timesteps"] = [
                 self.op_timestep
@@ -321,19 +608,24 @@ class GraphBuilder:
         )
 
 
-    def draw_graph(self, prog="dot", mode="steps", target=(24,), node_size=7000, colors=None, figsize=(16, 12), fontsize_node_labels=14, fontsize_edge_labels=14, edge_vis_dict=None):
+    def draw_graph(self, prog="dot", mode="steps", target=None, node_size=7000, colors=None, figsize=(16, 12), fontsize_node_labels=14, fontsize_edge_labels=14, edge_vis_dict=None, pos=None):
         """
         This function draws the graph.
         3 possible modes:
         - "steps": provide steps and operations for edge labels
         - "aggregate": increase edge width proportional to number of visits, don't show steps
         - "minimal": minimalistic style, no steps, no operations, no states except for target and start_state
+        `pos` maps each node to its position. If it isn't given, the nodes are laid out with graphviz.
+        `target` is the goal node, the graph's goal state by default.
         """
+        if target is None:
+            target = self.goal_state
         G = self.G.copy()
         start_state = self.start_state
 
         # Position nodes using a hierarchical layout
-        pos = nx.nx_agraph.graphviz_layout(G, prog=prog)
+        if pos is None:
+            pos = nx.nx_agraph.graphviz_layout(G, prog=prog)
 
         fig, ax = plt.subplots(figsize=figsize)
 
@@ -359,7 +651,7 @@ class GraphBuilder:
             
             # In operations mode, make edge width proportional to number of visits
             if mode == "aggregate":
-                visits = len(attrs.get('op_timesteps', []))
+                visits = get_op_count(attrs)
                 edge_width = 3 + visits * 2
                 arrow_style = '-'
             else:
@@ -433,7 +725,7 @@ class GraphBuilder:
             )
 
         # find whether target node was visited
-        target_visited = any(attrs.get('visitation_timesteps', []) for node, attrs in G.nodes(data=True) if node == target)
+        target_visited = any(get_visit_count(attrs) > 0 for node, attrs in G.nodes(data=True) if node == target)
         plot_target = target_visited or (subgoal_nodes != [] and G.out_degree(target) > 0)
         # plot the target only if it was visited or if there are subgoals
         if plot_target:
@@ -512,7 +804,7 @@ class GraphBuilder:
         if plot_target and mode == "steps":
             nx.draw_networkx_labels(
                 G, pos,
-                labels={target: "24"},
+                labels={target: str(target[0])},
                 font_size=fontsize_node_labels + 2,
                 font_color='black',
                 font_weight='bold',
@@ -548,6 +840,11 @@ class GraphBuilder:
         # Check if start states match
         if self.start_state != other_graph.start_state:
             raise ValueError(f"Cannot unite graphs with different start states: {self.start_state} vs {other_graph.start_state}")
+        self.ensure_writable()
+
+        metric_counts = self.metric_counts
+        # the timesteps of the united graphs interleave, so they no longer form a single log
+        self.operation_log = None
 
         # Merge nodes
         for node, attrs in other_graph.G.nodes(data=True):
@@ -557,6 +854,7 @@ class GraphBuilder:
                 new_node = copy.deepcopy(node)
                 new_attrs = copy.deepcopy(attrs)
                 self.G.add_node(new_node, **new_attrs)
+                metric_counts["n_nodes"] += 1
             else:
                 # Combine visitation timesteps for existing nodes
                 self.G.nodes[node]['visitation_timesteps'].extend(
@@ -566,8 +864,11 @@ class GraphBuilder:
         # Merge edges
         for u, v, attrs in other_graph.G.edges(data=True):
             if not self.G.has_edge(u, v):
-                # Add new edge with all its attributes
-                self.G.add_edge(u, v, **attrs)
+                # Add new edge with a copy of its attributes, so other_graph's lists aren't extended later
+                self.G.add_edge(u, v, **copy.deepcopy(attrs))
+                update_edge_metric_counts(
+                    metric_counts, attrs.get("operation"), v, goal_state=self.goal_state
+                )
             else:
                 # Combine op_timesteps
                 if 'op_timesteps' in attrs:
@@ -589,9 +890,318 @@ class GraphBuilder:
 
     def copy(self):
         """
-        Returns a deep copy of the graph builder.
+        Returns a copy-on-write copy of the graph builder. The copy shares the underlying graph with
+        this one until either of them is modified through a GraphBuilder method, at which point the
+        one being modified makes its own deep copy. This graph's `.G` stays writable, but the
+        copy's `.G` is a read-only view of it in the meantime (so changes made to this graph
+        through `.G` directly show through the copy). The copy doesn't inherit the action hooks.
+        """
+        self._shares_graph = True
+        graph = copy.copy(self)
+        graph.G = self.G.copy(as_view=True)
+        graph.action_hooks = None
+        return graph
+
+    def ensure_writable(self) -> None:
+        """
+        Make a private, writable deep copy of the graph if it is shared with a copy or a view.
+        Called before every write.
+        """
+        if self._shares_graph or nx.is_frozen(self.G):
+            self.G = thaw_graph(self.G)
+            self._shares_graph = False
+            self.actions = list(self.actions)
+            if self._metric_counts is not None:
+                self._metric_counts = dict(self._metric_counts)
+            if self.operation_log is not None:
+                self.operation_log = self.operation_log.copy()
+
+    def add_action_hook(self, hook) -> None:
+        """
+        Call `hook(graph, action)` after each action that's added from now on, once the graph has
+        been updated (e.g. to check actions as they're added, see auto_checker.StreamingChecker).
+        """
+        if self.action_hooks is None:
+            self.action_hooks = []
+        self.action_hooks.append(hook)
+
+    def run_action_hooks(self, action: dict) -> None:
+        """Run the action hooks on an action that has been added"""
+        if self.action_hooks is not None:
+            for hook in self.action_hooks:
+                hook(self, action)
+
+    def record_action(self, action: dict) -> None:
+        """Add an action and run the action hooks on it"""
+        self.actions.append(action)
+        self.run_action_hooks(action)
+
+    def log_operation(self, source, target) -> None:
+        """Log the operation on an edge at the current operation timestep"""
+        if self.operation_log is not None:
+            operation = self.G.edges[(source, target)]["operation"]
+            self.operation_log.log_operation(
+                operation_label(operation, target), is_subgoal=operation == "subgoal"
+            )
+
+    def log_visit(self, state) -> None:
+        """Log a visit to a state at the current node visitation timestep"""
+        if self.operation_log is not None:
+            self.operation_log.log_visit(state)
+
+    @property
+    def metric_counts(self) -> dict:
+        """
+        Counters for the graph metrics (see count_graph_metrics), which are kept up to date by the
+        GraphBuilder methods, so they're stale if `.G` is modified directly.
+        """
+        if self._metric_counts is None:
+            self._metric_counts = count_graph_metrics(self.G, self.goal_state)
+        return self._metric_counts
+
+    @property
+    def goal_state(self) -> tuple:
+        return (self.target,)
+
+    @property
+    def state_space(self) -> CountdownStateSpace:
+        """The state space of the problem, e.g. to check solvability or the distance to the target"""
+        return CountdownStateSpace(self.start_state, self.target)
+
+    def get_metrics(self) -> dict:
+        """
+        The metrics in graph_metrics.metrics, read from the counters in constant time.
+        """
+        metric_counts = self.metric_counts
+        n_nodes = metric_counts["n_nodes"]
+        n_edges = metric_counts["n_edges"]
+        return {
+            "reached_goal": metric_counts["goal_in_degree"] > 0,
+            "mean_branching_factor": n_edges / n_nodes,
+            "mean_degree": 2 * n_edges / n_nodes,
+            "n_subgoals": metric_counts["n_subgoals"],
+            "n_nodes": n_nodes,
+            "n_edges": n_edges,
+        }
+
+    def apply_action(self, action: dict) -> None:
+        """Replay a single action from another graph's action log"""
+        if action["type"] == "explore_operation":
+            self.explore_operation(
+                action["curr_state"],
+                action["operation"],
+                action["resulting_state"],
+                result_calc_error=action["result_calc_error"],
+                comment=action["comment"],
+            )
+        elif action["type"] == "move_to_node":
+            self.move_to_node(action["new_state"])
+        elif action["type"] == "set_subgoal":
+            self.set_subgoal(
+                action["subgoal_state"],
+                state_after_subgoal=action["state_after_subgoal"],
+                comment=action["comment"],
+            )
+        elif action["type"] != "start":
+            raise ValueError(f"Unknown action type '{action['type']}'")
+
+    def iter_snapshots(self):
+        """
+        Replay the action log, yielding the number of actions replayed so far (not counting the
+        start) and the partially built graph after each action. The same graph object is updated
+        in place, so copy it (cheap, see GraphBuilder.copy) to keep a snapshot.
+        """
+        graph = type(self)(self.actions[0]["state"], target=self.target)
+        yield 0, graph
+        for n_actions, action in enumerate(self.actions[1:], start=1):
+            graph.apply_action(action)
+            yield n_actions, graph
+
+    def get_action_op_timesteps(self) -> list[int]:
+        """
+        A prefix index over the action log: the number of operation timesteps used up after each
+        action (explore_operation uses one per sub-operation, set_subgoal uses one)
+        """
+        op_timesteps = []
+        n_operations = 0
+        for action in self.actions:
+            if action["type"] == "explore_operation":
+                n_operations += len(action["sub_operations"] or [None])
+            elif action["type"] == "set_subgoal":
+                n_operations += 1
+            op_timesteps.append(n_operations)
+        return op_timesteps
+
+    def snapshot(
+        self,
+        n_actions: Optional[int] = None,
+        n_operations: Optional[int] = None,
+        fraction: Optional[float] = None,
+    ) -> "GraphBuilder":
         """
-        return copy.deepcopy(self)
+        Rebuild the graph as it was part of the way through the trial, as a new graph.
+        Give exactly one of:
+            n_actions: after the first n actions (not counting the start)
+            n_operations: after the actions that make up the first n operation timesteps. An
+                action with several sub-operations is only included once all of them are.
+            fraction: after that fraction of the operation timesteps. Actions aren't timestamped,
+                so this is how to slice the graph at a fraction of the trial's response time.
+
+        Example usage:
+        --------
+        >>> halfway_graph = graph.snapshot(fraction=0.5)
+        """
+        if sum(arg is not None for arg in (n_actions, n_operations, fraction)) != 1:
+            raise ValueError("Give exactly one of n_actions, n_operations or fraction")
+        if n_actions is None:
+            op_timesteps = self.get_action_op_timesteps()
+            if fraction is not None:
+                n_operations = int(fraction * op_timesteps[-1])
+            # the number of actions (after the start) whose operations all fit in n_operations
+            n_actions = sum(t <= n_operations for t in op_timesteps[1:])
+
+        for replayed_actions, graph in self.iter_snapshots():
+            if replayed_actions == n_actions:
+                return graph
+        return graph
+
+    def get_growth_curve(self) -> list[dict]:
+        """
+        The graph metrics (see get_metrics) after each action, from a single replay of the action log
+        """
+        growth_curve = []
+        for (n_actions, graph), n_operations in zip(
+            self.iter_snapshots(), self.get_action_op_timesteps()
+        ):
+            growth_curve.append(
+                {
+                    "n_actions": n_actions,
+                    "n_operations": n_operations,
+                    "action_type": self.actions[n_actions]["type"],
+                    **graph.get_metrics(),
+                }
+            )
+        return growth_curve
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialize the graph (nodes, edges, their attributes, the counters and the actions) into a
+        compact versioned format: a small header followed by a zlib-compressed payload of plain
+        Python values. Use GraphBuilder.from_bytes to load it.
+        """
+        payload = {
+            "start_state": self.start_state,
+            "target": self.target,
+            "node_visitation_timestep": self.node_visitation_timestep,
+            "op_timestep": self.op_timestep,
+            "nodes": list(self.G.nodes(data=True)),
+            "edges": list(self.G.edges(data=True)),
+            "actions": self.actions,
+        }
+        return SERIALIZATION_HEADER.pack(
+            SERIALIZATION_MAGIC, GRAPH_BUILDER_VERSION
+        ) + zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "GraphBuilder":
+        """
+        Load a graph serialized with to_bytes (from either backend) as a networkx-backed GraphBuilder.
+        Only load data you trust, since the payload is pickled.
+
+        Raises:
+            ValueError: If the data isn't a serialized graph or was written by a different GraphBuilder version
+        """
+        magic, version = SERIALIZATION_HEADER.unpack_from(data)
+        if magic != SERIALIZATION_MAGIC:
+            raise ValueError("Data is not a serialized GraphBuilder")
+        if version != GRAPH_BUILDER_VERSION:
+            raise ValueError(
+                f"Serialized graph has version {version}, but the current GraphBuilder version is {GRAPH_BUILDER_VERSION}"
+            )
+        payload = pickle.loads(zlib.decompress(data[SERIALIZATION_HEADER.size :]))
+
+        G = nx.DiGraph()
+        G.add_nodes_from(payload["nodes"])
+        G.add_edges_from(payload["edges"])
+        graph = GraphBuilder.__new__(GraphBuilder)
+        graph.__dict__.update(
+            G=G,
+            start_state=payload["start_state"],
+            target=payload.get("target", GraphBuilder.target),
+            node_visitation_timestep=payload["node_visitation_timestep"],
+            op_timestep=payload["op_timestep"],
+            actions=payload["actions"],
+        )
+        return graph
+
+    def view(
+        self, remove_subgoals: bool = False, min_visits: int = 0, drop_isolates: bool = False
+    ) -> "GraphBuilder":
+        """
+        Returns a read-only filtered view of the graph that shares its nodes, edges and attributes
+        with this one. Writing to the view (through the GraphBuilder methods) first copies it.
+
+        Args:
+            remove_subgoals: hide subgoal edges
+            min_visits: hide nodes that were visited fewer than this many times
+            drop_isolates: hide nodes that have no edges left after the other filters
+
+        Example usage:
+        --------
+        >>> pruned_graph = graph.view(remove_subgoals=True, min_visits=2, drop_isolates=True)
+        """
+        G = self.G
+        # writes to this graph (through the GraphBuilder methods) copy it first, so that they
+        # don't show through the view
+        self._shares_graph = True
+        nodes = {
+            node
+            for node, data in G.nodes(data=True)
+            if get_visit_count(data) >= min_visits
+        }
+        edges = {
+            (u, v)
+            for u, v, data in G.edges(data=True)
+            if u in nodes
+            and v in nodes
+            and not (remove_subgoals and data.get("operation") == "subgoal")
+        }
+        if drop_isolates:
+            nodes = {node for edge in edges for node in edge}
+
+        graph_view = GraphBuilder.__new__(GraphBuilder)
+        graph_view.__dict__.update(
+            G=nx.subgraph_view(
+                G,
+                filter_node=nodes.__contains__,
+                filter_edge=lambda u, v: (u, v) in edges,
+            ),
+            start_state=self.start_state,
+            target=self.target,
+            node_visitation_timestep=self.node_visitation_timestep,
+            op_timestep=self.op_timestep,
+            actions=self.actions,
+        )
+        return graph_view
+
+    target = 24  # the number to make
+    # the metrics are counted when they're first needed, see metric_counts
+    _metric_counts = None
+    # callbacks that are run on every new action, see add_action_hook
+    action_hooks = None
+    # whether the networkx graph is shared with a copy or a view, see ensure_writable
+    _shares_graph = False
+    # graphs that aren't built through __init__ (views and loaded graphs) don't have an operation
+    # log, since their timesteps may not describe a single trial
+    operation_log = None
+
+    # The DSL methods (from __init__ to set_subgoal) are shown to the coding model as they're
+    # written (see prompts.get_graphbuilder_code), so bookkeeping is wrapped around them here
+    __init__ = with_init_bookkeeping(__init__)
+    explore_operation = writes_graph(runs_action_hooks(explore_operation))
+    add_connected_node = writes_graph(with_connected_node_bookkeeping(add_connected_node))
+    move_to_node = writes_graph(runs_action_hooks(with_move_bookkeeping(move_to_node)))
+    set_subgoal = writes_graph(runs_action_hooks(with_subgoal_bookkeeping(set_subgoal)))
 
 if __name__ == "__main__":
 
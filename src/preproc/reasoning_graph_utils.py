@@ -1,44 +1,34 @@
 import re
-
-
-# Enhanced tokenizer function to handle negative numbers
+from functools import lru_cache
+
+
+# Numbers are made of the characters that str.isdigit accepts and ".". Besides \d, those are a few
+# digit-like characters (e.g. superscripts), which are all word characters. So numbers are runs of
+# word characters and ".", once the characters that aren't \d, ".", operators or whitespace have
+# been checked with str.isdigit.
+NUMBER_CHARACTERS = r"\w."
+# One alternative per kind of token: a number, a signed number, an operator or parenthesis. A sign
+# is part of a number (unary) at the start of the expression or right after an operator or "("
+# (with whitespace in between, it's a binary operator).
+TOKEN_PATTERN = re.compile(
+    rf"[{NUMBER_CHARACTERS}]+|[-+](?<![^-+*/(].)[{NUMBER_CHARACTERS}]*|[-+*/()]"
+)
+UNCOMMON_CHARACTER_PATTERN = re.compile(r"[^-+*/().\d\s]")
+NUMBER_PATTERN = re.compile(r"^[+-]?(\d+(\.\d+)?)$")
+
+
+@lru_cache(maxsize=65536)
+def tokenize_cached(expression) -> tuple:
+    for character in UNCOMMON_CHARACTER_PATTERN.findall(expression):
+        if not character.isdigit():
+            raise ValueError(f"Invalid character '{character}' in expression")
+    return tuple(TOKEN_PATTERN.findall(expression))
+
+
+# Enhanced tokenizer function to handle negative numbers. Expressions are tokenized once, and each
+# call returns a new list.
 def tokenize(expression):
-    tokens = []
-    i = 0
-    length = len(expression)
-    while i < length:
-        c = expression[i]
-        if c.isspace():
-            i += 1
-            continue
-        elif c in "+-":
-            # Check if this is a unary operator
-            if i == 0 or expression[i - 1] in "+-*/(":
-                # Unary operator: part of a number
-                num = c
-                i += 1
-                while i < length and (expression[i].isdigit() or expression[i] == "."):
-                    num += expression[i]
-                    i += 1
-                tokens.append(num)
-            else:
-                # Binary operator
-                tokens.append(c)
-                i += 1
-        elif c.isdigit() or c == ".":
-            # Number
-            num = ""
-            while i < length and (expression[i].isdigit() or expression[i] == "."):
-                num += expression[i]
-                i += 1
-            tokens.append(num)
-        elif c in "*/()":
-            # Operator or parenthesis
-            tokens.append(c)
-            i += 1
-        else:
-            raise ValueError(f"Invalid character '{c}' in expression")
-    return tokens
+    return list(tokenize_cached(expression))
 
 
 # Precedence function remains the same
@@ -99,7 +89,7 @@ def evaluate_expression(tokens):
         token = tokens[i]
 
         # If it's a number (including negative numbers), push to operands stack
-        if re.match(r"^[+-]?(\d+(\.\d+)?)$", token):
+        if NUMBER_PATTERN.match(token):
             if "." in token:
                 operands.append(float(token))
             else:
@@ -142,11 +132,16 @@ def evaluate_expression(tokens):
     return results, sub_operations
 
 
-# Main function remains mostly the same
+@lru_cache(maxsize=65536)
+def get_sub_operations_cached(expression) -> tuple:
+    _, sub_operations = evaluate_expression(tokenize_cached(expression))
+    return tuple(tuple(sub_operation) for sub_operation in sub_operations)
+
+
+# Main function remains mostly the same. The same operations come up over and over, so they're
+# parsed once; each call returns new lists, since the actions of a graph keep them.
 def get_sub_operations(expression):
-    tokens = tokenize(expression)
-    results, sub_operations = evaluate_expression(tokens)
-    return sub_operations
+    return [list(sub_operation) for sub_operation in get_sub_operations_cached(expression)]
 
 
 # Testing the updated code with expressions involving negative numbers
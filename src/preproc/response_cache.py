@@ -0,0 +1,116 @@
+"""
+A cache of language model responses, so that reruns (and runs that are resumed after a crash) get
+the responses of the requests they already made without calling the model again.
+
+Responses are stored in a SQLite database, keyed by a hash of the request: the model, the system
+prompt, the messages, the temperature and any other options (e.g. a grammar). Each response is
+committed as soon as it's stored. Requests that are made again in the same run (e.g. a retry that
+resends a prompt at the same temperature) are keyed by how many times they've been made, so they
+get a fresh sample the first time and the same sequence of samples on every rerun.
+
+Example usage:
+--------
+>>> cache = get_response_cache("data/llm-cache/responses.sqlite")
+>>> key = cache.next_key("gpt-4o", system_prompt, messages, temp=0.0)
+>>> response = cache.get(key)  # None if the request wasn't made before
+>>> cache.put(key, "gpt-4o", response)
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from typing import Optional
+from pyprojroot import here
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY, model TEXT NOT NULL, response TEXT NOT NULL, created REAL NOT NULL
+);
+"""
+
+
+def get_request_key(
+    model_name: str, system_prompt: str, messages: list[dict], temp: float = 0.0, **options
+) -> str:
+    """A hash of a request to a model"""
+    request = {
+        "model": model_name,
+        "system_prompt": system_prompt,
+        "messages": messages,
+        "temp": temp,
+        "options": options,
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    A SQLite cache of model responses (see the module docstring). A cache can be used from many
+    threads and processes at once.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = str(filepath)
+        self.local = threading.local()
+        # how many times each request has been made in this process
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The connection of this thread (and process) to the database"""
+        if getattr(self.local, "pid", None) != os.getpid():
+            os.makedirs(os.path.dirname(self.filepath) or ".", exist_ok=True)
+            # the timeout waits for other processes that are writing to the cache
+            connection = sqlite3.connect(self.filepath, timeout=60)
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def next_key(
+        self,
+        model_name: str,
+        system_prompt: str,
+        messages: list[dict],
+        temp: float = 0.0,
+        **options,
+    ) -> str:
+        """The key of the next time a request is made (see the module docstring)"""
+        request_key = get_request_key(model_name, system_prompt, messages, temp, **options)
+        with self.lock:
+            n_made = self.counts[request_key]
+            self.counts[request_key] += 1
+        return hashlib.sha256(f"{request_key}\0{n_made}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.connection.execute(
+            "SELECT response FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, key: str, model_name: str, response: str) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, model_name, response, time.time()),
+            )
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+@lru_cache(maxsize=None)
+def get_response_cache(filepath) -> Optional[ResponseCache]:
+    """
+    The cache at a path (relative to the project root), shared by everything in this process.
+    None if there's no path.
+    """
+    if not filepath:
+        return None
+    return ResponseCache(here(filepath))
@@ -0,0 +1,167 @@
+"""
+Search-strategy metrics (backtracking, revisits, depth and depth-first vs breadth-first tendencies)
+for many trials at once, computed from the event table (see event_table.py) with array operations
+instead of per-graph loops over GraphBuilder.actions.
+
+The position of a participant is the state they last started at or moved to with move_to_node.
+Depths count the operations from the start state, i.e. how many numbers have been combined.
+
+Solvability metrics look the states up in a precomputed StateOracle (see state_oracle.py).
+
+Example usage:
+--------
+>>> table = build_event_table(graphs)
+>>> df_search = compute_search_metrics(table)  # one row per trial id
+>>> df_solvability = compute_solvability_metrics(table, StateOracle.load())
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from src.preproc.event_table import get_states
+
+SEARCH_METRICS = [
+    "n_moves",
+    "n_backtracks",
+    "n_revisits",
+    "max_depth",
+    "depth_first_ratio",
+    "breadth_first_ratio",
+]
+
+SOLVABILITY_METRICS = [
+    "fraction_solvable_operations",
+    "n_dead_end_operations",
+]
+
+
+def get_event_arrays(table: pa.Table) -> dict:
+    """The event table columns used by the search metrics, as numpy arrays (-1 for missing states)"""
+    return {
+        "trial_id": table["trial_id"].to_numpy(),
+        "action_type": table["action_type"].to_pandas().to_numpy(dtype=str),
+        "start_state_id": table["start_state_id"].to_numpy(),
+        "curr_state_id": table["curr_state_id"].fill_null(-1).to_numpy(),
+        "resulting_state_id": table["resulting_state_id"].fill_null(-1).to_numpy(),
+    }
+
+
+def compute_search_metrics(table: pa.Table) -> pd.DataFrame:
+    """
+    Compute the search metrics for every trial in an event table:
+        n_moves: the number of move_to_node actions
+        n_backtracks: moves to a state that is no deeper than the current position, i.e. moves that
+            abandon the current branch
+        n_revisits: moves to a state that the participant was already positioned at before
+        max_depth: the greatest depth of any state reached by an operation
+        depth_first_ratio: the fraction of consecutive operations where the second one continues
+            from the state that the first one produced
+        breadth_first_ratio: the fraction of consecutive operations that start from the same state
+    The ratios are NaN for trials with fewer than two operations.
+    Returns a DataFrame indexed by trial id. Relies on each trial's events being contiguous and
+    starting with its start event, which is how build_event_table writes them.
+    """
+    events = get_event_arrays(table)
+    trial_id = events["trial_id"]
+    resulting_state_id = events["resulting_state_id"]
+    curr_state_id = events["curr_state_id"]
+    is_start = events["action_type"] == "start"
+    is_move = events["action_type"] == "move_to_node"
+    is_explore = events["action_type"] == "explore_operation"
+    trial_ids = pd.unique(trial_id)
+    if len(trial_id) == 0:
+        return pd.DataFrame(columns=SEARCH_METRICS, index=pd.Index([], name="trial_id"))
+
+    state_sizes = np.array([len(state) for state in get_states(table)])
+    start_sizes = state_sizes[events["start_state_id"]]
+    # set_subgoal events have no meaningful depth, and are masked out below
+    depth = np.where(resulting_state_id >= 0, start_sizes - state_sizes[resulting_state_id], 0)
+
+    # the position after each event, forward-filled from the last start or move
+    is_position = is_start | is_move
+    last_position = np.maximum.accumulate(np.where(is_position, np.arange(len(trial_id)), 0))
+    position_depth = depth[last_position]
+    # the position before each event (each trial starts with a start event, so this never
+    # crosses into the previous trial for moves)
+    prev_position_depth = np.concatenate([[0], position_depth[:-1]])
+    is_backtrack = is_move & (depth <= prev_position_depth)
+
+    position_events = pd.DataFrame(
+        {"trial_id": trial_id[is_position], "state_id": resulting_state_id[is_position]}
+    )
+    is_revisit = np.zeros(len(trial_id), dtype=bool)
+    is_revisit[is_position] = position_events.duplicated().to_numpy()
+    is_revisit &= is_move
+
+    # consecutive pairs of operations within the same trial
+    explore_trial_id = trial_id[is_explore]
+    explore_curr = curr_state_id[is_explore]
+    explore_resulting = resulting_state_id[is_explore]
+    is_pair = explore_trial_id[1:] == explore_trial_id[:-1]
+    is_depth_first = is_pair & (explore_curr[1:] == explore_resulting[:-1])
+    is_breadth_first = is_pair & (explore_curr[1:] == explore_curr[:-1])
+    pair_trial_id = explore_trial_id[1:]
+
+    def count_by_trial(values, ids=trial_id):
+        return pd.Series(values, index=ids).groupby(level=0).sum().reindex(trial_ids, fill_value=0)
+
+    n_pairs = count_by_trial(is_pair.astype(int), pair_trial_id)
+    df = pd.DataFrame(
+        {
+            "n_moves": count_by_trial(is_move.astype(int)),
+            "n_backtracks": count_by_trial(is_backtrack.astype(int)),
+            "n_revisits": count_by_trial(is_revisit.astype(int)),
+            "max_depth": pd.Series(np.where(is_explore, depth, 0), index=trial_id)
+            .groupby(level=0)
+            .max()
+            .reindex(trial_ids),
+            "depth_first_ratio": count_by_trial(is_depth_first.astype(int), pair_trial_id)
+            / n_pairs.replace(0, np.nan),
+            "breadth_first_ratio": count_by_trial(is_breadth_first.astype(int), pair_trial_id)
+            / n_pairs.replace(0, np.nan),
+        },
+        index=trial_ids,
+    )
+    df.index.name = "trial_id"
+    return df
+
+
+def compute_solvability_metrics(table: pa.Table, oracle) -> pd.DataFrame:
+    """
+    Compute the solvability metrics for every trial in an event table:
+        fraction_solvable_operations: the fraction of operations whose resulting state can still
+            make the target (NaN for trials without operations)
+        n_dead_end_operations: operations from a state that can make the target to one that can't
+    Every state is looked up in the oracle once, so each trial's metrics are array operations.
+    States that aren't in the oracle (e.g. after calculation errors) are checked by its fallback.
+    Returns a DataFrame indexed by trial id.
+    """
+    events = get_event_arrays(table)
+    trial_id = events["trial_id"]
+    trial_ids = pd.unique(trial_id)
+    states = get_states(table)
+    indices = oracle.lookup(states) if states else np.zeros(0, dtype=int)
+    state_solvable = oracle.solvable[np.maximum(indices, 0)].astype(bool)
+    for state_id in np.flatnonzero(indices < 0):
+        state_solvable[state_id] = oracle.is_solvable(states[state_id])
+
+    is_explore = events["action_type"] == "explore_operation"
+    explore_trial_id = trial_id[is_explore]
+    curr_solvable = state_solvable[events["curr_state_id"][is_explore]]
+    resulting_solvable = state_solvable[events["resulting_state_id"][is_explore]]
+
+    def by_trial(values, aggregate):
+        grouped = pd.Series(values, index=explore_trial_id, dtype=float).groupby(level=0)
+        return getattr(grouped, aggregate)().reindex(trial_ids)
+
+    df = pd.DataFrame(
+        {
+            "fraction_solvable_operations": by_trial(resulting_solvable, "mean"),
+            "n_dead_end_operations": by_trial(curr_solvable & ~resulting_solvable, "sum")
+            .fillna(0)
+            .astype(int),
+        },
+        index=trial_ids,
+    )
+    df.index.name = "trial_id"
+    return df
@@ -0,0 +1,298 @@
+"""
+A precomputed oracle for the states of the Game-of-24 problems, so analyses can look states up
+instead of redoing the arithmetic for every action.
+
+The oracle holds every state that can be reached from the start states of the problem set. For each
+state it records whether 24 can still be made from it, the fewest operations needed to make 24, and
+its legal successors (each with the operation that leads to it). Solvability doesn't depend on the
+problem a state came from, so states are shared between problems.
+
+The oracle is stored as a directory of .npy files that are memory-mapped when loaded:
+    keys.npy: the states (as their repr, e.g. b"(4, 6)"), sorted so they can be binary searched
+    solvable.npy, distance.npy: whether each state can make the target, and in how many operations (-1 if it can't)
+    successor_offsets.npy, successor_ids.npy, successor_operations.npy: the successors of each state,
+        in compressed sparse row form (the successors of state i are at offsets[i]:offsets[i + 1])
+    metadata.json: the target and the problems the oracle was built for
+
+Example usage:
+--------
+>>> python -m src.preproc.state_oracle  # build data/state-oracle from the problem set
+>>> oracle = StateOracle.load()
+>>> oracle.is_solvable((4, 6)), oracle.distance_to_target((1, 2, 3, 4))
+(True, 3)
+>>> oracle.successors((3, 12))[:2]
+[('3+12=15', (15,)), ('3-12=-9', (-9,))]
+"""
+
+import json
+import os
+from argparse import ArgumentParser
+from ast import literal_eval
+from collections import deque
+from functools import lru_cache
+from typing import Iterable, Optional
+import numpy as np
+import pandas as pd
+from pyprojroot import here
+from src.preproc.state_space import (
+    CountdownStateSpace,
+    get_successors,
+    makes_target,
+    normalize_operation,
+    to_fraction,
+    to_multiset,
+    to_state,
+)
+
+ORACLE_ARRAYS = [
+    "keys",
+    "solvable",
+    "distance",
+    "successor_offsets",
+    "successor_ids",
+    "successor_operations",
+]
+
+
+def state_key(state) -> bytes:
+    """The key of a state in the oracle: the repr of its canonical (sorted, rounded) form"""
+    if all(type(number) is int for number in state):
+        return repr(tuple(sorted(state))).encode()
+    return repr(to_state(to_multiset(state))).encode()
+
+
+def read_problem_set(filepath=here("data/problem-set/problem_set.csv")) -> list[tuple]:
+    """The start states of the problems in the problem set"""
+    df = pd.read_csv(filepath)
+    return [tuple(int(number) for number in puzzle.split()) for puzzle in df["Puzzles"]]
+
+
+def build_state_oracle(start_states: Iterable[tuple], target=24) -> dict:
+    """
+    Enumerate every state reachable from the start states and compute the oracle arrays.
+    States are explored with exact arithmetic. Different exact states can round to the same state
+    (e.g. 8/3 and 2.67), in which case their successors are merged and the rounded state counts as
+    solvable if any of them is.
+    """
+    exact_target = to_fraction(target)
+    start_multisets = [to_multiset(start_state) for start_state in start_states]
+    queue = deque(start_multisets)
+    seen = set(start_multisets)
+    solvable = {}
+    n_numbers = {}
+    successors = {}
+    while queue:
+        multiset = queue.popleft()
+        key = repr(to_state(multiset)).encode()
+        solvable[key] = solvable.get(key, False) or makes_target(multiset, exact_target)
+        n_numbers[key] = len(multiset)
+        key_successors = successors.setdefault(key, {})
+        for operation, successor in get_successors(multiset):
+            key_successors.setdefault(operation, repr(to_state(successor)).encode())
+            if successor not in seen:
+                seen.add(successor)
+                queue.append(successor)
+
+    keys = np.array(sorted(solvable), dtype=bytes)
+    ids = {key: i for i, key in enumerate(keys.tolist())}
+    # every operation combines two numbers into one, so a state with n numbers is n-1 operations
+    # away from the target if it's solvable
+    distance = np.array(
+        [n_numbers[key] - 1 if solvable[key] else -1 for key in keys.tolist()], dtype=np.int8
+    )
+    successor_offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    successor_ids = []
+    successor_operations = []
+    for i, key in enumerate(keys.tolist()):
+        for operation, successor_key in successors[key].items():
+            successor_ids.append(ids[successor_key])
+            successor_operations.append(operation.encode())
+        successor_offsets[i + 1] = len(successor_ids)
+
+    return {
+        "keys": keys,
+        "solvable": np.array([solvable[key] for key in keys.tolist()], dtype=bool),
+        "distance": distance,
+        "successor_offsets": successor_offsets,
+        "successor_ids": np.array(successor_ids, dtype=np.int32),
+        "successor_operations": np.array(successor_operations, dtype=bytes),
+    }
+
+
+class StateOracle:
+    """
+    Lookups into a precomputed oracle. Queries about states that aren't in the oracle (e.g. states
+    with calculation errors, or from problems outside the problem set) are answered by a
+    CountdownStateSpace instead, so the answers are the same either way, just slower.
+
+    The state-level queries match CountdownStateSpace, so an oracle can be passed wherever a state
+    space is expected (e.g. auto_checker.check_graph).
+    """
+
+    def __init__(self, arrays: dict, target=24):
+        self.target = target
+        for name in ORACLE_ARRAYS:
+            setattr(self, name, arrays[name])
+        # single-state queries are binary searches through the keys, with the recent ones cached
+        self._find_key = lru_cache(maxsize=65536)(self._find_key)
+        self._states = {}
+
+    @staticmethod
+    def load(directory=here("data/state-oracle"), mmap=True) -> "StateOracle":
+        directory = str(directory)
+        with open(os.path.join(directory, "metadata.json")) as f:
+            metadata = json.load(f)
+        arrays = {
+            # plain ndarray views of the memory maps, since slicing a np.memmap is slow
+            name: np.load(
+                os.path.join(directory, name + ".npy"), mmap_mode="r" if mmap else None
+            ).view(np.ndarray)
+            for name in ORACLE_ARRAYS
+        }
+        return StateOracle(arrays, target=metadata["target"])
+
+    def save(self, directory=here("data/state-oracle"), problems=None) -> None:
+        directory = str(directory)
+        os.makedirs(directory, exist_ok=True)
+        for name in ORACLE_ARRAYS:
+            np.save(os.path.join(directory, name + ".npy"), getattr(self, name))
+        with open(os.path.join(directory, "metadata.json"), "w") as f:
+            json.dump(
+                {"target": self.target, "problems": problems, "n_states": len(self.keys)}, f
+            )
+
+    @property
+    def goal_state(self) -> tuple:
+        return (self.target,)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get_state_space(self, state) -> CountdownStateSpace:
+        return CountdownStateSpace(state, self.target)
+
+    def lookup(self, states) -> np.ndarray:
+        """The index of each state in the oracle (-1 for states that aren't in it), vectorized"""
+        keys = [state_key(state) for state in states]
+        # keys longer than the oracle's fixed-width keys would be truncated, and can't be in it
+        fits = np.array([len(key) <= self.keys.itemsize for key in keys], dtype=bool)
+        keys = np.array(keys, dtype=self.keys.dtype)
+        indices = np.searchsorted(self.keys, keys)
+        indices = np.minimum(indices, len(self.keys) - 1)
+        return np.where(fits & (self.keys[indices] == keys), indices, -1)
+
+    def _find_key(self, key: bytes) -> Optional[int]:
+        # keys longer than the oracle's fixed-width keys can't be in it (see lookup)
+        if len(key) > self.keys.itemsize:
+            return None
+        index = int(np.searchsorted(self.keys, key))
+        if index < len(self.keys) and self.keys[index] == key:
+            return index
+        return None
+
+    def index(self, state) -> Optional[int]:
+        """The index of a state in the oracle, or None if it isn't in it"""
+        return self._find_key(state_key(state))
+
+    def is_solvable(self, state) -> bool:
+        index = self.index(state)
+        if index is None:
+            return self.get_state_space(state).is_solvable()
+        return bool(self.solvable[index])
+
+    def distance_to_target(self, state) -> Optional[int]:
+        index = self.index(state)
+        if index is None:
+            return self.get_state_space(state).distance_to_target()
+        distance = int(self.distance[index])
+        return None if distance < 0 else distance
+
+    def get_whole_number_index(self, state) -> Optional[int]:
+        """
+        The index of a state in the oracle, if it's in it and only has whole numbers. The successors
+        of rounded numbers are computed from their exact values in the oracle, so queries about
+        their operations are left to the state space, which works on the rounded numbers like
+        the code translations do.
+        """
+        if any(isinstance(number, float) for number in state):
+            return None
+        return self.index(state)
+
+    def successors(self, state) -> list[tuple[str, tuple]]:
+        """Every operation on two numbers of a state, with the state that it results in"""
+        index = self.get_whole_number_index(state)
+        if index is None:
+            return self.get_state_space(state).successors(state)
+        start, end = self.successor_offsets[index], self.successor_offsets[index + 1]
+        return [
+            (operation.decode(), self.get_state(successor_id))
+            for operation, successor_id in zip(
+                self.successor_operations[start:end], self.successor_ids[start:end]
+            )
+        ]
+
+    def get_successor(self, state, operation: str) -> Optional[tuple]:
+        """
+        The state that a single operation (e.g. "3*4=12") leads to from a state, or None if it
+        isn't one of the state's legal operations (see CountdownStateSpace.get_successor).
+        """
+        index = self.get_whole_number_index(state)
+        if index is None:
+            return self.get_state_space(state).get_successor(state, operation)
+        operation = normalize_operation(operation).encode()
+        start, end = self.successor_offsets[index], self.successor_offsets[index + 1]
+        operations = self.successor_operations[start:end].tolist()
+        if operation not in operations:
+            return None
+        return self.get_state(int(self.successor_ids[start + operations.index(operation)]))
+
+    def get_state(self, index: int) -> tuple:
+        state = self._states.get(index)
+        if state is None:
+            state = self._states[index] = literal_eval(self.keys[index].decode())
+        return state
+
+    def can_reach(self, state, other_state) -> bool:
+        """Whether `other_state` can be reached from `state` (see CountdownStateSpace.can_reach)"""
+        index, other_index = self.index(state), self.index(other_state)
+        if index is None or other_index is None:
+            return self.get_state_space(state).can_reach(state, other_state)
+        frontier = {index}
+        seen = {index}
+        while frontier:
+            if other_index in frontier:
+                return True
+            next_frontier = set()
+            for i in frontier:
+                start, end = self.successor_offsets[i], self.successor_offsets[i + 1]
+                next_frontier.update(self.successor_ids[start:end].tolist())
+            frontier = next_frontier - seen
+            seen |= frontier
+        return False
+
+
+def get_state_oracle(directory=here("data/state-oracle"), problem_set=None) -> StateOracle:
+    """Load the oracle from a directory, building it from the problem set first if it isn't there"""
+    if not os.path.exists(os.path.join(str(directory), "metadata.json")):
+        problems = read_problem_set(*([problem_set] if problem_set is not None else []))
+        oracle = StateOracle(build_state_oracle(problems))
+        oracle.save(directory, problems=[list(problem) for problem in problems])
+    return StateOracle.load(directory)
+
+
+def main(args):
+    problems = read_problem_set(here(args.problem_set))
+    oracle = StateOracle(build_state_oracle(problems, args.target), target=args.target)
+    oracle.save(here(args.output_dir), problems=[list(problem) for problem in problems])
+    print(f"Wrote an oracle of {len(oracle)} states to {here(args.output_dir)}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--problem_set", type=str, default="data/problem-set/problem_set.csv"
+    )
+    parser.add_argument("--output_dir", type=str, default="data/state-oracle")
+    parser.add_argument("--target", type=int, default=24)
+    args = parser.parse_args()
+    main(args)
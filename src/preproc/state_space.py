@@ -0,0 +1,310 @@
+"""
+The state space of Countdown-style number games: combine a multiset of numbers with +, -, * and /
+to make a target (the game of 24 is the special case of 4 numbers and a target of 24).
+
+Solvability and distance to the target are computed with subset dynamic programming: the values
+that a multiset of numbers can make are built from the values of its sub-multisets, and memoized by
+the sorted multiset, so sub-multisets are shared between states, problems and targets. This keeps
+problems with 5 or 6 numbers tractable. All arithmetic is exact (with Fractions); states are
+converted to the 2-decimal numbers used in graphs only at the boundary.
+
+Example usage:
+--------
+>>> space = CountdownStateSpace((1, 2, 3, 4), target=24)
+>>> space.is_solvable()
+True
+>>> space.successors((1, 2, 3, 4))[0]
+('1+2=3', (3, 3, 4))
+>>> CountdownStateSpace((25, 50, 75, 100, 3, 6), target=952).distance_to_target()
+5
+"""
+
+import re
+from fractions import Fraction
+from functools import lru_cache
+from itertools import combinations
+from typing import Optional, Union
+from src.preproc.arithmetic import is_close, parse_number, to_number
+
+OPERATORS = ("+", "-", "*", "/")
+COMMUTATIVE_OPERATION_PATTERN = re.compile(r"^\s*(-?[\d.]+)\s*([+*])\s*(-?[\d.]+)\s*=\s*(-?[\d.]+)\s*$")
+
+
+def to_fraction(number: Union[int, float, Fraction]) -> Fraction:
+    """Convert a number in a state to an exact Fraction (floats by their decimal representation)"""
+    if isinstance(number, Fraction):
+        return number
+    if isinstance(number, float):
+        return parse_number(repr(number))
+    return Fraction(number)
+
+
+def to_multiset(state) -> tuple[Fraction, ...]:
+    """The canonical (sorted, exact) form of a state, used as the memoization key"""
+    return tuple(sorted(to_fraction(number) for number in state))
+
+
+def to_state(multiset) -> tuple:
+    """Convert a multiset of Fractions back to a state, as it would appear in a graph"""
+    return tuple(sorted(to_number(number, ndigits=2) for number in multiset))
+
+
+def apply_operator(a: Fraction, operator: str, b: Fraction) -> Optional[Fraction]:
+    """The result of `a operator b`, or None for a division by zero"""
+    if operator == "+":
+        return a + b
+    if operator == "-":
+        return a - b
+    if operator == "*":
+        return a * b
+    return a / b if b != 0 else None
+
+
+@lru_cache(maxsize=65536)
+def combine_values(values: frozenset, other_values: frozenset) -> frozenset:
+    """Every value that can be made by combining a value from each set with one operation"""
+    results = set()
+    for a in values:
+        for b in other_values:
+            results.update((a + b, a - b, b - a, a * b))
+            if b != 0:
+                results.add(a / b)
+            if a != 0:
+                results.add(b / a)
+    return frozenset(results)
+
+
+@lru_cache(maxsize=65536)
+def get_sub_multisets(multiset: tuple) -> tuple:
+    """
+    The distinct ways to split a multiset into two non-empty parts. Each split is listed once:
+    the first part always contains the first number of the multiset.
+    """
+    splits = set()
+    rest = multiset[1:]
+    for size in range(len(rest)):
+        for indices in combinations(range(len(rest)), size):
+            part = (multiset[0],) + tuple(rest[i] for i in indices)
+            other_part = tuple(rest[i] for i in range(len(rest)) if i not in indices)
+            splits.add((part, other_part))
+    return tuple(splits)
+
+
+@lru_cache(maxsize=65536)
+def get_values(multiset: tuple) -> frozenset:
+    """
+    Every value that can be made by combining *all* the numbers of a (sorted) multiset, computed
+    from the values of its sub-multisets
+    """
+    if len(multiset) == 1:
+        return frozenset(multiset)
+    values = set()
+    for part, other_part in get_sub_multisets(multiset):
+        values.update(combine_values(get_values(part), get_values(other_part)))
+    return frozenset(values)
+
+
+def can_combine_to(value: Fraction, other_values: frozenset, target: Fraction) -> bool:
+    """Whether `value` can be combined with one of `other_values` to make the target exactly"""
+    if value == 0:
+        # 0+b, 0-b and b-0 need b=±target, 0*b and 0/b make 0, b/0 is undefined
+        return target in other_values or -target in other_values or target == 0
+    return (
+        target - value in other_values
+        or value - target in other_values
+        or target + value in other_values
+        or target / value in other_values
+        or target * value in other_values
+        or (target != 0 and value / target in other_values)
+    )
+
+
+def makes_target(multiset: tuple, target: Fraction) -> bool:
+    """
+    Whether combining all the numbers of a (sorted) multiset can make the target.
+
+    For whole numbers this checks, for each split of the multiset, whether a value of one part
+    combines with a value of the other to make the target, without building the values of the
+    whole multiset. Numbers with decimals may have been rounded, so they're compared to the target
+    with a tolerance instead.
+    """
+    if len(multiset) == 1:
+        return is_close(multiset[0], target)
+    if target.denominator != 1 or any(number.denominator != 1 for number in multiset):
+        return any(is_close(value, target) for value in get_values(multiset))
+    for part, other_part in get_sub_multisets(multiset):
+        values, other_values = get_values(part), get_values(other_part)
+        if len(values) > len(other_values):
+            values, other_values = other_values, values
+        if any(can_combine_to(value, other_values, target) for value in values):
+            return True
+    return False
+
+
+def normalize_operation(operation: str) -> str:
+    """
+    Write a single operation the way get_successors does, i.e. without spaces and with the smaller
+    number first for + and * (e.g. "4 * 3 = 12" becomes "3*4=12"). Other operations are returned
+    unchanged.
+    """
+    match = COMMUTATIVE_OPERATION_PATTERN.match(operation)
+    if match is None:
+        return operation
+    a, operator, b, result = match.groups()
+    try:
+        if parse_number(a) > parse_number(b):
+            a, b = b, a
+    except ValueError:
+        return operation
+    return f"{a}{operator}{b}={result}"
+
+
+@lru_cache(maxsize=65536)
+def get_successors(multiset: tuple) -> tuple:
+    """
+    Every distinct operation on two numbers of a (sorted) multiset, with the (sorted) multiset
+    that it results in
+    """
+    successors = []
+    seen = set()
+    for i, j in combinations(range(len(multiset)), 2):
+        rest = multiset[:i] + multiset[i + 1 : j] + multiset[j + 1 :]
+        for a, b in ((multiset[i], multiset[j]), (multiset[j], multiset[i])):
+            for operator in OPERATORS:
+                if operator in "+*" and a > b:
+                    continue  # commutative, so only one order is needed
+                result = apply_operator(a, operator, b)
+                if result is None:
+                    continue
+                operation = f"{to_number(a, 2)}{operator}{to_number(b, 2)}={to_number(result, 2)}"
+                if operation in seen:
+                    continue
+                seen.add(operation)
+                successors.append((operation, tuple(sorted(rest + (result,)))))
+    return tuple(successors)
+
+
+class CountdownStateSpace:
+    """
+    The state space of one problem: the start numbers and the target.
+
+    Args:
+        start_state: the numbers the problem starts with
+        target: the number to make
+        use_all_numbers: whether every number has to be used (as in the game of 24), or the target
+            only has to be made from some of the numbers (as in Countdown)
+
+    Values are compared to the target with the same tolerance as the arithmetic checks, since
+    the numbers in graph states are rounded to 2 decimals.
+    """
+
+    def __init__(self, start_state, target=24, use_all_numbers=True):
+        self.start_state = to_state(to_multiset(start_state))
+        self.target = target
+        self.use_all_numbers = use_all_numbers
+        self._target = to_fraction(target)
+
+    @property
+    def goal_state(self) -> tuple:
+        return (self.target,)
+
+    def __repr__(self):
+        return f"CountdownStateSpace({self.start_state}, target={self.target})"
+
+    def is_goal(self, state) -> bool:
+        """Whether the target has been made in a state"""
+        if self.use_all_numbers and len(state) != 1:
+            return False
+        return any(is_close(number, self._target) for number in to_multiset(state))
+
+    def successors(self, state) -> list[tuple[str, tuple]]:
+        """
+        Every operation on two numbers of a state, with the state that it results in. Operations
+        are written the same way as in code translations, e.g. "12/3=4".
+        """
+        return [
+            (operation, to_state(multiset))
+            for operation, multiset in get_successors(to_multiset(state))
+        ]
+
+    def get_successor(self, state, operation: str) -> Optional[tuple]:
+        """
+        The state that a single operation (e.g. "3*4=12") leads to from a state, or None if it
+        isn't one of the state's legal operations (including operations with a wrong result).
+        """
+        operation = normalize_operation(operation)
+        for successor_operation, successor in self.successors(state):
+            if successor_operation == operation:
+                return successor
+        return None
+
+    def reachable_states(self, state=None) -> set[tuple]:
+        """
+        Every state that can be reached from a state (the start state by default) with any
+        number of operations, including the state itself
+        """
+        frontier = {to_multiset(self.start_state if state is None else state)}
+        reachable = set(frontier)
+        while frontier:
+            next_frontier = set()
+            for multiset in frontier:
+                next_frontier.update(
+                    multiset[:i] + multiset[i + 1 : j] + multiset[j + 1 :] + (result,)
+                    for i, j in combinations(range(len(multiset)), 2)
+                    for result in combine_values(
+                        frozenset((multiset[i],)), frozenset((multiset[j],))
+                    )
+                )
+            frontier = {tuple(sorted(multiset)) for multiset in next_frontier} - reachable
+            reachable |= frontier
+        return {to_state(multiset) for multiset in reachable}
+
+    def distance_to_target(self, state=None) -> Optional[int]:
+        """
+        The fewest operations needed to make the target from a state (the start state by
+        default), or None if the target can't be made from it
+        """
+        multiset = to_multiset(self.start_state if state is None else state)
+        if not self.use_all_numbers:
+            # the smallest sub-multiset that can make the target
+            for size in range(1, len(multiset) + 1):
+                for indices in combinations(range(len(multiset)), size):
+                    sub_multiset = tuple(multiset[i] for i in indices)
+                    if makes_target(sub_multiset, self._target):
+                        return size - 1
+            return None
+        if makes_target(multiset, self._target):
+            return len(multiset) - 1
+        return None
+
+    def is_solvable(self, state=None) -> bool:
+        """Whether the target can be made from a state (the start state by default)"""
+        return self.distance_to_target(state) is not None
+
+    def can_reach(self, state, other_state) -> bool:
+        """
+        Whether `other_state` can be reached from `state`, i.e. whether the numbers of `state`
+        can be split into groups that make each number of `other_state`
+        """
+        multiset = to_multiset(state)
+        other_multiset = to_multiset(other_state)
+        return self._can_make(multiset, other_multiset)
+
+    @staticmethod
+    @lru_cache(maxsize=65536)
+    def _can_make(multiset: tuple, other_multiset: tuple) -> bool:
+        if not other_multiset:
+            return not multiset
+        if len(multiset) < len(other_multiset):
+            return False
+        number, rest = other_multiset[0], other_multiset[1:]
+        for size in range(1, len(multiset) - len(rest) + 1):
+            for indices in combinations(range(len(multiset)), size):
+                part = tuple(multiset[i] for i in indices)
+                if makes_target(part, number):
+                    remaining = tuple(
+                        multiset[i] for i in range(len(multiset)) if i not in indices
+                    )
+                    if CountdownStateSpace._can_make(remaining, rest):
+                        return True
+        return False
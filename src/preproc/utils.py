@@ -13,6 +13,10 @@ import numpy as np
 from pyprojroot import here
 from src.preproc.reasoning_graph import GraphBuilder
 
+# the hint for code that fails with "IndexError: pop from empty list", which usually means that an
+# operation has no "="
+MISSING_EQUALS_HINT = "It is possible that you forgot a '=' sign."
+
 
 class DotDict(dict):
     """
@@ -140,7 +144,11 @@ def preprocess_response(response, for_pretraining):
     return response
 
 
-def run_code(code, for_pretraining=True):
+def run_code(code, for_pretraining=True, graph_builder_cls=GraphBuilder):
+    """
+    Run a code translation and return the graph it builds (or an error message if it fails).
+    `graph_builder_cls` lets the code build graphs with an alternative backend, e.g. CompactGraphBuilder.
+    """
     code = preprocess_response(code, for_pretraining=for_pretraining)
     linecache.cache["<string>"] = (
         len(code),
@@ -148,13 +156,14 @@ def run_code(code, for_pretraining=True):
         code.splitlines(keepends=True),
         "<string>",
     )
+    namespace = {**globals(), "GraphBuilder": graph_builder_cls}
     try:
-        exec(code)
-        return graph
+        exec(code, namespace)
+        return namespace["graph"]
     except Exception:
         traceback_str = "".join(traceback.format_exc())
         if "IndexError: pop from empty list" in traceback_str:
-            return f"Error running code. Python gave the following error message:\n{traceback_str}\nIt is possible that you forgot a '=' sign."
+            return f"Error running code. Python gave the following error message:\n{traceback_str}\n{MISSING_EQUALS_HINT}"
         else:
             return f"Error running code. Python gave the following error message:\n{traceback_str}"
 
@@ -7,12 +7,19 @@ from src.analysis.gini_analysis import (
     get_ngrams,
     compute_gini,
     get_operation_sequence,
+    get_operation_id_sequence,
     get_random_op_sequence,
+    prune_graph,
+    unite_graph_lst,
+    union_many,
 )
-from src.analysis.errors import count_error_types
+from src.analysis.errors import count_error_types, count_errors_by_trial
+from src.preproc.auto_checker import check_graph, check_graphs, get_problem_records
 from src.preproc.reasoning_graph import GraphBuilder
 from src.preproc.utils import run_code
+import networkx as nx
 import pandas as pd
+import pytest
 import numpy as np
 
 
@@ -171,6 +178,49 @@ def test_get_operation_sequence():
     ]
 
 
+def test_operation_log():
+    graph = GraphBuilder((1, 2, 3, 4))
+    new_state = graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), False)
+    graph.move_to_node(new_state)
+    graph.explore_operation((3, 3, 4), "3*4=12", (3, 12), False)
+    graph.move_to_node((1, 2, 3, 4))
+    # the subgoal overwrites the edge's operation and timesteps, but the log keeps the earlier step
+    graph.set_subgoal((3, 3, 4), state_after_subgoal=(1, 2, 3, 4))
+    assert get_operation_sequence(graph) == ["1+2=3", "3*4=12", "subgoal: (3, 3, 4)"]
+    assert graph.operation_log.get_visitation_sequence() == [
+        (1, 2, 3, 4),
+        (3, 3, 4),
+        (3, 12),
+        (1, 2, 3, 4),
+    ]
+    assert graph.operation_log.get_operation_ngrams(2, include_subgoals=False) == [
+        ("1+2=3", "3*4=12")
+    ]
+
+    # copies log separately
+    graph_copy = graph.copy()
+    graph_copy.explore_operation((3, 12), "12+3=15", (15,), False)
+    assert len(get_operation_sequence(graph_copy)) == 4
+    assert len(get_operation_sequence(graph)) == 3
+
+
+def test_get_operation_id_sequence():
+    graph = GraphBuilder((1, 2, 3, 4))
+    graph.explore_operation((1, 2, 3, 4), "2+1=3", (3, 3, 4), False)
+    graph.explore_operation((1, 2, 3, 4), "4*3=12", (1, 2, 12), False)
+    graph.set_subgoal((4, 6), state_after_subgoal=(24,))
+    other_graph = GraphBuilder((1, 2, 3, 4))
+    other_graph.explore_operation((1, 2, 3, 4), "(1 + 2) = 3.0", (3, 3, 4), False)
+    other_graph.explore_operation((1, 2, 3, 4), "3*4=12", (1, 2, 12), False)
+
+    ids = get_operation_id_sequence(graph, include_subgoals=False)
+    assert ids == get_operation_id_sequence(other_graph)
+    assert len(set(ids)) == 2
+    assert len(get_operation_id_sequence(graph)) == 3
+    # graphs without an operation log read the operations from their edges
+    assert get_operation_id_sequence(union_many([graph])) == get_operation_id_sequence(graph)
+
+
 def test_compute_gini():
     # The gini index should be low if all n-grams are distinct (though not exactly 0 for smal)
     assert np.isclose(compute_gini([(1, 2), (3, 4), (5, 6), (7, 8)]), 0.25)
@@ -221,6 +271,58 @@ def test_get_random_op_sequence():
     assert isinstance(graph, GraphBuilder)
 
 
+def test_prune_graph():
+    graphs = []
+    for operation, resulting_state in [("1+2=3", (3, 3, 4)), ("3*4=12", (1, 2, 12))]:
+        graph = GraphBuilder((1, 2, 3, 4))
+        graph.set_subgoal((6, 4), state_after_subgoal=(24,))
+        graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), False)
+        graph.explore_operation((1, 2, 3, 4), operation, resulting_state, False)
+        graphs.append(graph)
+
+    aggregated_graph = unite_graph_lst(graphs, (1, 2, 3, 4))
+    # uniting the graphs doesn't modify them
+    assert graphs[0].G.edges[((1, 2, 3, 4), (3, 3, 4))]["op_timesteps"] == [2, 3]
+
+    pruned_graph = prune_graph(aggregated_graph, threshold=2)
+    assert list(pruned_graph.G.edges) == [((1, 2, 3, 4), (3, 3, 4))]
+    assert aggregated_graph.G.number_of_edges() == 3
+
+    pruned_graph = prune_graph(aggregated_graph, threshold=0, remove_subgoals=False)
+    assert pruned_graph.G.number_of_edges() == 3
+
+
+def test_union_many():
+    graphs = []
+    for operation, resulting_state in [("1+2=3", (3, 3, 4)), ("3*4=12", (1, 2, 12))] * 3:
+        graph = GraphBuilder((1, 2, 3, 4))
+        graph.explore_operation((1, 2, 3, 4), operation, resulting_state, False)
+        graphs.append(graph)
+
+    folded_graph = GraphBuilder((1, 2, 3, 4))
+    for graph in graphs:
+        folded_graph.unite_graphs(graph)
+
+    united_graph = union_many(graphs)
+    assert nx.utils.graphs_equal(united_graph.G, folded_graph.G)
+    assert united_graph.actions == folded_graph.actions
+
+    parallel_graph = union_many(graphs, n_jobs=2)
+    assert nx.utils.graphs_equal(parallel_graph.G, folded_graph.G)
+
+    counts_graph = union_many(graphs, counts_only=True)
+    assert counts_graph.G.nodes[(3, 3, 4)]["visit_count"] == 3
+    assert counts_graph.G.edges[((1, 2, 3, 4), (1, 2, 12))]["op_count"] == 3
+    assert "comment" not in counts_graph.G.edges[((1, 2, 3, 4), (1, 2, 12))]
+    assert prune_graph(counts_graph, threshold=3).G.number_of_edges() == 2
+
+    with pytest.raises(ValueError):
+        union_many(graphs + [GraphBuilder((1, 1, 2, 3))])
+    with pytest.raises(ValueError, match="empty"):
+        union_many([])
+    assert union_many([], start_state=(4, 3, 2, 1)).G.number_of_nodes() == 2
+
+
 def test_count_error_types():
     errors = [
         {
@@ -253,3 +355,22 @@ def test_count_error_types():
 
     errors = None
     assert count_error_types(errors) == {}
+
+    # problem records
+    graph = GraphBuilder((1, 2, 3, 4))
+    graph.explore_operation((1, 2, 3, 4), "2*4=9", (1, 3, 9))
+    graph.explore_operation((1, 2, 3, 4), "9+1=10", (2, 3, 4, 10))
+    records = get_problem_records(graph)
+    assert count_error_types(records) == {
+        "state_calculation_errors": 1,
+        "runnability_errors": 1,
+        "total_errors": 2,
+    }
+    assert count_error_types(check_graph(graph)) == count_error_types(records)
+
+    df_counts = count_errors_by_trial(check_graphs([graph, "error", GraphBuilder((1, 2))]), 3)
+    assert df_counts.to_dict("list") == {
+        "runnability_errors": [1, 0, 0],
+        "state_calculation_errors": [1, 0, 0],
+        "total_errors": [2, 0, 0],
+    }
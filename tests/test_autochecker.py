@@ -6,9 +6,21 @@ import pandas as pd
 from pyprojroot import here
 
 from src.preproc.utils import run_code
-from src.preproc.auto_checker import check_graph, get_problems_str
+from src.preproc.code_compiler import run_compiled_code
+from src.preproc.auto_checker import (
+    ProblemType,
+    StreamingChecker,
+    check_code,
+    check_graph,
+    check_graphs,
+    get_problem_records,
+    get_problems_str,
+)
+from src.preproc.auto_repair import repair_code
 from src.preproc.reasoning_graph import GraphBuilder
 from src.preproc.code_checking_tools import (
+    OperandStateIndex,
+    get_runnability,
     parse_number,
     is_op_well_formatted,
     check_if_all_elements_in_state,
@@ -149,3 +161,146 @@ def test_can_set_subgoal():
     assert not can_set_subgoal(1, (24,))[0]
     assert not can_set_subgoal("a string", (23, 2))[0]
     assert not can_set_subgoal((23, 2), "a string")[0]
+
+
+def test_streaming_checker():
+    code = """start_state = (1, 2, 3, 4)
+curr_state = start_state
+graph = GraphBuilder(curr_state)
+new_state = graph.explore_operation(curr_state, operation="1+2=3", resulting_state=(3, 3, 4))
+new_state = graph.explore_operation(curr_state, operation="3*4=12", resulting_state=(1, 2, 12))
+new_state = graph.explore_operation(curr_state, operation="2*4=9", resulting_state=(1, 3, 9))
+curr_state = graph.move_to_node(new_state)
+new_state = graph.explore_operation(curr_state, operation="9+9=18", resulting_state=(1, 3, 18))
+"""
+    graph = run_code(code)
+    problems = check_graph(graph)
+    assert len(problems) == 2
+
+    # checked while the code runs
+    checked_graph, streamed_problems = check_code(code)
+    assert streamed_problems == problems
+    assert checked_graph.action_hooks == []
+
+    # or stopped at the first problem
+    checked_graph, streamed_problems = check_code(code, stop_at_first_problem=True)
+    assert streamed_problems == problems[:1]
+    assert len(checked_graph.actions) == 4
+    assert check_graph(graph, stop_at_first_problem=True) == problems[:1]
+
+    assert check_code("graph = None + 1")[1][0].startswith("Error running code")
+
+    # hooks are called with each new action, but not by copies
+    checker = StreamingChecker()
+    graph = checker.attach(GraphBuilder((1, 2, 3, 4)))
+    graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 4, 4))
+    graph.copy().explore_operation((1, 2, 3, 4), "1+2=3", (3, 4, 4))
+    assert len(checker.problems) == 1
+
+
+def test_problem_records():
+    code = """start_state = (1, 2, 3, 4)
+curr_state = start_state
+graph = GraphBuilder(curr_state)
+new_state = graph.explore_operation(curr_state, operation="2*4=9", resulting_state=(1, 3, 9))
+curr_state = graph.move_to_node(new_state)
+new_state = graph.explore_operation(curr_state, operation="9+9=18", resulting_state=(1, 3, 18))
+"""
+    graph = run_code(code)
+    records = get_problem_records(graph)
+    assert [(record.type, record.action_index) for record in records] == [
+        (ProblemType.RESULTING_STATE, 1),
+        (ProblemType.RUNNABILITY, 3),
+    ]
+    assert records[0].operands == (1, 3, 9)
+    assert records[0].suggested_fix == (1, 3, 8)
+    assert records[1].operands == (9,)
+    # the records are only written out as text when they're shown to a model
+    assert [problem["Problems"] for problem in check_graph(graph)] == [
+        [str(records[0])],
+        [str(records[1])],
+    ]
+    assert str(records[0]).startswith("PROBLEM TYPE: Resulting state calculation error.")
+    assert get_problems_str(records) == get_problems_str(check_graph(graph))
+
+    df = check_graphs([graph, "Error running code", run_code(code)], trial_ids=["a", "b", "c"])
+    assert df["trial_id"].tolist() == ["a", "a", "c", "c"]
+    assert df["action_index"].tolist() == [1, 3, 1, 3]
+    assert df["problem_type"].tolist() == ["RESULTING_STATE", "RUNNABILITY"] * 2
+    assert len(check_graphs([])) == 0
+
+
+def test_state_index():
+    state_index = OperandStateIndex([(1, 2, 3, 4), (4, 3, 3), (3, 4, 4), 5, (3, "a")])
+    state_index.add((3, 3, 4))
+    assert len(state_index) == 3
+    assert (3, 3, 4) in state_index
+    assert state_index.find_states([3]) == [(1, 2, 3, 4), (3, 3, 4), (3, 4, 4)]
+    assert state_index.find_states([3, 3]) == [(3, 3, 4)]
+    assert state_index.find_states([4, 3, 4]) == [(3, 4, 4)]
+    assert state_index.find_states([5]) == []
+
+    # operations that can't be run from the start or new state are run from other existing states
+    can_run, missing_elements, state_to_move_to, message = get_runnability(
+        (1, 12), "3*3=9", (1, 2, 3, 4), (1, 12), state_index
+    )
+    assert not can_run and missing_elements == (3, 3)
+    assert state_to_move_to == (3, 3, 4)
+    assert "the existing state (3, 3, 4)" in message
+    assert get_runnability((1, 12), "3*3=9", (1, 2, 3, 4), (1, 12))[2] is None
+
+    graph = GraphBuilder((1, 2, 3, 4))
+    graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4))
+    graph.explore_operation((1, 2, 3, 4), "3*4=12", (1, 2, 12))
+    graph.explore_operation((1, 2, 12), "3*3=9", (4, 9))
+    (problem,) = get_problem_records(graph)
+    assert problem.suggested_fix == (3, 3, 4)
+    assert "move_to_node" in str(problem)
+
+    # subgoals are never visited, so they can't be moved to
+    graph = GraphBuilder((1, 2, 3, 4))
+    graph.set_subgoal((6, 4), (24,))
+    graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4))
+    graph.explore_operation((3, 3, 4), "6*4=24", (3, 24))
+    graph.explore_operation((3, 3, 4), "3+3=6", (4, 6))
+    graph.explore_operation((1, 2, 3, 4), "1*2=2", (2, 3, 4))
+    graph.explore_operation((2, 3, 4), "6*4=24", (2, 3, 24))
+    assert [problem.suggested_fix for problem in get_problem_records(graph)] == [None, (4, 6)]
+
+
+def test_repair_code():
+    code = """```python
+start_state = (1, 2, 3, 4)
+curr_state = start_state
+graph = GraphBuilder(curr_state)
+# "one plus two" × 2
+new_state = graph.explore_operation(curr_state, operation="1+2=3", resulting_state=(1, 3, 3, 4))
+curr_state = graph.move_to_node(new_state)
+new_state = graph.explore_operation(curr_state, operation="3+3=7", resulting_state=(4, 7))
+new_state = graph.explore_operation(curr_state, operation="2*4=8", resulting_state=(1, 3, 8))
+```"""
+    repaired_code, repairs, problems = repair_code(code)
+    assert [str(repair) for repair in repairs] == [
+        "resulting_state of action 1: (1, 3, 3, 4) -> (3, 3, 4)",
+        "move_to_node of action 4: (3, 3, 4) -> (1, 2, 3, 4)",
+    ]
+    # the edits are made in place, and the rest of the code is left as it was
+    assert '# "one plus two" × 2' in repaired_code
+    assert 'operation="1+2=3", resulting_state=(3, 3, 4))' in repaired_code
+    assert "curr_state = graph.move_to_node((1, 2, 3, 4))\nnew_state" in repaired_code
+    # calculation errors aren't repaired
+    assert len(problems) == 1 and "3+3=7" in problems[0]["Action"]
+    assert check_code(repaired_code)[1] == problems
+
+    # code without repairs is returned as it was
+    assert repair_code(repaired_code) == (repaired_code, [], problems)
+    assert repair_code("graph = None + 1")[1:] == ([], [run_compiled_code("graph = None + 1")])
+
+    # repairs that give the actions after them new problems aren't applied (moving to the start
+    # state for 2*4=8 would change curr_state for 3*3=9, which then couldn't be run)
+    code = code.replace("```python", "").replace("```", "") + (
+        '\nnew_state = graph.explore_operation(curr_state, operation="3*3=9", resulting_state=(4, 9))'
+    )
+    repaired_code, repairs, problems = repair_code(code)
+    assert [repair.kind for repair in repairs] == ["resulting_state"]
+    assert len(problems) == 2
@@ -1,6 +1,26 @@
-from src.preproc.reasoning_graph_utils import get_sub_operations
+import os
+from fractions import Fraction
+import pytest
+from src.preproc.reasoning_graph_utils import get_sub_operations, tokenize
+from src.preproc.arithmetic import evaluate, operation_is_correct, to_number
 from src.preproc.reasoning_graph import GraphBuilder
+from src.preproc.compact_graph import CompactGraphBuilder
+from src.preproc.graph_store import GraphStore
+from src.preproc.operation_ids import canonical_operation, operation_id
+from src.preproc.event_table import build_event_table, read_event_table, write_event_table
+from src.preproc.code_compiler import UnsupportedCode, compile_code, run_compiled_code
+from src.preproc.code_runner import CodeRunner, is_stopped_error
+from src.preproc.code_salvage import run_partial, splice_tail
+from src.preproc.response_cache import ResponseCache, get_response_cache
+from src.preproc.utils import run_code
+from src.preproc.graph_rendering import LayoutCache, render_many, structural_hash
+from src.preproc.search_metrics import compute_search_metrics, compute_solvability_metrics
+from src.preproc.state_oracle import StateOracle, build_state_oracle
+from src.preproc.state_space import CountdownStateSpace
+from src.preproc.auto_checker import check_graph
+from src.preproc.graph_metrics import check_metric_counts, get_growth_curves
 import networkx as nx
+import pandas as pd
 
 
 def test_get_sub_operations():
@@ -21,6 +41,44 @@ def test_get_sub_operations():
     assert get_sub_operations("3-(-3)") == [[3, "-", -3, 6]]
 
 
+def test_tokenize():
+    assert tokenize("(9-4)*3 + 9") == ["(", "9", "-", "4", ")", "*", "3", "+", "9"]
+    # a sign is unary at the start and right after an operator or "(", but not after a space
+    assert tokenize("-3*-4") == ["-3", "*", "-4"]
+    assert tokenize("10 - -2") == ["10", "-", "-", "2"]
+    assert tokenize("(+1.5)") == ["(", "+1.5", ")"]
+    assert tokenize("3²") == ["3²"]
+    with pytest.raises(ValueError, match="Invalid character 'x'"):
+        tokenize("3 x 4")
+
+    # parsed operations are cached, so the lists that callers get back must be their own
+    tokenize("1+2").append("+")
+    get_sub_operations("1+2")[0][3] = 4
+    assert tokenize("1+2") == ["1", "+", "2"]
+    assert get_sub_operations("1+2") == [[1, "+", 2, 3]]
+
+
+def test_arithmetic():
+    assert evaluate("(9-4)*3+9") == 24
+    assert evaluate("-1*(2+3)*4") == -20
+    assert evaluate("3-(-3)") == 6
+    assert evaluate("13/7") == Fraction(13, 7)
+    assert evaluate("0.1+0.2") == Fraction(3, 10)
+    assert to_number(evaluate("12/8")) == 1.5
+    assert to_number(evaluate("13/3"), ndigits=2) == 4.33
+    assert to_number(evaluate("4/2"), ndigits=2) == 2
+
+    assert operation_is_correct("13/7=1.86")
+    assert not operation_is_correct("9*9=80")
+    assert not operation_is_correct("9*9=81", result_calc_error=True)
+
+    for expression in ["1+", "(1+2", "1+twelve", "3 4"]:
+        with pytest.raises(ValueError):
+            evaluate(expression)
+    with pytest.raises(ZeroDivisionError):
+        evaluate("4/(2-2)")
+
+
 def test_graph_builder():
     graph = GraphBuilder((1, 2, 3, 4))
     graph.set_subgoal((6, 4), state_after_subgoal=(24,))
@@ -34,3 +92,532 @@ def test_graph_builder():
     assert nx.has_path(graph.G, (1, 2, 3, 4), (24,))
     assert nx.has_path(graph.G, (1, 2, 3, 4), (4, 6))
     assert nx.has_path(graph.G, (24,), (4, 6))
+
+
+def test_compact_graph_builder():
+    graphs = [GraphBuilder((1, 2, 3, 4)), CompactGraphBuilder((1, 2, 3, 4))]
+    for graph in graphs:
+        graph.set_subgoal((6, 4), state_after_subgoal=(24,), comment="4 times 6")
+        graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), False)
+        graph.move_to_node((3, 3, 4))
+        graph.explore_operation((3, 3, 4), "3*4=12", (3, 12), False, comment="3 x 4")
+        graph.explore_operation((3, 12), "3+12=16", (15,), True)
+        graph.move_to_node((1, 2, 3, 4))
+        graph.explore_operation((1, 2, 3, 4), "1*2*3*4=24", (24,), False)
+        graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), False)
+
+    graph, compact_graph = graphs
+    assert nx.utils.graphs_equal(graph.G, compact_graph.G)
+    assert graph.actions == compact_graph.actions
+    assert nx.utils.graphs_equal(compact_graph.to_graph_builder().G, graph.G)
+
+    # copies don't carry the cached networkx graph
+    compact_graph_copy = compact_graph.copy()
+    assert compact_graph_copy._G is None
+    assert nx.utils.graphs_equal(compact_graph_copy.G, graph.G)
+
+
+def test_copy_on_write():
+    graph = GraphBuilder((1, 2, 3, 4))
+    graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), False)
+
+    graph_copy = graph.copy()
+    # shared until someone writes: the copy gets a read-only view, and the graph stays writable
+    assert graph_copy.G._graph is graph.G
+    assert nx.is_frozen(graph_copy.G) and not nx.is_frozen(graph.G)
+
+    graph_copy.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), False)
+    graph_copy.explore_operation((1, 2, 3, 4), "3*4=12", (1, 2, 12), False)
+    assert graph_copy.G is not graph.G
+    assert graph.G.number_of_nodes() == 3
+    assert graph.G.nodes[(3, 3, 4)]["visitation_timesteps"] == [1]
+    assert graph_copy.G.number_of_nodes() == 4
+    assert graph_copy.G.nodes[(3, 3, 4)]["visitation_timesteps"] == [1, 2]
+    assert len(graph.actions) == 2 and len(graph_copy.actions) == 4
+
+    # the original can still be written to after being copied
+    graph.move_to_node((3, 3, 4))
+    assert graph.G.nodes[(3, 3, 4)]["visitation_timesteps"] == [1]
+    assert graph_copy.G.nodes[(3, 3, 4)]["visitation_timesteps"] == [1, 2]
+
+
+def test_graph_view():
+    graph = GraphBuilder((1, 2, 3, 4))
+    graph.set_subgoal((6, 4), state_after_subgoal=(24,))
+    graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), False)
+    graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), False)
+    graph.explore_operation((1, 2, 3, 4), "3*4=12", (1, 2, 12), False)
+
+    graph_view = graph.view(remove_subgoals=True)
+    assert not graph_view.G.has_edge((24,), (4, 6))
+    assert graph_view.G.number_of_nodes() == 5
+
+    graph_view = graph.view(remove_subgoals=True, min_visits=1, drop_isolates=True)
+    assert set(graph_view.G.nodes) == {(1, 2, 3, 4), (3, 3, 4), (1, 2, 12)}
+
+    # writes to the graph don't show through the view, and vice versa
+    assert not nx.is_frozen(graph.G)
+    graph.explore_operation((1, 2, 3, 4), "4-3=1", (1, 1, 2), False)
+    assert graph_view.G.number_of_nodes() == 3
+    graph_view.explore_operation((1, 2, 3, 4), "4-1=3", (2, 3, 3), False)
+    assert graph_view.G.number_of_nodes() == 4
+    assert not graph.G.has_node((2, 3, 3))
+
+
+def test_serialization(tmp_path):
+    graph = GraphBuilder((1, 2, 3, 4))
+    graph.set_subgoal((6, 4), state_after_subgoal=(24,), comment="make 6 and 4")
+    graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), "one plus two")
+    graph.explore_operation((1, 2, 3, 4), "3/4=0.75", (0.75, 1, 2), "three over four")
+
+    loaded_graph = GraphBuilder.from_bytes(graph.to_bytes())
+    assert nx.utils.graphs_equal(loaded_graph.G, graph.G)
+    assert loaded_graph.actions == graph.actions
+    assert loaded_graph.op_timestep == graph.op_timestep
+    assert loaded_graph.start_state == graph.start_state
+
+    with pytest.raises(ValueError):
+        GraphBuilder.from_bytes(b"not a graph")
+
+    graph_store = GraphStore(tmp_path, for_pretraining=False)
+    code = "curr_state = (1, 2, 3, 4)\ngraph = GraphBuilder(curr_state)\ncurr_state = graph.explore_operation(curr_state, '1+2=3', (3, 3, 4), 'one plus two')"
+    assert code not in graph_store
+    graph = graph_store.run_code(code)
+    assert code in graph_store
+    assert nx.utils.graphs_equal(graph_store.run_code(code).G, graph.G)
+
+    graph_store.put("broken code", "Error running code.")
+    assert graph_store.get("broken code") == "Error running code."
+    assert graph_store.get("unseen code") is None
+
+
+def test_graph_store_problems(tmp_path, monkeypatch):
+    from src.preproc import graph_store as graph_store_module
+    from src.preproc.auto_checker import check_code
+
+    graph_store = GraphStore(tmp_path)
+    code = "curr_state = (1, 2, 3, 4)\ngraph = GraphBuilder(curr_state)\nnew_state = graph.explore_operation(curr_state, '1+2=3', (3, 4), 'one plus two')\nnew_state = graph.explore_operation(curr_state, '5*4=20', (3, 20), 'five times four')"
+    graph, problems = graph_store.check_code(code)
+    assert problems == check_code(code)[1] and len(problems) == 2
+    [(loaded_graph, records)] = graph_store.check_many([code])
+    assert [record.action_index for record in records] == [1, 2]
+    assert records[0].action is loaded_graph.actions[1]
+    assert graph_store.check_code(code)[1] == problems
+    assert graph_store.check_code("broken code")[1] == [graph_store.run_code("broken code")]
+
+    # a new version of the checker re-checks the stored graphs, and a new version of the
+    # GraphBuilder runs the code again
+    monkeypatch.setattr(graph_store_module, "CHECK_VERSION", "new checker")
+    assert code in graph_store and graph_store.get_records(code, graph) is None
+    assert graph_store.check_code(code)[1] == problems
+    monkeypatch.setattr(graph_store_module, "BUILD_VERSION", "new graph builder")
+    assert code not in graph_store
+    assert graph_store.prune() == 3  # the two old graphs, and the problems of the old checker
+    assert graph_store.check_code(code)[1] == problems
+
+
+def test_event_table(tmp_path):
+    graph = GraphBuilder((1, 2, 3, 4))
+    graph.set_subgoal((6, 4), state_after_subgoal=(24,))
+    new_state = graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), False)
+    graph.move_to_node(new_state)
+    graph.explore_operation((3, 3, 4), "3*4=11", (3, 11), True)
+
+    table = build_event_table([graph, "Error running code.", graph], trial_ids=[5, 6, 7])
+    write_event_table(table, tmp_path / "events.parquet")
+    events, states = read_event_table(tmp_path / "events.parquet")
+
+    assert list(events.groupby("trial_id").size().items()) == [(5, 5), (7, 5)]
+    assert list(events["action_type"].iloc[:5]) == [
+        "start",
+        "set_subgoal",
+        "explore_operation",
+        "move_to_node",
+        "explore_operation",
+    ]
+    assert events["is_subgoal"].sum() == 2
+    assert events["result_calc_error"].sum() == 2
+    assert states[events["resulting_state_id"].iloc[1]] == (4, 6)
+    assert states[events["curr_state_id"].iloc[4]] == (3, 3, 4)
+    assert pd.isna(events["curr_state_id"].iloc[0])
+    assert events["operation_id"].iloc[2] == operation_id("2+1=3")
+    assert pd.isna(events["operation_id"].iloc[1])
+
+
+def test_operation_ids():
+    assert canonical_operation("(4 * 3) = 12.0") == "3*4=12"
+    assert canonical_operation("(4-2)*3+9=15") == "9+(3*(4-2))=15"
+    assert canonical_operation("5*-3=-15") == "-3*5=-15"
+    # only commutativity is normalized, not associativity
+    assert canonical_operation("2+3+4=9") != canonical_operation("2+(3+4)=9")
+    assert canonical_operation("12/3=4") != canonical_operation("3/12=4")
+    # text that isn't arithmetic is kept, without whitespace
+    assert canonical_operation("subgoal: (4, 6)") == "subgoal:(4,6)"
+    assert operation_id("4*3=12") == operation_id("3*4=12") != operation_id("3*4=13")
+    assert 0 <= operation_id("4*3=12") < 2**63
+
+
+def test_code_compiler():
+    code = """```python
+start_state = (1, 2, 3, 4)
+curr_state = start_state
+graph = GraphBuilder(curr_state)
+
+graph.set_subgoal((6, 4), comment="make 6 and 4")
+new_state = graph.explore_operation(
+    curr_state,
+    operation="1+2=3",
+    resulting_state=(3, 3, 4),
+    comment='"one plus two is three"',
+)
+curr_state = graph.move_to_node(new_state)
+new_state = graph.explore_operation(curr_state, "3*4=11", (3, 11), True)
+```"""
+    graph = run_code(code)
+    compiled_graph = compile_code(code).run()
+    assert nx.utils.graphs_equal(compiled_graph.G, graph.G)
+    assert compiled_graph.actions == graph.actions
+
+    # code outside the GraphBuilder subset isn't compiled
+    unsafe_code = code + "\nimport os"
+    with pytest.raises(UnsupportedCode):
+        compile_code(unsafe_code)
+    assert "Unsupported statement: Import (line 15)" in run_compiled_code(unsafe_code)
+    # parity checks can opt into exec'ing it with run_code
+    assert nx.utils.graphs_equal(run_compiled_code(unsafe_code, fallback=True).G, graph.G)
+
+    # failing code reports the failing statement, or falls back to run_code's error message
+    failing_code = code + "\ngraph.move_to_node((5, 5))"
+    assert run_compiled_code(failing_code) == (
+        "Error running code. The code failed on line 15: graph.move_to_node((5, 5))\n"
+        "KeyError: (5, 5)"
+    )
+    assert run_compiled_code(failing_code, fallback=True) == run_code(failing_code)
+
+    # operations without "=" get the same hint as from run_code
+    failing_code = code + "\ngraph.explore_operation(curr_state, '1+2', (3, 3, 4))"
+    assert run_code(failing_code).endswith("\n\nIt is possible that you forgot a '=' sign.")
+    assert run_compiled_code(failing_code).endswith("\n\nIt is possible that you forgot a '=' sign.")
+
+
+def test_code_runner(tmp_path):
+    code = "curr_state = (1, 2, 3, 4)\ngraph = GraphBuilder(curr_state)\ncurr_state = graph.explore_operation(curr_state, '1+2=3', (3, 3, 4))"
+    failing_code = code + "\ngraph.move_to_node((5, 5))"
+    hanging_code = code + "\ngraph.explore_operation(curr_state, '1+' * 10000000 + '1=10000001', (10000001,))"
+    memory_code = code + "\nnumbers = [0] * 10000000000"
+    # code that could crash the worker isn't run at all
+    crashing_code = code + "\nimport os\nos._exit(1)"
+
+    with CodeRunner(workers=2, timeout=2, max_mem=2**28) as runner:
+        results = runner.run_many(
+            [code, failing_code, hanging_code, memory_code, crashing_code, code]
+        )
+        # each failure only fails its own code, and the workers keep running code after it
+        assert nx.utils.graphs_equal(results[0].G, run_code(code).G)
+        assert results[0].actions == results[5].actions == run_code(code).actions
+        assert results[1] == run_compiled_code(failing_code)
+        assert is_stopped_error(results[2]) and "didn't finish" in results[2]
+        assert "MemoryError" in results[3] and not is_stopped_error(results[3])
+        assert "UnsupportedCode" in results[4] and not is_stopped_error(results[4])
+        assert len(runner.run_many([code] * 3)) == 3
+
+    # code that times out isn't stored, since it might not next time
+    graph_store = GraphStore(tmp_path)
+    results = graph_store.run_many([code, hanging_code], workers=1, timeout=2)
+    assert code in graph_store and hanging_code not in graph_store
+    assert nx.utils.graphs_equal(graph_store.run_many([code], timeout=2)[0].G, results[0].G)
+
+
+def test_run_partial():
+    code = "curr_state = (1, 2, 3, 4)\ngraph = GraphBuilder(curr_state)\n# one plus two\nnew_state = graph.explore_operation(curr_state, '1+2=3', (3, 3, 4))\n"
+    failing_statement = "new_state = graph.explore_operation(\n    curr_state, '3*3=9=12', (4, 9)\n)"
+    partial_run = run_partial(
+        f"```python\n{code}# three times three\n{failing_statement}\ncurr_state = graph.move_to_node(new_state)\n```"
+    )
+    assert partial_run.prefix == code
+    assert partial_run.error == "ValueError: Invalid character '=' in expression"
+    assert partial_run.lineno == 6 and partial_run.statement == failing_statement
+    assert partial_run.graph.actions == run_code(code).actions
+
+    # code with a syntax error keeps the statements before it
+    partial_run = run_partial(
+        code + "new_state = graph.explore_operation(curr_state, '3*4=12, (1, 2, 12))\n"
+    )
+    assert partial_run.prefix == code and partial_run.lineno == 5
+    assert partial_run.error.endswith("SyntaxError: unterminated string literal (detected at line 5)")
+    assert partial_run.graph.actions == run_code(code).actions
+
+    # a failure before the graph is built leaves nothing to continue from
+    partial_run = run_partial("curr_state = (1, 2, 3, 4)\ngraph = GraphBuilder(curr_stat)")
+    assert "NameError" in partial_run.error and not partial_run.has_graph
+    assert run_partial(code).error is None
+
+    tail = "new_state = graph.explore_operation(curr_state, '3*3=9', (4, 9))"
+    assert splice_tail(code, f"```python\n{tail}\n```") == code + tail
+    assert splice_tail(code, f"{code}\n{tail}") == code + tail
+    assert not isinstance(run_code(splice_tail(code, tail)), str)
+
+
+def test_async_coding(tmp_path):
+    import asyncio
+    import time
+    from src.preproc.async_coding import TokenBucket
+    from src.preproc.code_with_lm import code_rows_concurrently
+    from src.preproc.fake_llm_server import FakeLLMServer
+
+    async def acquire_many(bucket, n):
+        for _ in range(n):
+            await bucket.acquire()
+
+    # a bucket of 2 requests, refilled at 10 per second
+    start_time = time.monotonic()
+    asyncio.run(acquire_many(TokenBucket(600, capacity=2), 4))
+    assert 0.15 < time.monotonic() - start_time < 1
+
+    df_trials = pd.DataFrame(
+        {
+            "choices": ["[1,2,3,4]", "[2,3,5,8]", "[1,1,6,6]", "[4,4,10,10]"],
+            "response": "",
+            "rt_s": 60.0,
+            "transcript": "one plus two is three",
+        }
+    )
+    args = {
+        "model_name": "gpt-4o",
+        "response_cache_path": str(tmp_path / "responses.sqlite"),
+        "max_concurrency": 2,
+        "tail_retry": True,
+    }
+    with FakeLLMServer(latency=0.1, bad_translation_rate=0.5, seed=1) as server:
+        translations, autochecker_log_dfs, _ = asyncio.run(
+            code_rows_concurrently(df_trials, args, base_url=server.url, api_key="fake")
+        )
+    assert server.stats["max_in_flight"] == 2
+    # the translations that failed were fixed by regenerating their tails
+    assert autochecker_log_dfs and all(
+        (df_log["retry_mode"].iloc[1:] == "tail").all() for df_log in autochecker_log_dfs
+    )
+    for choices, translation in zip(df_trials["choices"], translations):
+        graph = run_code(translation)
+        assert graph.start_state == tuple(sorted(eval(choices)))
+        assert len(graph.actions) == 2
+
+    # a rerun (in a new process) gets every response from the cache
+    get_response_cache.cache_clear()
+    with FakeLLMServer(latency=0.1, bad_translation_rate=0.5, seed=1) as server:
+        rerun_translations, _, _ = asyncio.run(
+            code_rows_concurrently(df_trials, args, base_url=server.url, api_key="fake")
+        )
+    assert server.stats["requests"] == 0 and rerun_translations == translations
+
+    # a row that fails is left without a translation, and the other rows are still coded
+    get_response_cache.cache_clear()
+    df_failing = pd.concat([df_trials.iloc[:1], df_trials.iloc[:1].assign(choices="[1,2")])
+    failing_translations, _, _ = asyncio.run(code_rows_concurrently(df_failing, args))
+    assert failing_translations == [translations[0], None]
+
+
+def test_retry_steps():
+    from src.preproc.auto_checker import check_code
+    from src.preproc.code_with_lm import retry_steps
+
+    code = """start_state = (1, 2, 3, 4)
+curr_state = start_state
+graph = GraphBuilder(curr_state)
+new_state = graph.explore_operation(curr_state, operation="1+2=3", resulting_state=(3, 4, 4))
+curr_state = graph.move_to_node(new_state)
+new_state = graph.explore_operation(curr_state, operation="3*4=12", resulting_state=(3, 13))
+"""
+    # a retry that fixes the first of two problems, then retries that fail to run
+    better_code = code.replace("(3, 4, 4)", "(3, 3, 4)")
+    features = {"start_state": "[1,2,3,4]", "response": "", "rt_s": 60.0, "transcript": ""}
+    args = {"stop_at_first_problem": True, "auto_repair": False, "tail_retry": False}
+    _, problems = check_code(code)
+    steps = retry_steps(features, code, problems, args)
+    request = next(steps)
+    # the model only gets feedback on the first problem
+    code_str, problems_str = request.messages[-1]["content"].split("\nproblems:\n")
+    assert "(3, 4, 4)" in problems_str and "(3, 13)" not in problems_str
+    request = steps.send(better_code)
+    # but the retry is scored on all of them, so it becomes the code to improve on
+    code_str, problems_str = request.messages[-1]["content"].split("\nproblems:\n")
+    assert better_code in code_str and "(3, 13)" in problems_str
+    try:
+        while True:
+            steps.send("graph = None + 1")
+    except StopIteration as stop:
+        best_translation, df_log = stop.value
+    assert best_translation == better_code
+    assert df_log["n_problems"].tolist() == [2, 1, 9999, 9999, 9999, 9999]
+
+
+def test_response_cache(tmp_path):
+    cache = ResponseCache(tmp_path / "responses.sqlite")
+    messages = [{"role": "user", "content": "one plus two is three"}]
+    key = cache.next_key("gpt-4o", "system prompt", messages, temp=0.3)
+    assert cache.get(key) is None
+    cache.put(key, "gpt-4o", "response")
+    # making the same request again gets a new sample
+    assert cache.get(cache.next_key("gpt-4o", "system prompt", messages, temp=0.3)) is None
+    assert cache.get(cache.next_key("gpt-4o", "system prompt", messages, temp=0.2)) is None
+
+    # the same sequence of requests in another process gets the same responses
+    rerun_cache = ResponseCache(tmp_path / "responses.sqlite")
+    assert rerun_cache.get(rerun_cache.next_key("gpt-4o", "system prompt", messages, 0.3)) == "response"
+    assert len(rerun_cache) == 1
+
+
+def test_render_many(tmp_path):
+    graph = GraphBuilder((1, 2, 3, 4))
+    graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), False)
+    graph.explore_operation((1, 2, 3, 4), "3*4=12", (1, 2, 12), False)
+    graphs = [graph, "Error running code.", graph.view(min_visits=1)]
+
+    # seed the layout cache, so rendering doesn't need graphviz
+    layout_cache = LayoutCache(tmp_path / "layouts")
+    for g in [graph, graphs[2]]:
+        layout_cache.put(g.G, structural_hash(g.G), nx.circular_layout(g.G))
+    assert structural_hash(graph.G) != structural_hash(graphs[2].G)
+    assert structural_hash(graph.copy().G) == structural_hash(graph.G)
+
+    filepaths = render_many(graphs, tmp_path / "steps", layout_cache=LayoutCache(tmp_path / "layouts"))
+    assert filepaths[1] is None
+    assert all(os.path.exists(filepath) for filepath in [filepaths[0], filepaths[2]])
+
+    filepaths = render_many(
+        graphs, tmp_path / "minimal", mode="minimal", file_format="svg", layout_cache=layout_cache, n_jobs=2
+    )
+    assert filepaths[0].endswith("0.svg") and os.path.exists(filepaths[0])
+
+
+def test_metric_counts():
+    for graph_builder_cls in [GraphBuilder, CompactGraphBuilder]:
+        graph = graph_builder_cls((1, 2, 3, 4))
+        graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), False)
+        graph.explore_operation((3, 3, 4), "3*4=12", (3, 12), False)
+        graph.explore_operation((3, 12), "12/3*6=24", (24,), False)
+        # setting a subgoal on an existing edge overwrites its operation
+        graph.set_subgoal((3, 12), state_after_subgoal=(24,))
+        graph.set_subgoal((3, 3, 4), state_after_subgoal=(3, 12))
+        assert check_metric_counts(graph) == []
+        assert graph.get_metrics()["n_subgoals"] == 2
+        assert graph.metric_counts["/"] == 1
+
+    graph_copy = graph.copy()
+    graph_copy.explore_operation((1, 2, 3, 4), "4-1=3", (2, 3, 3), False)
+    assert graph_copy.get_metrics()["n_nodes"] == graph.get_metrics()["n_nodes"] + 1
+    assert check_metric_counts(graph.view(remove_subgoals=True)) == []
+
+
+def test_snapshots():
+    for graph_builder_cls in [GraphBuilder, CompactGraphBuilder]:
+        graph = graph_builder_cls((1, 2, 3, 4))
+        graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), False)
+        graph.explore_operation((3, 3, 4), "3*4=12", (3, 12), False)
+        graph.move_to_node((1, 2, 3, 4))
+        graph.explore_operation((1, 2, 3, 4), "(1+3)*2=8", (4, 8), False)
+        graph.set_subgoal((3, 12), state_after_subgoal=(24,))
+
+        assert graph.get_action_op_timesteps() == [0, 1, 2, 2, 4, 5]
+        assert set(graph.snapshot(n_actions=2).G.nodes) == {(1, 2, 3, 4), (3, 3, 4), (3, 12), (24,)}
+        # the action with two sub-operations is only included once both fit
+        assert graph.snapshot(n_operations=3).get_metrics()["n_edges"] == 2
+        assert graph.snapshot(fraction=0.8).get_metrics()["n_edges"] == 4
+        assert type(graph.snapshot(fraction=0.5)) is graph_builder_cls
+
+        full_graph = graph.snapshot(n_actions=len(graph.actions) - 1)
+        assert nx.utils.graphs_equal(full_graph.G, graph.G)
+        assert full_graph.actions == graph.actions
+        assert full_graph.op_timestep == graph.op_timestep
+
+    growth_curves = get_growth_curves([graph, "Error running code"])
+    assert growth_curves["n_edges"].tolist() == [0, 1, 2, 2, 4, 5]
+    assert growth_curves["n_subgoals"].iloc[-1] == 1
+    with pytest.raises(ValueError):
+        graph.snapshot(n_actions=1, fraction=0.5)
+
+
+def test_search_metrics():
+    graph = GraphBuilder((1, 2, 3, 4))
+    graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), False)
+    graph.move_to_node((3, 3, 4))
+    graph.explore_operation((3, 3, 4), "3*4=12", (3, 12), False)
+    graph.explore_operation((3, 3, 4), "3+3=6", (4, 6), False)
+    graph.move_to_node((1, 2, 3, 4))
+    graph.explore_operation((1, 2, 3, 4), "4-1=3", (2, 3, 3), False)
+    graph.move_to_node((3, 3, 4))
+
+    short_graph = GraphBuilder((1, 2, 3, 4))
+    short_graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), False)
+
+    table = build_event_table([graph, "Error running code", short_graph], trial_ids=[5, 6, 7])
+    df = compute_search_metrics(table)
+    assert df.index.tolist() == [5, 7]
+    assert df.loc[5, "n_moves"] == 3
+    # moving back up to the start abandons a branch, moving down to a known state again doesn't
+    assert df.loc[5, "n_backtracks"] == 1
+    assert df.loc[5, "n_revisits"] == 2
+    assert df.loc[5, "max_depth"] == 2
+    assert df.loc[5, "depth_first_ratio"] == 1 / 3
+    assert df.loc[5, "breadth_first_ratio"] == 1 / 3
+    assert df.loc[7, "max_depth"] == 1
+    assert pd.isna(df.loc[7, "depth_first_ratio"])
+
+
+def test_state_space():
+    space = CountdownStateSpace((4, 3, 2, 1))
+    assert space.start_state == (1, 2, 3, 4)
+    assert space.is_solvable() and space.distance_to_target() == 3
+    assert not CountdownStateSpace((1, 1, 1, 1)).is_solvable()
+    # 8/(3-8/3) needs exact fractions
+    assert CountdownStateSpace((3, 3, 8, 8)).is_solvable()
+    assert ("12/3=4", (4,)) in space.successors((3, 12))
+    assert space.distance_to_target((4, 6)) == 1
+    assert space.can_reach((1, 2, 3, 4), (4, 6)) and not space.can_reach((1, 2, 3, 4), (5, 7))
+    assert len(space.reachable_states((2, 12))) == 7
+
+    # more numbers and other targets
+    space = CountdownStateSpace((25, 50, 75, 100, 3, 6), target=952)
+    assert space.distance_to_target() == 5
+    assert CountdownStateSpace((1, 3, 4, 6, 7), target=24, use_all_numbers=False).distance_to_target() == 1
+
+    for graph_builder_cls in [GraphBuilder, CompactGraphBuilder]:
+        graph = graph_builder_cls((2, 5, 7, 9, 11), target=100)
+        assert graph.goal_state == (100,) and (100,) in graph.G.nodes
+        graph.explore_operation((2, 5, 7, 9, 11), "9*11=99", (2, 5, 7, 99), False)
+        graph.set_subgoal((1, 99))
+        assert graph.actions[-1]["state_after_subgoal"] == (100,)
+        assert check_metric_counts(graph) == []
+        assert check_graph(graph, graph.state_space) == []
+        graph.set_subgoal((98,), state_after_subgoal=(1, 99))
+        assert len(check_graph(graph, graph.state_space)) == 1
+        assert check_graph(graph) == []
+    assert GraphBuilder.from_bytes(graph.to_bytes()).target == 100
+
+
+def test_state_oracle(tmp_path):
+    StateOracle(build_state_oracle([(1, 2, 3, 4), (4, 4, 7, 7)])).save(tmp_path)
+    oracle = StateOracle.load(tmp_path)
+    space = CountdownStateSpace((1, 2, 3, 4))
+    assert len(oracle) > len(space.reachable_states())
+    assert oracle.is_solvable((4, 6)) and not oracle.is_solvable((28, 49))
+    assert oracle.distance_to_target((4, 1, 3, 2)) == 3
+    assert oracle.distance_to_target((24,)) == 0
+    assert sorted(oracle.successors((3, 12))) == sorted(space.successors((3, 12)))
+    assert oracle.get_successor((3, 4, 6), "4*3=12") == (6, 12)
+    assert oracle.get_successor((3, 4, 6), "4*3=13") is None
+    # states that aren't in the oracle fall back to the state space
+    assert oracle.index((3, 3, 8, 8)) is None and oracle.is_solvable((3, 3, 8, 8))
+    assert oracle.lookup([(4, 6), (5, 5, 5, 123456789)]).tolist()[1] == -1
+
+    graph = GraphBuilder((1, 2, 3, 4))
+    graph.explore_operation((1, 2, 3, 4), "1+2=3", (3, 3, 4), False)
+    graph.explore_operation((1, 2, 3, 4), "4*3=12", (1, 2, 13), False)
+    graph.explore_operation((1, 2, 3, 4), "4-1=3", (2, 3, 3), False)
+    assert check_graph(graph, oracle) == check_graph(graph)
+    assert len(check_graph(graph, oracle)) == 1
+
+    df = compute_solvability_metrics(build_event_table([graph]), oracle)
+    # (3, 3, 4) and (1, 2, 13) can make 24, (2, 3, 3) can't
+    assert df.loc[0, "fraction_solvable_operations"] == 2 / 3
+    assert df.loc[0, "n_dead_end_operations"] == 1